@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Admission control for the API.
+A bounded number of pipeline runs at a time, a bounded wait queue behind them, and
+load shedding based on recent stage timings: a request that could not finish before
+its deadline is turned away immediately with a Retry-After instead of timing out later.
+"""
+
+import math
+import time
+import threading
+
+from cancellation import Cancelled
+
+# How often a waiting request checks whether its cancellation token has fired (seconds)
+CANCEL_POLL_S = 0.25
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted."""
+
+    def __init__(self, status_code, code, message, retry_after):
+        """
+        Describe the rejection.
+
+        Args:
+            status_code: 429 (estimated wait too long) or 503 (queue full or wait timed out)
+            code: Error code for the client
+            message: Error message
+            retry_after: Seconds the client should wait before retrying
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency gate with a bounded FIFO wait queue and EWMA-based wait estimates."""
+
+    def __init__(self, max_concurrent=2, max_queue=8, deadline=50.0, alpha=0.2):
+        """
+        Initialise an empty gate.
+
+        Args:
+            max_concurrent: Pipeline runs allowed at the same time
+            max_queue: Requests allowed to wait for a slot (beyond that they are rejected with 503)
+            deadline: Seconds a request may take from arrival to response (queue wait + service);
+                requests estimated to take longer are rejected with 429
+            alpha: Weight of the newest sample in the stage time averages
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.deadline = deadline
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._running = 0
+        self._waiting = [] # tickets in arrival order; the head is admitted first
+        self._stage_times = {} # stage name -> exponentially weighted moving average, seconds
+
+        # counters for monitoring
+        self.stats = {
+            'admitted': 0,
+            'rejected_busy': 0, # 429, estimated to miss the deadline
+            'rejected_full': 0, # 503, queue full or no slot in time
+            'cancelled': 0, # left the queue when the request's token fired (deadline, client gone)
+            'completed': 0
+        }
+
+    def estimated_service_time(self):
+        """
+        Expected time of one pipeline run from the stage averages.
+
+        Returns:
+            Seconds, or None before the first run has been recorded
+        """
+        with self._lock:
+            return self._service_time()
+
+    def _service_time(self):
+        """Sum of the stage averages (lock must be held)."""
+        if not self._stage_times:
+            return None
+        return sum(self._stage_times.values())
+
+    def _estimated_wait(self, position):
+        """
+        Expected queue wait for a request with position requests waiting ahead of it (lock must be held).
+        Every slot frees up about once per service time, so the queue drains max_concurrent at a time.
+        """
+        if self._running < self.max_concurrent and position == 0:
+            return 0.0
+        service = self._service_time()
+        if service is None:
+            return 0.0
+        return (position + 1) / self.max_concurrent * service
+
+    def acquire(self, cancel_token=None):
+        """
+        Wait for a slot, or reject the request.
+
+        Args:
+            cancel_token: The request's CancellationToken. Its remaining time (counted from the
+                request's arrival, not from this call) is what the estimated wait is checked against
+                and the longest the request waits, and the request leaves the queue as soon as the
+                token fires. None = the gate's own deadline, counted from this call
+
+        Returns:
+            dictionary (the ticket to pass to release()) with:
+                queue_depth (int): Requests running or waiting when this one arrived
+                queued_time (float): Seconds spent waiting for the slot
+
+        Raises:
+            AdmissionRejected: Queue full, estimated to miss the deadline, or no slot in time
+            Cancelled: The token fired before a slot was free
+        """
+        arrived = time.time()
+        if cancel_token is not None:
+            cancel_token.check('admission')
+            budget = cancel_token.remaining()
+        else:
+            budget = self.deadline or None
+
+        with self._lock:
+            position = len(self._waiting)
+            queue_depth = self._running + position
+            wait = self._estimated_wait(position)
+            service = self._service_time() or 0.0
+
+            if position >= self.max_queue and self._running >= self.max_concurrent:
+                self.stats['rejected_full'] += 1
+                raise AdmissionRejected(
+                    503, 'SERVER_BUSY',
+                    "Server is at capacity. Please retry shortly.",
+                    retry_after=self._retry_after(wait)
+                )
+
+            if budget is not None and wait + service > budget:
+                self.stats['rejected_busy'] += 1
+                raise AdmissionRejected(
+                    429, 'TOO_MANY_REQUESTS',
+                    f"Estimated wait of {wait:.0f}s exceeds the deadline. Please retry later.",
+                    retry_after=self._retry_after(wait)
+                )
+
+            ticket = {'queue_depth': queue_depth, 'queued_time': 0.0}
+            self._waiting.append(ticket)
+
+            # first come, first served: only the head of the queue takes a free slot
+            while self._running >= self.max_concurrent or self._waiting[0] is not ticket:
+                if cancel_token is not None:
+                    if cancel_token.cancelled:
+                        self._leave(ticket)
+                        self.stats['cancelled'] += 1
+                        raise Cancelled(cancel_token.reason, 'admission')
+                    # the token can fire from outside (client gone), so it is polled
+                    remaining = cancel_token.remaining()
+                    self._slot_freed.wait(CANCEL_POLL_S if remaining is None else min(remaining, CANCEL_POLL_S))
+                    continue
+
+                remaining = (budget - (time.time() - arrived)) if budget else None
+                if remaining is not None and remaining <= 0:
+                    self._leave(ticket)
+                    self.stats['rejected_full'] += 1
+                    raise AdmissionRejected(
+                        503, 'SERVER_BUSY',
+                        "Timed out waiting for a processing slot. Please retry shortly.",
+                        retry_after=self._retry_after(self._estimated_wait(len(self._waiting)))
+                    )
+                self._slot_freed.wait(remaining)
+
+            self._waiting.pop(0)
+            self._running += 1
+            self.stats['admitted'] += 1
+            self._slot_freed.notify_all() # the new head may also find a free slot
+
+        ticket['queued_time'] = time.time() - arrived
+        return ticket
+
+    def _leave(self, ticket):
+        """Take a waiting ticket out of the queue (lock must be held)."""
+        self._waiting.remove(ticket)
+        self._slot_freed.notify_all() # the next in line may be the head now
+
+    def release(self, ticket, stage_times=None):
+        """
+        Free the slot of an admitted request.
+
+        Args:
+            ticket: Dict returned by acquire()
+            stage_times: Dict of stage name -> seconds for a completed pipeline run, folded
+                into the averages (None for failed or atypical runs)
+        """
+        with self._lock:
+            self._running -= 1
+            self.stats['completed'] += 1
+
+            for stage, seconds in (stage_times or {}).items():
+                previous = self._stage_times.get(stage)
+                self._stage_times[stage] = seconds if previous is None else (
+                    self.alpha * seconds + (1 - self.alpha) * previous
+                )
+
+            self._slot_freed.notify_all()
+
+    def _retry_after(self, wait):
+        """Whole seconds for the Retry-After header (at least 1)."""
+        return max(1, int(math.ceil(wait)))
+
+    def get_stats(self):
+        """
+        Snapshot of the gate.
+
+        Returns:
+            Dictionary with running, queue_depth (waiting), limits, stage averages, the
+            estimated wait for a new request and the counters
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['running'] = self._running
+            stats['queue_depth'] = len(self._waiting)
+            stats['max_concurrent'] = self.max_concurrent
+            stats['max_queue'] = self.max_queue
+            stats['deadline'] = self.deadline
+            stats['stage_times'] = {stage: round(seconds, 3) for stage, seconds in self._stage_times.items()}
+            stats['estimated_wait'] = round(self._estimated_wait(len(self._waiting)), 3)
+        return stats
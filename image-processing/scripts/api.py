@@ -7,43 +7,192 @@ Allows Node.js server to call Python pipeline via HTTP requests.
 
 import os
 import re
+import json
+import hashlib
+import asyncio
 import time
 import uuid
+import socket
 import logging
 from enum import Enum
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import List, Optional
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
-from image_analyser import analyse_image
 from pipeline import ImageProcessingPipeline
+from pipeline_utils import cleanup_temp_files
+from compression import negotiate_encoding, iter_file, compress_chunks, NegotiatedGZipMiddleware
+from admission import AdmissionController, AdmissionRejected
+from cancellation import CancellationToken, Cancelled, DEADLINE_EXCEEDED, CLIENT_DISCONNECTED, LEASE_LOST
+from metrics import REGISTRY, CONTENT_TYPE, Counter, CallbackMetric
+from profiling import run_profiled, ProfilerBusy
+from cache import LRUCache, SingleFlight
+from structured_logging import setup_logging, bind_request, update_request, reset_request
+from notifier import CallbackNotifier, parse_target
+from job_queue import JobQueue, QUEUED
 
 # Base directory and models directory definition
 BASE_DIR = Path(__file__).parent
 MODELS_DIR = os.getenv("MODELS_DIR", str(BASE_DIR / "../models"))
 
+# Memory budget for loaded style models; least recently used styles are evicted beyond this (0 = unbounded)
+MODEL_CACHE_MAX_MB = int(os.getenv("MODEL_CACHE_MAX_MB", "0"))
+
+# Bounds on every generated SVG, so dense photos can't produce drawings too big for the editor (0 = off)
+SVG_MAX_PATHS = int(os.getenv("SVG_MAX_PATHS", "0"))
+SVG_MAX_NODES = int(os.getenv("SVG_MAX_NODES", "0"))
+SVG_MIN_AREA = float(os.getenv("SVG_MIN_AREA", "0"))
+
+# Outline tracer: 'cli' (potrace binary), 'potracer' (in process, no subprocess) or 'auto'
+TRACE_BACKEND = os.getenv("TRACE_BACKEND", "auto")
+
+# Memory kept for the preprocessed inputs of recent jobs, so /refine-region can re-render part of a drawing (0 = off)
+JOB_CACHE_MAX_MB = int(os.getenv("JOB_CACHE_MAX_MB", "256"))
+
+# Admission control: pipeline runs at a time, requests allowed to wait for one, and the time budget
+# per request (queue wait + processing) beyond which requests are shed with 429/503 (Node gives up at 60s)
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "8"))
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "50"))
+
+# Staged pipeline: workers per stage (threads for model inference, which releases the GIL; worker
+# processes for analysis and tracing, which are GIL-bound Python; 0 = run the stage inline) and the
+# items allowed to wait for each stage before the request handing work to it blocks
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "1"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(MAX_CONCURRENT_JOBS)))
+TRACING_WORKERS = int(os.getenv("TRACING_WORKERS", str(MAX_CONCURRENT_JOBS)))
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", str(2 * MAX_CONCURRENT_JOBS)))
+
+# How often a running request checks whether its client has disconnected (seconds)
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.5"))
+
+# Memory kept for per-request profiles (the 'profile' field of /generate-svg); 0 = profiling disabled
+PROFILE_CACHE_MAX_MB = int(os.getenv("PROFILE_CACHE_MAX_MB", "0"))
+
+# Identical /generate-svg requests (same image bytes and options) arriving while one of them is running
+# share its result instead of running the pipeline again ('0' = off)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") != "0"
+
+# Completion callbacks (the callback_url field): deliveries tried per callback, seconds per attempt,
+# key for the X-Signature HMAC of the body (empty = unsigned), hosts callbacks may go to
+# (comma-separated; empty = only hosts resolving to public addresses) and the directory Unix socket
+# callbacks may use (empty = no Unix socket callbacks)
+CALLBACK_MAX_ATTEMPTS = int(os.getenv("CALLBACK_MAX_ATTEMPTS", "5"))
+CALLBACK_TIMEOUT_S = float(os.getenv("CALLBACK_TIMEOUT_S", "10"))
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET", "")
+CALLBACK_ALLOWED_HOSTS = {host.strip() for host in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+CALLBACK_SOCKET_DIR = os.getenv("CALLBACK_SOCKET_DIR", "")
+
+# Durable queue for callback jobs: SQLite file the accepted jobs are stored in, so they survive a crash
+# or restart (empty = off; callback jobs then only live in memory), jobs run at the same time, seconds a
+# running job's lease lasts without a heartbeat, claims per job and hours finished jobs are kept
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "")
+JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", str(MAX_CONCURRENT_JOBS)))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_H = float(os.getenv("JOB_RETENTION_H", "24"))
+
+# How often idle queue consumers look for due jobs (retries, jobs enqueued by another process), and the
+# delay before retrying a job that failed with a server error (doubled per attempt)
+JOB_POLL_S = 1.0
+JOB_RETRY_BASE_S = 2.0
+
+# Log file rotation: size at which logs/api.log is rotated and how many old files are kept
+LOG_MAX_MB = int(os.getenv("LOG_MAX_MB", "10"))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
 # Logging in order to track API usage and errors
 LOG_FILE = BASE_DIR / "../logs/api.log" # setting up file path
-LOG_FILE.parent.mkdir(parents=True, exist_ok=True) # ensure logs directory exists
-
-logging.basicConfig(
-    level=logging.INFO, # logging info is used to track normal operations, warnings for potential issues, and errors for exceptions
-    format='%(asctime)s - %(levelname)s - %(message)s', # time, log level, and message format
-    handlers=[
-        logging.StreamHandler(),            # handler to log to the terminal
-        logging.FileHandler(LOG_FILE)       # handler to log to the log file
-    ]
-)
 logger = logging.getLogger(__name__) # initialises logger
 
+UPLOAD_DIR = BASE_DIR / "../temp/uploads" # Temporary directory for uploaded files
+
+
+def configure_logging():
+    """Start the log writer (once per process; later calls keep the first setup)."""
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True) # ensure logs directory exists
+
+    # request threads only enqueue records; a background thread writes JSON lines to the file and text to the terminal
+    setup_logging(
+        LOG_FILE,
+        level=logging.INFO, # logging info is used to track normal operations, warnings for potential issues, and errors for exceptions
+        max_bytes=LOG_MAX_MB * 1024 * 1024,
+        backup_count=LOG_BACKUP_COUNT
+    )
+
+
+def start_service():
+    """Set up logging, the temp directory, the pipeline, the callback sender and the job queue."""
+    global pipeline, notifier, job_queue
+
+    configure_logging()
+    logger.info(f"Models directory: {MODELS_DIR}")
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Initialising the image-processing pipeline
+    pipeline = ImageProcessingPipeline(
+        models_dir=MODELS_DIR,
+        model_cache_bytes=MODEL_CACHE_MAX_MB * 1024 * 1024 if MODEL_CACHE_MAX_MB > 0 else None,
+        optimize_options={
+            'max_paths': SVG_MAX_PATHS or None,
+            'max_nodes': SVG_MAX_NODES or None,
+            'min_area': SVG_MIN_AREA
+        },
+        trace_backend=TRACE_BACKEND,
+        job_cache_bytes=JOB_CACHE_MAX_MB * 1024 * 1024,
+        workers_per_stage={
+            'analysis': ANALYSIS_WORKERS,
+            'inference': INFERENCE_WORKERS,
+            'tracing': TRACING_WORKERS
+        },
+        stage_queue_size=STAGE_QUEUE_SIZE
+    )
+
+    notifier = CallbackNotifier(
+        max_attempts=CALLBACK_MAX_ATTEMPTS, timeout=CALLBACK_TIMEOUT_S, secret=CALLBACK_SECRET or None,
+        allowed_hosts=CALLBACK_ALLOWED_HOSTS, socket_dir=CALLBACK_SOCKET_DIR or None
+    )
+
+    job_queue = JobQueue(
+        JOB_QUEUE_PATH,
+        lease_s=JOB_LEASE_S,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        retention_s=JOB_RETENTION_H * 3600
+    ) if JOB_QUEUE_PATH else None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Build the service on startup and stop it on shutdown.
+    Importing this module has no side effects: the stage worker processes are spawned and
+    re-import it (as __mp_main__ under `python api.py`), and must not open their own log file,
+    pipeline or job queue.
+    """
+    start_service()
+    if job_queue is not None:
+        start_job_queue()
+    try:
+        yield
+    finally:
+        if job_queue is not None:
+            await stop_job_queue()
+        await run_in_threadpool(pipeline.shutdown)
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Image to SVG API",
     description="Convert photos to editable SVG line art",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -58,11 +207,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = BASE_DIR / "../temp/uploads" # Temporary directory for uploaded files
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Compress JSON responses for clients that accept gzip, q-values included (streamed SVGs negotiate
+# their own encoding, gzip or brotli)
+app.add_middleware(NegotiatedGZipMiddleware, minimum_size=1024)
 
-# Initialising the image-processing pipeline
-pipeline = ImageProcessingPipeline(models_dir=MODELS_DIR)
+# The image-processing pipeline, built by start_service()
+pipeline = None
 
 # File size limit (20MB)
 MAX_FILE_SIZE = 20 * 1024 * 1024
@@ -72,6 +222,122 @@ class StyleOption(str, Enum):
     contour = "contour"
     anime = "anime"
 
+# Latency budget for inference - picks the model input resolution
+class QualityOption(str, Enum):
+    fast = "fast"
+    balanced = "balanced"
+    high = "high"
+
+# How line art is traced: filled stroke outlines (Potrace) or stroked centerlines
+class TraceMode(str, Enum):
+    outline = "outline"
+    centerline = "centerline"
+
+# What /generate-svg returns: the SVG markup, the structured path list, or both
+class OutputFormat(str, Enum):
+    svg = "svg"
+    paths = "paths"
+    svg_paths = "svg+paths"
+
+# Profiler for a debug run of /generate-svg: Python call tree or torch operator trace
+class ProfileKind(str, Enum):
+    cprofile = "cprofile"
+    torch = "torch"
+
+# Bounded concurrency + wait queue for the pipeline; the queue depth also drives the sizing policy
+admission = AdmissionController(
+    max_concurrent=MAX_CONCURRENT_JOBS,
+    max_queue=MAX_QUEUED_JOBS,
+    deadline=REQUEST_DEADLINE_S
+)
+
+# Captured profiles by request id, served by GET /profiles/{id}
+profiles = LRUCache(PROFILE_CACHE_MAX_MB * 1024 * 1024, size_of=lambda profile: len(profile['body']))
+
+# /generate-svg runs in flight by coalesce_key(), joined by identical requests
+flights = SingleFlight()
+
+# Sends the results of jobs submitted with a callback_url (built by start_service()); without the
+# job queue, the jobs themselves run as background tasks
+notifier = None
+background_jobs = set()
+
+# Callback jobs stored before their 202 and run by queue consumers (JOB_QUEUE_PATH, opened by
+# start_service()); None = off
+job_queue = None
+jobs_available = asyncio.Event() # set on enqueue, wakes idle consumers
+queue_consumers = [] # (owner id, task)
+
+
+def cache_samples(field):
+    """One sample per cache (loaded models, refinement jobs) of a cache stats field."""
+    return [
+        ({'cache': 'model'}, pipeline.lineart_generator.get_cache_stats()[field]),
+        ({'cache': 'job'}, pipeline.job_cache.get_stats()[field])
+    ]
+
+
+# Prometheus metrics for GET /metrics; the pipeline records its own per-stage latency histogram
+REQUESTS = REGISTRY.register(Counter('api_requests', 'Requests per endpoint and style.', ('endpoint', 'style')))
+ERRORS = REGISTRY.register(Counter('api_errors', 'Error responses by error code.', ('code',)))
+REGISTRY.register(CallbackMetric(
+    'api_callbacks', 'Completion callbacks by outcome (delivered, or failed after every retry).', 'counter',
+    lambda: [({'outcome': outcome}, notifier.get_stats()[outcome]) for outcome in ('delivered', 'failed')]
+))
+REGISTRY.register(CallbackMetric(
+    'api_callback_retries', 'Callback deliveries retried after a failed attempt.', 'counter',
+    lambda: [({}, notifier.get_stats()['retries'])]
+))
+REGISTRY.register(CallbackMetric(
+    'api_callbacks_pending', 'Callbacks waiting to be sent or retried.', 'gauge',
+    lambda: [({}, notifier.get_stats()['pending'])]
+))
+REGISTRY.register(CallbackMetric(
+    'api_callback_jobs_running', 'Jobs accepted with a callback_url that are still processing.', 'gauge',
+    lambda: [({}, len(background_jobs))]
+))
+REGISTRY.register(CallbackMetric(
+    'api_job_queue_jobs', 'Jobs in the durable job queue by state.', 'gauge',
+    lambda: [({'state': state}, count) for state, count in job_queue.get_stats().items() if state != 'pending_writes']
+    if job_queue is not None else []
+))
+COALESCED = REGISTRY.register(Counter(
+    'api_coalesced_requests', 'Requests answered with the result of an identical request already in flight.', ('endpoint',)
+))
+REGISTRY.register(CallbackMetric(
+    'api_jobs_in_flight', 'Pipeline runs in progress.', 'gauge',
+    lambda: [({}, admission.get_stats()['running'])]
+))
+REGISTRY.register(CallbackMetric(
+    'api_queue_depth', 'Requests waiting for a pipeline slot.', 'gauge',
+    lambda: [({}, admission.get_stats()['queue_depth'])]
+))
+REGISTRY.register(CallbackMetric(
+    'api_cache_resident_bytes', 'Estimated memory held by each cache (model = loaded style models).', 'gauge',
+    lambda: cache_samples('resident_bytes')
+))
+REGISTRY.register(CallbackMetric('api_cache_hits', 'Cache lookups that found an entry.', 'counter', lambda: cache_samples('hits')))
+REGISTRY.register(CallbackMetric('api_cache_misses', 'Cache lookups that found nothing.', 'counter', lambda: cache_samples('misses')))
+REGISTRY.register(CallbackMetric('api_cache_evictions', 'Entries evicted to stay within budget.', 'counter', lambda: cache_samples('evictions')))
+
+
+def stage_samples(field):
+    """Samples of one Stage.get_stats() field, labelled by stage."""
+    return [({'stage': name}, stats[field]) for name, stats in pipeline.get_stage_stats().items()]
+
+
+REGISTRY.register(CallbackMetric('pipeline_stage_workers', 'Workers of each offloaded pipeline stage.', 'gauge', lambda: stage_samples('workers')))
+REGISTRY.register(CallbackMetric('pipeline_stage_busy_workers', 'Stage workers running an item.', 'gauge', lambda: stage_samples('busy')))
+REGISTRY.register(CallbackMetric('pipeline_stage_queue_depth', 'Items waiting for a stage worker.', 'gauge', lambda: stage_samples('queue_depth')))
+REGISTRY.register(CallbackMetric(
+    'pipeline_stage_busy_seconds', 'Worker time spent on items (rate / workers = utilisation).', 'counter',
+    lambda: stage_samples('busy_seconds')
+))
+REGISTRY.register(CallbackMetric(
+    'pipeline_stage_utilisation', 'Share of stage worker time spent busy since startup (0-1).', 'gauge',
+    lambda: stage_samples('utilisation')
+))
+
 # Valid image types (magic bytes)
 # Looking at the first few bytes of image files
 VALID_IMAGE_SIGNATURES = {
@@ -126,6 +392,7 @@ def create_error_response(message: str, code: str = "PROCESSING_ERROR"):
     Returns:
         Structured error dict
     """
+    ERRORS.inc(code=code)
     return {
         "success": False,
         "data": None,
@@ -137,6 +404,627 @@ def create_error_response(message: str, code: str = "PROCESSING_ERROR"):
     }
 
 
+def read_svg(svg_path):
+    """
+    Read a generated SVG and strip the potrace metadata block.
+
+    Args:
+        svg_path: Path to SVG file
+
+    Returns:
+        SVG content string
+    """
+    with open(svg_path, 'r') as f:
+        svg_content = f.read()
+
+    # Potrace version info and processing parameters are not needed by the client and add unnecessary size
+    return re.sub(r'<metadata>.*?</metadata>\n?', '', svg_content, flags=re.DOTALL)
+
+
+def build_style_metrics(result):
+    """
+    Per-style timing and size metrics for the response.
+
+    Args:
+        result: Single-style pipeline result
+
+    Returns:
+        Metrics dict in milliseconds
+    """
+    return {
+        "lineart_time_ms": int(result['metrics']['lineart_time'] * 1000),
+        "vectorization_time_ms": int(result['metrics']['vectorization_time'] * 1000),
+        "path_count": result['metrics']['path_count'],
+        "file_size_kb": result['metrics']['file_size_kb'],
+        "svg_bytes_saved": result['metrics'].get('svg_bytes_saved'),
+        "input_size": result['metrics'].get('input_size'),
+        "trace_mode": result['metrics'].get('trace_mode'),
+        "optimization": result['metrics'].get('optimization')
+    }
+
+
+async def admit_request(cancel_token):
+    """
+    Take a pipeline slot, waiting in the queue if needed (in a pool thread, the event loop stays free).
+
+    Args:
+        cancel_token: The request's CancellationToken; the wait ends when it fires
+
+    Returns:
+        Ticket from AdmissionController.acquire()
+
+    Raises:
+        HTTPException: 429 or 503 with Retry-After when the request is shed, 504 or 499 when its
+            token fired while it waited
+    """
+    acquiring = asyncio.ensure_future(run_in_threadpool(admission.acquire, cancel_token))
+    try:
+        return await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # this coroutine was cancelled (e.g. a queue consumer on shutdown), but the pool thread
+        # can't be: make it leave the queue, and give back the slot if it took one first
+        cancel_token.cancel()
+        acquiring.add_done_callback(release_unclaimed)
+        raise
+    except Cancelled:
+        raise cancelled_exception(cancel_token)
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected ({e.status_code}): {e.message}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=create_error_response(e.message, e.code),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+def release_unclaimed(acquiring):
+    """Done callback of an acquire nobody is waiting for any more: release the slot it got, if any."""
+    if not acquiring.cancelled() and acquiring.exception() is None:
+        admission.release(acquiring.result())
+
+
+def start_cancel_token(request):
+    """
+    Cancellation token for a request: it expires at the request's deadline and is cancelled
+    when the client disconnects, so the pipeline stops instead of finishing for nobody.
+    The deadline is REQUEST_DEADLINE_S, or the caller's own timeout from the
+    X-Request-Timeout-Ms header if that is shorter.
+
+    Args:
+        request: Incoming request (called from an async endpoint, on the event loop)
+
+    Returns:
+        tuple: (CancellationToken, function that stops watching for a disconnect)
+    """
+    budget = REQUEST_DEADLINE_S or None
+    try:
+        client_timeout = float(request.headers.get("x-request-timeout-ms", "")) / 1000
+        if client_timeout > 0:
+            budget = min(budget, client_timeout) if budget else client_timeout
+    except ValueError:
+        pass
+
+    cancel_token = CancellationToken(timeout=budget)
+
+    async def watch():
+        while not cancel_token.cancelled:
+            if await request.is_disconnected():
+                cancel_token.cancel(CLIENT_DISCONNECTED)
+                return
+            await asyncio.sleep(DISCONNECT_POLL_S)
+
+    watcher = asyncio.create_task(watch())
+    return cancel_token, watcher.cancel
+
+
+def cancelled_exception(cancel_token):
+    """
+    Error response for a request stopped by its cancellation token.
+
+    Args:
+        cancel_token: The request's CancellationToken (cancelled)
+
+    Returns:
+        HTTPException: 504 when the deadline passed, 499 when the client went away
+    """
+    if cancel_token.reason == DEADLINE_EXCEEDED:
+        logger.warning("Request stopped: deadline exceeded")
+        return HTTPException(
+            status_code=504,
+            detail=create_error_response("Processing did not finish before the deadline.", "DEADLINE_EXCEEDED")
+        )
+
+    # nobody reads this one; 499 keeps it apart from real failures in the access log
+    logger.info(f"Request stopped: {cancel_token.reason}")
+    return HTTPException(
+        status_code=499,
+        detail=create_error_response("Client closed the request.", "CLIENT_CLOSED_REQUEST")
+    )
+
+
+def coalesce_key(file_bytes, spec):
+    """
+    Identity of a /generate-svg run: requests with the same key would produce the same result.
+
+    Args:
+        file_bytes: Uploaded image
+        spec: Request options (see generate_svg())
+
+    Returns:
+        Key string (content hash + options)
+    """
+    options = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+    return f"{hashlib.sha256(file_bytes).hexdigest()}:{options}"
+
+
+async def join_in_flight(future, cancel_token):
+    """
+    Wait for the outcome of an identical request that is already running.
+    This request holds no pipeline slot meanwhile, but its own deadline and disconnect still apply.
+
+    Args:
+        future: Future from flights.claim()
+        cancel_token: This request's CancellationToken
+
+    Returns:
+        The running request's outcome (see svg_response()), or None if that request was abandoned
+        (client gone or out of time) and this one should run itself
+
+    Raises:
+        HTTPException: The running request failed (same error), or this request was cancelled
+    """
+    shared = asyncio.wrap_future(future)
+    while not shared.done():
+        if cancel_token.cancelled:
+            raise cancelled_exception(cancel_token)
+        await asyncio.wait({shared}, timeout=DISCONNECT_POLL_S)
+
+    error = shared.exception()
+    if error is None:
+        return shared.result()
+
+    # a stop that belongs to the other request (its client left, its deadline passed) isn't this one's
+    if not isinstance(error, HTTPException) or error.status_code in (499, 504):
+        return None
+    raise HTTPException(status_code=error.status_code, detail=error.detail, headers=error.headers)
+
+def start_background(job):
+    """
+    Run a coroutine after the response has been sent, keeping a reference until it is done
+    (the event loop only holds tasks weakly).
+
+    Args:
+        job: Coroutine
+    """
+    task = asyncio.create_task(job)
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+
+async def job_outcome(request_id, job):
+    """
+    Run a callback job and turn its response (or error) into the callback payload.
+    The callback carries the same JSON envelope a synchronous request would have got.
+
+    Args:
+        request_id: Id returned in the 202
+        job: Coroutine producing the JSON response (see generate_svg())
+
+    Returns:
+        dict with request_id, status (complete or failed), status_code, retry_after and the envelope
+    """
+    retry_after = None
+    try:
+        response = await job
+        status_code, envelope = response.status_code, json.loads(response.body)
+    except HTTPException as e:
+        status_code, envelope = e.status_code, e.detail
+        retry_after = (e.headers or {}).get("Retry-After")
+    except Exception as e:
+        logger.error(f"Callback job error: {str(e)}", exc_info=True)
+        status_code, envelope = 500, create_error_response("Internal processing error")
+
+    return {
+        "request_id": request_id,
+        "status": "complete" if status_code == 200 else "failed",
+        "status_code": status_code,
+        "retry_after": int(retry_after) if retry_after else None, # set when the job was shed
+        **envelope
+    }
+
+
+def send_callback(callback_url, payload, queued=False):
+    """
+    Queue the POST of a job's outcome.
+
+    Args:
+        callback_url: Target checked by parse_target()
+        payload: Callback body (see job_outcome())
+        queued: The job is in the job queue; it is marked notified once the callback is done with,
+            so it isn't resent after a restart
+    """
+    request_id = payload['request_id']
+
+    def delivered(ok, attempts, error):
+        if ok:
+            logger.info(f"Callback for {request_id} delivered (attempt {attempts})")
+        if queued:
+            job_queue.mark_notified(request_id)
+
+    notifier.notify(callback_url, payload, on_done=delivered)
+
+
+async def run_for_callback(callback_url, request_id, job):
+    """
+    Run a job accepted with a callback URL (without the job queue) and queue the POST of its outcome.
+
+    Args:
+        callback_url: Target checked by parse_target()
+        request_id: Id returned in the 202
+        job: Coroutine producing the JSON response (see generate_svg())
+    """
+    send_callback(callback_url, await job_outcome(request_id, job))
+
+
+def start_job_queue():
+    """Resend the callbacks a previous process didn't get to, and start the queue consumers."""
+    for job in job_queue.unnotified():
+        logger.info(f"Resending callback for {job['id']}")
+        send_callback(job['callback_url'], job['result'], queued=True)
+
+    for i in range(max(1, JOB_QUEUE_WORKERS)):
+        owner = f"{socket.gethostname()}:{os.getpid()}:{i}"
+        queue_consumers.append((owner, asyncio.create_task(consume_jobs(owner))))
+
+
+async def stop_job_queue():
+    """Stop the consumers and hand their unfinished jobs back to the queue for the next process."""
+    for _, task in queue_consumers:
+        task.cancel()
+    await asyncio.gather(*(task for _, task in queue_consumers), return_exceptions=True)
+
+    for owner, _ in queue_consumers:
+        released = await run_in_threadpool(job_queue.release, owner)
+        if released:
+            logger.info(f"Released {released} unfinished job(s) of {owner}")
+    queue_consumers.clear()
+    job_queue.close()
+
+
+async def consume_jobs(owner):
+    """
+    Queue consumer: claim due jobs one at a time and run them; when there are none, wait for an
+    enqueue or the next poll.
+
+    Args:
+        owner: Lease owner id of this consumer
+    """
+    while True:
+        try:
+            job = await run_in_threadpool(job_queue.claim, owner)
+        except Exception as e:
+            logger.error(f"Job queue claim failed: {str(e)}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(jobs_available.wait(), JOB_POLL_S)
+            except asyncio.TimeoutError:
+                pass
+            jobs_available.clear()
+            continue
+
+        try:
+            await run_queued_job(job, owner)
+        except Exception as e:
+            # the job stays claimed; it is picked up again once its lease runs out
+            logger.error(f"Queued job {job['id']} error: {str(e)}", exc_info=True)
+
+
+async def keep_lease(job_id, owner, cancel_token):
+    """Renew a running job's lease until cancelled; stop the run if another worker has taken it over."""
+    while True:
+        await asyncio.sleep(JOB_LEASE_S / 3)
+        if not await run_in_threadpool(job_queue.heartbeat, job_id, owner):
+            logger.warning(f"Lease on job {job_id} was taken over, stopping the run")
+            cancel_token.cancel(LEASE_LOST)
+            return
+
+
+async def run_queued_job(job, owner):
+    """
+    Run one claimed job: keep its lease alive while it runs, then record the outcome (or schedule
+    a retry) and send the callback once the job is finished for good.
+
+    Args:
+        job: Claimed job (see JobQueue.claim())
+        owner: Lease owner id of the consumer
+    """
+    request_id, spec = job['id'], job['spec']
+    context = bind_request(
+        request_id=request_id, endpoint='generate-svg', styles=spec['styles'], quality=spec['quality'],
+        attempt=job['attempts']
+    )
+    try:
+        if job['attempts'] > job_queue.max_attempts:
+            # every earlier claim ended with its process dying mid-run
+            payload = {
+                "request_id": request_id, "status": "failed", "status_code": 500, "retry_after": None,
+                **create_error_response("The job was interrupted too many times.", "JOB_ABANDONED")
+            }
+            state = await run_in_threadpool(job_queue.fail, request_id, owner, payload)
+        else:
+            # a queued job has no client waiting on it, so only the server's own deadline applies
+            cancel_token = CancellationToken(timeout=REQUEST_DEADLINE_S or None)
+            heartbeat = asyncio.create_task(keep_lease(request_id, owner, cancel_token))
+            try:
+                payload = await job_outcome(request_id, generate_svg(request_id, job['payload'], spec, cancel_token))
+            finally:
+                heartbeat.cancel()
+            state = await record_outcome(job, owner, payload)
+
+        if state is None:
+            logger.warning(f"Lost the lease on job {request_id}; its outcome is left to the worker that took it over")
+        elif state == QUEUED:
+            logger.info(f"Job {request_id} failed with {payload['status_code']} (attempt {job['attempts']}), will retry")
+        elif job['callback_url']:
+            send_callback(job['callback_url'], payload, queued=True)
+    finally:
+        reset_request(context)
+
+
+async def record_outcome(job, owner, payload):
+    """
+    Store the outcome of a job's attempt: done, queued again for a retry, or failed.
+
+    Args:
+        job: Claimed job
+        owner: Lease owner id of the consumer
+        payload: Callback payload of the attempt (see job_outcome())
+
+    Returns:
+        New state of the job (see JobQueue.complete() and JobQueue.fail())
+    """
+    status_code = payload['status_code']
+    if status_code == 200:
+        return await run_in_threadpool(job_queue.complete, job['id'], owner, payload)
+
+    if status_code in (429, 503):
+        # shed before it started: try again once there is room, without using up an attempt
+        retry_in, count_attempt = payload['retry_after'] or JOB_RETRY_BASE_S, False
+    elif status_code >= 500:
+        retry_in, count_attempt = JOB_RETRY_BASE_S * 2 ** (job['attempts'] - 1), True
+    else:
+        retry_in, count_attempt = None, True # the job itself was rejected; a retry won't help
+
+    return await run_in_threadpool(job_queue.fail, job['id'], owner, payload, retry_in, count_attempt)
+
+
+def run_pipeline(profile, profile_id, **kwargs):
+    """
+    Run pipeline.process(), under a profiler if one was asked for.
+
+    Args:
+        profile: ProfileKind or None
+        profile_id: Id to store the profile under
+        **kwargs: Arguments for pipeline.process()
+
+    Returns:
+        tuple: (pipeline result, profile id or None)
+
+    Raises:
+        HTTPException: 409 when another request is being profiled
+    """
+    if profile is None:
+        return pipeline.process(**kwargs), None
+
+    try:
+        # the profilers only see this thread, so the stages run here instead of on the executors
+        result, captured = run_profiled(profile.value, pipeline.process, offload=False, **kwargs)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=create_error_response(str(e), "PROFILER_BUSY"))
+
+    # kept for failed runs too; those are often the ones worth looking at
+    profiles.put(profile_id, captured)
+    logger.info(f"Stored {profile.value} profile {profile_id} ({len(captured['body'])} bytes)")
+    return result, profile_id
+
+
+def stage_durations(result, style_results, multi_style, queue_time_ms, total_time_ms):
+    """
+    Duration of each stage of a request, for the Server-Timing header and the request log context.
+
+    Args:
+        result: Pipeline result
+        style_results: style -> result dict
+        multi_style: Whether several styles were rendered (their stages get a '-<style>' suffix)
+        queue_time_ms: Time waited for a pipeline slot
+        total_time_ms: Pipeline time
+
+    Returns:
+        List of (name, milliseconds), e.g. [('queue', 0), ('decode', 12.1), ..., ('pipeline', 4432)]
+    """
+    entries = [('queue', queue_time_ms)]
+    entries += [(stage, seconds * 1000) for stage, seconds in result['metrics'].get('stages', {}).items()]
+    if multi_style:
+        for style_name, style_result in style_results.items():
+            entries += [
+                (f"{stage}-{style_name}", seconds * 1000)
+                for stage, seconds in style_result['metrics'].get('stages', {}).items()
+            ]
+    entries.append(('pipeline', total_time_ms))
+    return entries
+
+
+def wants_svg_stream(request, stream):
+    """
+    Whether to answer with the raw SVG body instead of the JSON envelope.
+
+    Args:
+        request: Incoming request
+        stream: Value of the 'stream' form field
+
+    Returns:
+        True if the form asked for it or the Accept header prefers image/svg+xml over JSON
+    """
+    if stream:
+        return True
+    accept = request.headers.get('accept', '')
+    return 'image/svg+xml' in accept and 'application/json' not in accept
+
+
+def stream_svg_response(svg, request, headers, cleanup_paths=()):
+    """
+    Stream an SVG file as the response body, compressed if the client accepts it.
+    The temp files are removed once the body has been sent.
+
+    Args:
+        svg: Path to the SVG file, or the SVG itself as bytes (a request that joined another's run)
+        request: Incoming request (for Accept-Encoding)
+        headers: Metadata headers to send
+        cleanup_paths: Temp files to delete after sending
+
+    Returns:
+        StreamingResponse
+    """
+    encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+
+    headers = dict(headers)
+    headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    else:
+        headers['Content-Length'] = str(len(svg) if isinstance(svg, bytes) else os.path.getsize(svg))
+
+    chunks = [svg] if isinstance(svg, bytes) else iter_file(svg)
+    return StreamingResponse(
+        compress_chunks(chunks, encoding),
+        media_type="image/svg+xml",
+        headers=headers,
+        background=BackgroundTask(cleanup_temp_files, *cleanup_paths)
+    )
+
+def svg_response(outcome, spec, request=None, stream_svg=False, coalesced_ms=None):
+    """
+    Response of /generate-svg for a finished run, either this request's own or one it joined.
+
+    Args:
+        outcome: dict with request_id, job_id, result, style_results, total_time_ms, queue_time_ms,
+            durations, profile, svgs (style -> SVG text, None if not read) and svg_files (style -> temp
+            file, None for a joined run)
+        spec: Request options (see generate_svg())
+        request: Incoming request (for a streamed response)
+        stream_svg: Stream the SVG instead of answering with JSON
+        coalesced_ms: Time this request waited on the run it joined (None = its own run)
+
+    Returns:
+        JSONResponse, or a StreamingResponse of the SVG
+    """
+    result = outcome['result']
+    style_results = outcome['style_results']
+    requested_styles = spec['styles']
+    include_svg = spec['output_format'] != OutputFormat.paths.value
+    include_paths = spec['output_format'] != OutputFormat.svg.value
+    coalesced = coalesced_ms is not None
+
+    durations = [('coalesced', coalesced_ms)] + outcome['durations'] if coalesced else outcome['durations']
+    server_timing = ', '.join(f"{name};dur={ms:.1f}" for name, ms in durations)
+
+    if stream_svg:
+        metrics = {
+            "total_time_ms": outcome['total_time_ms'],
+            "queue_time_ms": outcome['queue_time_ms'],
+            **build_style_metrics(result),
+            "quality": spec['quality'],
+            "coalesced": coalesced
+        }
+        headers = {
+            "X-Style": requested_styles[0],
+            "X-Job-Id": outcome['job_id'] or "",
+            "X-Path-Ids": "true" if result['metrics'].get('path_ids') else "false",
+            "X-Preprocessing-Applied": ",".join(result.get('preprocessing_applied', [])),
+            "X-Metrics": json.dumps(metrics, separators=(',', ':')),
+            "X-Warnings": json.dumps(result.get('warnings', []), separators=(',', ':')),
+            "X-Profile-Id": outcome['profile']['id'] if outcome['profile'] else "",
+            "Server-Timing": server_timing
+        }
+        if coalesced:
+            return stream_svg_response(outcome['svgs'][requested_styles[0]].encode('utf-8'), request, headers)
+
+        # Send this request's own SVG file as-is: no read into memory, no JSON escaping
+        return stream_svg_response(
+            outcome['svg_files'][requested_styles[0]], request, headers,
+            cleanup_paths=list(outcome['svg_files'].values())
+        )
+
+    svgs = outcome['svgs'] if include_svg else {}
+    paths = {s: style_results[s].get('paths') for s in requested_styles} if include_paths else {}
+
+    if len(requested_styles) > 1:
+        # Return one SVG (and/or path list) per style
+        data = {
+            "job_id": outcome['job_id'], # for /refine-region
+            "styles": requested_styles,
+            "preprocessing_applied": {
+                s: style_results[s].get('preprocessing_applied', []) for s in requested_styles
+            },
+            # every <path> already carries a stable id, so callers can skip their own id pass
+            "path_ids": all(style_results[s]['metrics'].get('path_ids') for s in requested_styles)
+        }
+        if include_svg:
+            data["svgs"] = svgs
+        if include_paths:
+            data["paths"] = paths
+        if spec['spatial_index']:
+            data["index"] = {s: style_results[s].get('index') for s in requested_styles}
+
+        return JSONResponse(content=create_success_response(
+            data=data,
+            analysis={
+                "metrics": {
+                    "total_time_ms": outcome['total_time_ms'],
+                    "queue_time_ms": outcome['queue_time_ms'],
+                    "shared_time_ms": int(result['metrics']['shared_time'] * 1000),
+                    "quality": spec['quality'],
+                    "coalesced": coalesced,
+                    "styles": {s: build_style_metrics(style_results[s]) for s in requested_styles}
+                },
+                "warnings": result.get('warnings', []),
+                "profile": outcome['profile']
+            }
+        ), headers={"Server-Timing": server_timing})
+
+    # Return structured response with inline SVG (and/or path list)
+    data = {
+        "job_id": outcome['job_id'], # for /refine-region
+        "style": requested_styles[0],
+        "preprocessing_applied": result.get('preprocessing_applied', []),
+        # every <path> already carries a stable id, so callers can skip their own id pass
+        "path_ids": bool(result['metrics'].get('path_ids'))
+    }
+    if include_svg:
+        data["svg"] = svgs[requested_styles[0]]
+    if include_paths:
+        data["paths"] = paths[requested_styles[0]]
+    if spec['spatial_index']:
+        data["index"] = result.get('index')
+
+    return JSONResponse(content=create_success_response(
+        data=data,
+        analysis={
+            "metrics": {
+                "total_time_ms": outcome['total_time_ms'],
+                "queue_time_ms": outcome['queue_time_ms'],
+                **build_style_metrics(result),
+                "quality": spec['quality'],
+                "coalesced": coalesced
+            },
+            "warnings": result.get('warnings', []),
+            "profile": outcome['profile']
+        }
+    ), headers={"Server-Timing": server_timing})
+
+
 @app.get("/")
 def root():
     """Root endpoint for API information."""
@@ -146,7 +1034,11 @@ def root():
         "endpoints": {
             "POST /analyse": "Analyse image quality",
             "POST /generate-svg": "Full pipeline conversion of photo to SVG",
-            "GET /health": "Health check"
+            "POST /refine-region": "Re-render one region of a generated SVG at higher detail",
+            "GET /health": "Health check",
+            "GET /metrics": "Prometheus metrics",
+            "GET /profiles/{id}": "Profile captured with the 'profile' field of /generate-svg",
+            "GET /jobs/{id}": "State and result of a /generate-svg job accepted with a callback_url"
         }
     }
 
@@ -156,12 +1048,81 @@ def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "service": "image-to-svg-api"
+        "service": "image-to-svg-api",
+        "model_cache": pipeline.lineart_generator.get_cache_stats(),
+        "job_cache": pipeline.job_cache.get_stats(),
+        "admission": admission.get_stats(),
+        "coalescing": {"in_flight": flights.in_flight()},
+        "callbacks": {**notifier.get_stats(), "jobs_running": len(background_jobs)},
+        "job_queue": job_queue.get_stats() if job_queue is not None else None,
+        "stages": pipeline.get_stage_stats()
     }
 
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms, request, error and cache counters, load gauges."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str):
+    """
+    Profile captured by a /generate-svg request with the 'profile' field.
+
+    Args:
+        profile_id: Id from analysis.profile (or the X-Profile-Id header)
+
+    Returns:
+        cProfile report (text/plain) or torch profiler Chrome trace (application/json)
+    """
+    if PROFILE_CACHE_MAX_MB <= 0:
+        raise HTTPException(
+            status_code=403,
+            detail=create_error_response("Profiling is disabled on this server.", "PROFILING_DISABLED")
+        )
+
+    captured = profiles.get(profile_id)
+    if captured is None:
+        raise HTTPException(
+            status_code=404,
+            detail=create_error_response("Unknown or expired profile.", "PROFILE_NOT_FOUND")
+        )
+
+    return Response(content=captured['body'], media_type=captured['content_type'])
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    State of a /generate-svg job accepted with a callback_url, from the job queue.
+    Lets a caller that missed the callback (e.g. it restarted) look the result up.
+
+    Args:
+        job_id: request_id from the 202
+
+    Returns:
+        JSON envelope with id, state (queued, running, done or failed), attempts, created_at,
+        updated_at and result (the callback payload, once the job is finished)
+    """
+    if job_queue is None:
+        raise HTTPException(
+            status_code=403,
+            detail=create_error_response("The job queue is disabled on this server.", "JOB_QUEUE_DISABLED")
+        )
+
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=create_error_response("Unknown or expired job.", "JOB_NOT_FOUND")
+        )
+
+    return create_success_response(data=job)
+
+
 @app.post("/analyse")
-def analyse_endpoint(file: UploadFile = File(...)):
+async def analyse_endpoint(file: UploadFile = File(...)):
     """
     Analyse image quality without processing.
 
@@ -171,11 +1132,14 @@ def analyse_endpoint(file: UploadFile = File(...)):
     Returns:
         JSON with structured quality analysis results
     """
-    temp_path = None
+    REQUESTS.inc(endpoint='analyse', style='')
+
+    request_id = str(uuid.uuid4())
+    bind_request(request_id=request_id, endpoint='analyse')
 
     try:
         # Read file bytes
-        file_bytes = file.file.read()
+        file_bytes = await file.read()
 
         # Validate file type
         if not validate_image_file(file_bytes):
@@ -195,23 +1159,10 @@ def analyse_endpoint(file: UploadFile = File(...)):
                 detail=create_error_response("Image too large. Maximum size allowed is 20MB.", "FILE_TOO_LARGE")
             )
         
-        # Generate unique filename using UUID to avoid collisions
-        file_extension = Path(file.filename).suffix # get file extension from original filename
-        unique_filename = f"{uuid.uuid4()}{file_extension}" # new filename with unique UUID and original extension
-        temp_path = UPLOAD_DIR / unique_filename
-        
-        # We need to save the file to disk because the analyse_image function expects a file path. 
-        # TODO: Consider modifying analyse_image to accept file-like objects or byte streams to avoid this step.
-        with open(temp_path, "wb") as f:
-            f.write(file_bytes)
-        
-        logger.info(f"Analysing image: {unique_filename}")
+        logger.info(f"Analysing image: {file.filename}")
         
-        # Analyse
-        analysis = analyse_image(str(temp_path))
-        
-        # Cleanup
-        temp_path.unlink()
+        # Analyse the upload in memory, on an analysis worker
+        analysis = await run_in_threadpool(pipeline.analyse, file_bytes)
         
         # Return structured response
         return JSONResponse(content=create_success_response(
@@ -235,10 +1186,6 @@ def analyse_endpoint(file: UploadFile = File(...)):
     except Exception as e:
         logger.error(f"Analysis error: {str(e)}", exc_info=True)
         
-        # Cleanup on error
-        if temp_path and temp_path.exists():
-            temp_path.unlink()
-        
         raise HTTPException(
             status_code=500,
             detail=create_error_response(str(e))
@@ -246,10 +1193,20 @@ def analyse_endpoint(file: UploadFile = File(...)):
 
 
 @app.post("/generate-svg")
-def generate_svg_endpoint(
+async def generate_svg_endpoint(
+    request: Request,
     file: UploadFile = File(...),
     style: StyleOption = Form(StyleOption.contour),
-    skip_preprocess: bool = Form(False)
+    skip_preprocess: bool = Form(False),
+    quality: QualityOption = Form(QualityOption.balanced),
+    styles: Optional[List[StyleOption]] = Form(None),
+    output_format: OutputFormat = Form(OutputFormat.svg),
+    trace_mode: TraceMode = Form(TraceMode.outline),
+    stream: bool = Form(False),
+    spatial_index: bool = Form(False),
+    refinable: bool = Form(False),
+    profile: Optional[ProfileKind] = Form(None),
+    callback_url: Optional[str] = Form(None)
 ):
     """
     \Convert photo to SVG.
@@ -259,16 +1216,89 @@ def generate_svg_endpoint(
         file: Uploaded image file (max 20MB)
         style: Line art style ('contour' or 'anime')
         skip_preprocess: Skip preprocessing step
+        quality: Latency budget ('fast', 'balanced' or 'high'); the resolution also drops under load
+        styles: Several styles to render from the same upload (overrides style); decoding and
+            analysis run once and one SVG per style is returned
+        output_format: 'svg', 'paths' (structured path list only) or 'svg+paths'
+        trace_mode: 'outline' (filled shapes) or 'centerline' (one stroked path per connected line network)
+        stream: Send the SVG itself as the body (image/svg+xml, gzip/brotli negotiated) with the
+            metadata in X- headers instead of the JSON envelope; also chosen by 'Accept: image/svg+xml'
+        spatial_index: Also return per-path bounding boxes with a grid index for region queries
+        refinable: Keep the job's preprocessed input for /refine-region and return its job_id
+            (only when JOB_CACHE_MAX_MB is set)
+        profile: Capture a 'cprofile' or 'torch' profile of this request, retrievable from
+            /profiles/{id} (only when PROFILE_CACHE_MAX_MB is set)
+        callback_url: Answer 202 straight away and POST the JSON result (or error) to this URL
+            (http, https or http+unix://<percent-encoded socket path>/<path>) once processed
 
     Returns:
-        JSON with SVG string and metadata
+        JSON with SVG string and metadata (and, if refinable, a job_id for /refine-region), the streamed SVG,
+        or 202 with the request_id the callback will carry
     """
-    temp_input = None
-    temp_output = None
+
+    # Multi-style request if more than one distinct style was asked for
+    requested_styles = list(dict.fromkeys(s.value for s in styles)) if styles else [style.value]
+    multi_style = len(requested_styles) > 1
+    # a callback carries the JSON result; an Accept header then only concerns the 202
+    stream_svg = wants_svg_stream(request, stream) and not callback_url
+
+    # the request id doubles as job id and temp file name; every log record of this request carries it
+    # (each request runs in its own task, and the pipeline thread gets a copy of its context)
+    unique_id = str(uuid.uuid4())
+    bind_request(request_id=unique_id, endpoint='generate-svg', styles=requested_styles, quality=quality.value)
+
+    for requested_style in requested_styles:
+        REQUESTS.inc(endpoint='generate-svg', style=requested_style)
+
+    if stream_svg and (multi_style or output_format != OutputFormat.svg or spatial_index):
+        raise HTTPException(
+            status_code=422,
+            detail=create_error_response(
+                "Streaming returns a single SVG; use one style, output_format=svg and no spatial_index.",
+                "STREAM_NOT_SUPPORTED"
+            )
+        )
+
+    if profile is not None and PROFILE_CACHE_MAX_MB <= 0:
+        raise HTTPException(
+            status_code=403,
+            detail=create_error_response("Profiling is disabled on this server.", "PROFILING_DISABLED")
+        )
+
+    if callback_url:
+        if stream:
+            raise HTTPException(
+                status_code=422,
+                detail=create_error_response("Callbacks carry the JSON result; don't combine them with stream.", "STREAM_NOT_SUPPORTED")
+            )
+        try:
+            # resolving the host is blocking I/O, so it runs in a pool thread
+            await run_in_threadpool(parse_target, callback_url, CALLBACK_ALLOWED_HOSTS, CALLBACK_SOCKET_DIR or None)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=create_error_response(str(e), "INVALID_CALLBACK_URL"))
+        except OSError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=create_error_response(f"Callback host could not be resolved: {e}", "INVALID_CALLBACK_URL")
+            )
+
+    # the profilers follow the request thread, and multi-style requests render on worker threads
+    if profile is not None and multi_style:
+        raise HTTPException(
+            status_code=422,
+            detail=create_error_response("Profiling covers one style per request.", "PROFILE_NOT_SUPPORTED")
+        )
+
+    # the deadline runs from arrival, so time spent in the queue counts against it
+    if callback_url:
+        # the caller doesn't wait, so only the server's own deadline applies
+        cancel_token, stop_watching = CancellationToken(timeout=REQUEST_DEADLINE_S or None), lambda: None
+    else:
+        cancel_token, stop_watching = start_cancel_token(request)
 
     try:
         # Read file bytes
-        file_bytes = file.file.read()
+        file_bytes = await file.read()
 
         # Validate file size
         if len(file_bytes) > MAX_FILE_SIZE:
@@ -288,87 +1318,334 @@ def generate_svg_endpoint(
                 )
             )
 
-        # Generate unique filenames
-        input_extension = Path(file.filename).suffix
-        unique_id = str(uuid.uuid4())
-        temp_input = UPLOAD_DIR / f"{unique_id}{input_extension}" # input the file as its original format (jpg or png)
-        temp_output = UPLOAD_DIR / f"{unique_id}.svg" # output an svg file
-        
-        # Write input to disk
-        with open(temp_input, "wb") as f:
-            f.write(file_bytes)
+        spec = {
+            'styles': requested_styles,
+            'skip_preprocess': skip_preprocess,
+            'quality': quality.value,
+            'output_format': output_format.value,
+            'trace_mode': trace_mode.value,
+            'spatial_index': spatial_index,
+            'refinable': refinable
+        }
+
+        if callback_url and job_queue is not None and profile is None:
+            # stored before the 202, so the job survives a crash or restart; a queue consumer runs it
+            await run_in_threadpool(job_queue.enqueue, unique_id, file_bytes, spec, callback_url)
+            jobs_available.set()
+            logger.info(f"Queued {unique_id} for a callback to {callback_url}")
+            return JSONResponse(status_code=202, content=create_success_response(
+                data={"request_id": unique_id, "status": "accepted", "status_url": f"/jobs/{unique_id}"}
+            ))
+
+        if callback_url:
+            # accepted now, processed in the background, result POSTed to the callback URL
+            # (profiled runs stay in memory: a profile is a one-off debug run, not worth a retry)
+            start_background(run_for_callback(
+                callback_url, unique_id, generate_svg(unique_id, file_bytes, spec, cancel_token, profile=profile)
+            ))
+            logger.info(f"Accepted {unique_id} for a callback to {callback_url}")
+            return JSONResponse(status_code=202, content=create_success_response(
+                data={"request_id": unique_id, "status": "accepted"}
+            ))
+
+        return await generate_svg(
+            unique_id, file_bytes, spec, cancel_token, request=request, stream_svg=stream_svg, profile=profile
+        )
+
+    finally:
+        stop_watching()
+
+
+async def generate_svg(request_id, file_bytes, spec, cancel_token, request=None, stream_svg=False, profile=None):
+    """
+    The work of /generate-svg for a validated upload: join an identical run in flight, or take a
+    pipeline slot and run the pipeline, then build the response.
+
+    Args:
+        request_id: Request id (also the job id and the temp file prefix)
+        file_bytes: Uploaded image
+        spec: JSON-serialisable options: styles (list), skip_preprocess, quality, output_format,
+            trace_mode, spatial_index and refinable
+        cancel_token: The request's CancellationToken
+        request: Incoming request, for a streamed response (Accept-Encoding)
+        stream_svg: Answer with the streamed SVG instead of JSON
+        profile: ProfileKind or None
+
+    Returns:
+        JSONResponse, or a StreamingResponse of the SVG
+
+    Raises:
+        HTTPException: Shed, cancelled or failed
+    """
+    requested_styles = spec['styles']
+    multi_style = len(requested_styles) > 1
+    include_svg = spec['output_format'] != OutputFormat.paths.value
+    include_paths = spec['output_format'] != OutputFormat.svg.value
+    # only refinable jobs pay for keeping their input and building the path index refinement needs
+    refinable = spec.get('refinable', False) and JOB_CACHE_MAX_MB > 0
+
+    temp_outputs = {}
+    cleanup_deferred = False # a streamed response deletes its temp files once it has been sent
+    ticket = None
+    stage_times = None # recorded for the wait estimates once the pipeline succeeds
+    flight = None # (key, future) while this request runs a pipeline that identical requests can join
+    shared_error = None # what joined requests get if this run fails
+
+    try:
+        # A duplicate of a request still in flight (double-click, retry after a timeout) waits for
+        # that request's result instead of running the pipeline again; profiled requests always run.
+        # Hashing up to 20MB takes a while, so it happens off the event loop
+        key = await run_in_threadpool(coalesce_key, file_bytes, spec) if COALESCE_REQUESTS and profile is None else None
+
+        while key is not None:
+            future, leader = flights.claim(key)
+            if leader:
+                flight = (key, future)
+                break
+
+            wait_start = time.time()
+            outcome = await join_in_flight(future, cancel_token)
+            if outcome is None:
+                continue # that request was abandoned; run this one (or join a newer run)
+
+            COALESCED.inc(endpoint='generate-svg')
+            wait_ms = (time.time() - wait_start) * 1000
+            update_request(coalesced_with=outcome['request_id'])
+            logger.info(f"Request {request_id} answered with the result of in-flight request {outcome['request_id']}")
+            return svg_response(outcome, spec, request, stream_svg, coalesced_ms=wait_ms)
+
+        # Wait for a pipeline slot (or get shed); the requests ahead of this one are the queue depth
+        ticket = await admit_request(cancel_token)
+        queue_depth = ticket['queue_depth']
+
+        # Generate unique filenames (the upload itself is decoded in memory)
+        temp_outputs = {s: UPLOAD_DIR / f"{request_id}_{s}.svg" for s in requested_styles} # output an svg file per style
         
-        logger.info(f"Processing image {unique_id} with style={style}, skip_preprocess={skip_preprocess}")
+        logger.info(
+            f"Processing image {request_id} with styles={requested_styles}, skip_preprocess={spec['skip_preprocess']}, quality={spec['quality']}, trace_mode={spec['trace_mode']}, queue_depth={queue_depth}",
+            extra={'queue_depth': queue_depth, 'trace_mode': spec['trace_mode'], 'file_bytes': len(file_bytes)}
+        )
         
-        # Run pipeline (timed to include preprocessing + lineart + vectorization)
+        # Run pipeline (timed to include preprocessing + lineart + vectorization); the orchestration
+        # waits in a pool thread while the stages run on their own workers
         pipeline_start = time.time()
-        result = pipeline.process(
-            input_image=str(temp_input),
-            output_svg=str(temp_output),
-            style=style,
-            skip_preprocess=skip_preprocess
+        result, profile_id = await run_in_threadpool(
+            run_pipeline,
+            profile, request_id,
+            input_image=file_bytes,
+            output_svg={s: str(path) for s, path in temp_outputs.items()} if multi_style else str(temp_outputs[requested_styles[0]]),
+            style=requested_styles if multi_style else requested_styles[0],
+            skip_preprocess=spec['skip_preprocess'],
+            quality=spec['quality'],
+            queue_depth=queue_depth,
+            include_paths=include_paths,
+            trace_mode=spec['trace_mode'],
+            include_index=spec['spatial_index'],
+            job_id=request_id if refinable else None,
+            cancel_token=cancel_token
         )
         total_time_ms = int((time.time() - pipeline_start) * 1000)
         
         # Check if successful
         if not result['success']:
+            if result.get('cancelled'):
+                raise cancelled_exception(cancel_token)
+            if result.get('invalid_input'):
+                # passed the magic-byte check but doesn't decode; retrying won't help
+                logger.warning(f"Undecodable image {request_id}: {result['error']}")
+                raise HTTPException(
+                    status_code=422,
+                    detail=create_error_response(result['error'], "INVALID_IMAGE_FORMAT")
+                )
             logger.error(f"Pipeline failed: {result['error']}")
             raise HTTPException(
                 status_code=500,
                 detail=create_error_response(result['error'])
             )
+
+        stage_times = result['metrics'].get('stage_times')
+        queue_time_ms = int(ticket['queued_time'] * 1000)
+
+        style_results = result['styles'] if multi_style else {requested_styles[0]: result}
+        durations = stage_durations(result, style_results, multi_style, queue_time_ms, total_time_ms)
+
+        # attached to this request's remaining log records
+        resolution = (result.get('analysis') or {}).get('resolution')
+        if resolution:
+            update_request(image_width=resolution['width'], image_height=resolution['height'])
+        update_request(stage_ms={name: round(ms, 1) for name, ms in durations})
+
+        outcome = {
+            'request_id': request_id,
+            'job_id': request_id if refinable else None,
+            'result': result,
+            'style_results': style_results,
+            'total_time_ms': total_time_ms,
+            'queue_time_ms': queue_time_ms,
+            'durations': durations,
+            'profile': {"id": profile_id, "kind": profile.value, "url": f"/profiles/{profile_id}"} if profile_id else None,
+            # Read SVG content for every style (a streamed response sends the file as-is instead)
+            'svgs': {s: read_svg(temp_outputs[s]) for s in requested_styles} if include_svg and not stream_svg else None,
+            'svg_files': temp_outputs
+        }
+
+        if flight is not None:
+            # the joined requests get the SVGs in memory, since this request's files go once it is answered
+            if flights.close(*flight) and outcome['svgs'] is None and include_svg:
+                outcome['svgs'] = {s: read_svg(temp_outputs[s]) for s in requested_styles}
+            flight[1].set_result({**outcome, 'svg_files': None})
+            flight = None
+
+        logger.info(
+            f"Successfully processed {request_id}: " + ", ".join(
+                f"{s}={style_results[s]['metrics']['path_count']} paths" for s in requested_styles
+            ),
+            extra={'path_counts': {s: style_results[s]['metrics']['path_count'] for s in requested_styles}}
+        )
+
+        response = svg_response(outcome, spec, request, stream_svg)
+        cleanup_deferred = stream_svg
+        return response
         
-        # Read SVG content and strip potrace metadata block with Portrace version info and processing parameters (not needed for client and adds unnecessary size)
-        with open(temp_output, 'r') as f:
-            svg_content = f.read()
-        svg_content = re.sub(r'<metadata>.*?</metadata>\n?', '', svg_content, flags=re.DOTALL)
-        
-        logger.info(f"Successfully processed {unique_id}: {result['metrics']['path_count']} paths")
+    except HTTPException as e:
+        shared_error = e
+        raise
+    except Exception as e:
+        logger.error(f"SVG generation error: {str(e)}", exc_info=True)
         
+        shared_error = HTTPException(
+            status_code=500,
+            detail=create_error_response("Internal processing error")
+        )
+        raise shared_error
+
+    finally:
+        # requests that joined this run get its error (or, if it was abandoned, run themselves)
+        if flight is not None:
+            flights.resolve(*flight, error=shared_error or Cancelled(CLIENT_DISCONNECTED))
+
         # Cleanup temp files
-        temp_input.unlink()
-        temp_output.unlink()
-        
-        # Return structured response with inline SVG
+        if not cleanup_deferred:
+            cleanup_temp_files(*temp_outputs.values())
+
+        if ticket is not None:
+            admission.release(ticket, stage_times)
+
+
+@app.post("/refine-region")
+async def refine_region_endpoint(
+    request: Request,
+    job_id: str = Form(...),
+    style: StyleOption = Form(StyleOption.contour),
+    x: float = Form(...),
+    y: float = Form(...),
+    width: float = Form(...),
+    height: float = Form(...),
+    detail: float = Form(2.0)
+):
+    """
+    Re-render one region of a drawing from /generate-svg at higher detail.
+    Only the region goes through inference and tracing again, starting from the job's cached input.
+
+    Args:
+        job_id: job_id returned by /generate-svg
+        style: Style of the drawing to refine
+        x, y, width, height: Region in the SVG's viewBox pixels
+        detail: Resolution relative to the drawing (2.0 = twice as many pixels per side)
+
+    Returns:
+        JSON with the replacement paths (id and path data in the coordinates of the SVG's <g>)
+        and the ids of the paths they replace
+    """
+    REQUESTS.inc(endpoint='refine-region', style=style.value)
+    bind_request(request_id=str(uuid.uuid4()), endpoint='refine-region', job_id=job_id, styles=[style.value])
+
+    if not 0 < detail <= 8:
+        raise HTTPException(
+            status_code=422,
+            detail=create_error_response("detail must be greater than 0 and at most 8.", "INVALID_REGION")
+        )
+
+    cancel_token, stop_watching = start_cancel_token(request)
+
+    # region refinement shares the pipeline slots, but its timings don't feed the full-request estimates
+    try:
+        ticket = await admit_request(cancel_token)
+    except HTTPException:
+        stop_watching()
+        raise
+
+    try:
+        logger.info(f"Refining job {job_id} ({style.value}) region x={x}, y={y}, width={width}, height={height}, detail={detail}")
+
+        result = await run_in_threadpool(
+            pipeline.refine_region,
+            job_id, style.value, (x, y, width, height), detail=detail, cancel_token=cancel_token
+        )
+
+        if not result['success']:
+            logger.error(f"Region refinement failed: {result['error']}")
+            raise HTTPException(
+                status_code=500,
+                detail=create_error_response(result['error'])
+            )
+
+        logger.info(f"Refined job {job_id}: {len(result['replaced_ids'])} paths replaced by {len(result['paths'])}")
+
         return JSONResponse(content=create_success_response(
             data={
-                "svg": svg_content,
-                "style": style,
-                "preprocessing_applied": result.get('preprocessing_applied', [])
+                "job_id": job_id,
+                "style": style.value,
+                "region": result['region'],
+                "paths": result['paths'],
+                "replaced_ids": result['replaced_ids']
             },
             analysis={
                 "metrics": {
-                    "total_time_ms": total_time_ms,
+                    "total_time_ms": int(result['metrics']['total_time'] * 1000),
                     "lineart_time_ms": int(result['metrics']['lineart_time'] * 1000),
                     "vectorization_time_ms": int(result['metrics']['vectorization_time'] * 1000),
+                    "input_size": result['metrics']['input_size'],
                     "path_count": result['metrics']['path_count'],
-                    "file_size_kb": result['metrics']['file_size_kb']
+                    "trace_mode": result['metrics']['trace_mode']
                 },
-                "warnings": result.get('warnings', [])
+                "warnings": []
             }
         ))
-        
+
     except HTTPException:
         raise
+    except Cancelled:
+        raise cancelled_exception(cancel_token)
+    except KeyError:
+        raise HTTPException(
+            status_code=404,
+            detail=create_error_response(
+                "Unknown or expired job. Generate the SVG again to refine it.", "JOB_NOT_FOUND"
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=create_error_response(str(e), "INVALID_REGION")
+        )
     except Exception as e:
-        logger.error(f"SVG generation error: {str(e)}", exc_info=True)
-        
-        # Cleanup on error
-        if temp_input and temp_input.exists():
-            temp_input.unlink()
-        if temp_output and temp_output.exists():
-            temp_output.unlink()
-        
+        logger.error(f"Region refinement error: {str(e)}", exc_info=True)
+
         raise HTTPException(
             status_code=500,
             detail=create_error_response("Internal processing error")
         )
 
+    finally:
+        stop_watching()
+        admission.release(ticket)
+
 
 def main():
     """Run the FastAPI server."""
+    configure_logging()
     logger.info("Starting Image to SVG API server...")
-    logger.info(f"Models directory: {MODELS_DIR}")
     logger.info("Server will run on http://localhost:8000")
     logger.info("API docs available at http://localhost:8000/docs")
     
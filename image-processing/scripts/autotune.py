@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep for the vectorizer's style configs.
+Traces the line art of a set of test images with every combination of turdsize, alphamax,
+opttolerance and threshold, measures trace time, path count, SVG size and fidelity
+(IoU of the re-rasterized SVG against the binary line art), and reports the Pareto
+front per style so size and speed can be traded against quality with data.
+"""
+
+import os
+import json
+import time
+import itertools
+import tempfile
+from pathlib import Path
+import cv2
+import numpy as np
+
+from bitmap import binarize
+from svg_writer import parse_potrace_svg
+from path_list import build_path_list, flatten_cubics
+from vectorize_lineart import LineArtVectorizer
+
+# Default grid, around the hand-picked style configs
+DEFAULT_GRID = {
+    'turdsize': [2, 5, 10],
+    'alphamax': [0.8, 1.0, 1.3],
+    'opttolerance': [0.2, 0.4],
+    'threshold': ['otsu', 128, 180]
+}
+
+# Fractional bits for cv2.fillPoly, so curves are rasterized with sub-pixel precision
+RASTER_SHIFT = 4
+
+# Subpixels per pixel side when rasterizing; a pixel is filled when at least half of it is covered.
+# fillPoly always fills the pixels an edge touches, so filling at 1x grows every shape by about a pixel
+SUPERSAMPLE = 4
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def rasterize_svg(svg_text, width, height):
+    """
+    Rasterize a filled (outline) SVG written by the vectorizer.
+    Pixels are set by coverage (at least half of the pixel inside the outline),
+    so an SVG traced from a bitmap rasterizes back to the same pixels.
+
+    Args:
+        svg_text: SVG string
+        width: Raster width (the line art's width)
+        height: Raster height
+
+    Returns:
+        HxW bool array, True where the SVG is filled
+    """
+    document = parse_potrace_svg(svg_text)
+    factor = SUPERSAMPLE
+    raster = np.zeros((height * factor, width * factor), dtype=np.uint8)
+    scale = 1 << RASTER_SHIFT
+
+    for path in build_path_list(document):
+        for start, cubics, closed in path['subpaths']:
+            if not closed:
+                continue
+            polygon = flatten_cubics(start, cubics) * factor - 0.5 # subpixel centres sit at +0.5
+
+            # fill each outline in its own bounding box and XOR it in (even-odd), so holes are cut out
+            left = max(0, int(np.floor(polygon[:, 0].min())))
+            top = max(0, int(np.floor(polygon[:, 1].min())))
+            right = min(width * factor, int(np.ceil(polygon[:, 0].max())) + 1)
+            bottom = min(height * factor, int(np.ceil(polygon[:, 1].max())) + 1)
+            if right <= left or bottom <= top:
+                continue
+
+            local = np.zeros((bottom - top, right - left), dtype=np.uint8)
+            points = np.round((polygon - (left, top)) * scale).astype(np.int32)
+            cv2.fillPoly(local, [points], 1, lineType=cv2.LINE_8, shift=RASTER_SHIFT)
+            raster[top:bottom, left:right] ^= local
+
+    coverage = raster.reshape(height, factor, width, factor).sum(axis=(1, 3), dtype=np.int32)
+    return coverage * 2 >= factor * factor
+
+
+def iou(a, b):
+    """Intersection over union of two bool masks (1.0 if both are empty)."""
+    union = np.count_nonzero(a | b)
+    if union == 0:
+        return 1.0
+    return np.count_nonzero(a & b) / union
+
+
+def load_lineart(images, style, generator=None, input_size=256):
+    """
+    Grey line art for each test image.
+
+    Args:
+        images: List of image paths (photos, or line art PNGs if generator is None)
+        style: 'contour' or 'anime'
+        generator: LineArtGenerator to render photos with, or None to read the images as line art
+        input_size: Model input resolution (shorter side)
+
+    Returns:
+        List of (name, HxW uint8 line art) tuples
+    """
+    lineart = []
+    for image_path in images:
+        if generator is None:
+            array = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+        else:
+            image = cv2.imread(str(image_path))
+            result = generator.generate_array(image, style=style, channel_order='bgr', input_size=input_size) if image is not None else None
+            array = result['lineart'] if result and result['success'] else None
+
+        if array is None:
+            print(f"Skipping {image_path}: could not load or render")
+            continue
+        lineart.append((Path(image_path).name, array))
+
+    return lineart
+
+
+def measure_setting(vectorizer, style, lineart, reference, output_path, repeat=1):
+    """
+    Trace one line art image with one setting.
+
+    Args:
+        vectorizer: LineArtVectorizer whose style config holds the setting
+        style: 'contour' or 'anime'
+        lineart: HxW uint8 grey line art
+        reference: HxW bool reference line mask
+        output_path: Scratch path for the SVG
+        repeat: Trace this many times and keep the fastest time
+
+    Returns:
+        dictionary with trace_time_ms, path_count, svg_bytes, iou (against the reference mask)
+        and trace_iou (against the bitmap that was traced)
+    """
+    bitmap = binarize(lineart, vectorizer.threshold_for(style))
+
+    best_time = None
+    for _ in range(max(1, repeat)):
+        result = vectorizer.vectorize_bitmap(bitmap, output_path, style=style, trace_mode='outline')
+        if not result['success']:
+            raise RuntimeError(result['error'])
+        if best_time is None or result['processing_time'] < best_time:
+            best_time = result['processing_time']
+
+    with open(output_path) as f:
+        svg_text = f.read()
+    raster = rasterize_svg(svg_text, bitmap.width, bitmap.height)
+
+    return {
+        'trace_time_ms': best_time * 1000,
+        'path_count': result['metrics']['path_count'],
+        'svg_bytes': result['metrics']['file_size_bytes'],
+        'iou': iou(raster, reference),
+        'trace_iou': iou(raster, bitmap.unpack())
+    }
+
+
+def pareto_front(rows, minimize=('svg_bytes', 'trace_time_ms'), maximize=('iou',)):
+    """
+    Rows not dominated by any other row.
+
+    Args:
+        rows: List of dicts with the objective fields
+        minimize: Fields where lower is better
+        maximize: Fields where higher is better
+
+    Returns:
+        Non-dominated rows, sorted by the first minimized field
+    """
+    def key(row):
+        return [row[name] for name in minimize] + [-row[name] for name in maximize]
+
+    keys = [key(row) for row in rows]
+    front = []
+    for i, row in enumerate(rows):
+        dominated = any(
+            all(o <= k for o, k in zip(other, keys[i])) and other != keys[i]
+            for j, other in enumerate(keys) if j != i
+        )
+        if not dominated:
+            front.append(row)
+
+    return sorted(front, key=lambda row: row[minimize[0]])
+
+
+def recommend(front, iou_slack=0.02):
+    """
+    Smallest SVG on the front whose fidelity is within iou_slack of the best.
+
+    Args:
+        front: Rows from pareto_front()
+        iou_slack: Allowed IoU loss against the most faithful setting
+
+    Returns:
+        Row, or None if the front is empty
+    """
+    if not front:
+        return None
+    best_iou = max(row['iou'] for row in front)
+    candidates = [row for row in front if row['iou'] >= best_iou - iou_slack]
+    return min(candidates, key=lambda row: (row['svg_bytes'], row['trace_time_ms']))
+
+
+def sweep_style(style, lineart, grid, backend='auto', repeat=1):
+    """
+    Run the grid over every line art image for one style.
+
+    Args:
+        style: 'contour' or 'anime'
+        lineart: List from load_lineart()
+        grid: Dict of parameter -> list of values (see DEFAULT_GRID)
+        backend: Outline tracer, 'cli', 'potracer' or 'auto'
+        repeat: Timing repeats per trace
+
+    Returns:
+        List of rows: the setting plus trace_time_ms, path_count, svg_bytes, iou and trace_iou
+        averaged over the images
+    """
+    # the binary line art the pipeline produces by default is the reference for every setting
+    references = [binarize(array, 'otsu').unpack() for _, array in lineart]
+
+    rows = []
+    names = list(grid)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, 'sweep.svg')
+
+        for values in itertools.product(*(grid[name] for name in names)):
+            setting = dict(zip(names, values))
+
+            vectorizer = LineArtVectorizer(backend=backend)
+            config = vectorizer.style_configs[style]
+            config.update(turdsize=setting['turdsize'], alphamax=setting['alphamax'], opttolerance=setting['opttolerance'])
+            if setting['threshold'] == 'otsu':
+                config['threshold_strategy'] = 'otsu'
+            else:
+                config.update(threshold_strategy='fixed', threshold=int(setting['threshold']))
+
+            measurements = [
+                measure_setting(vectorizer, style, array, reference, output_path, repeat=repeat)
+                for (_, array), reference in zip(lineart, references)
+            ]
+
+            row = dict(setting)
+            for field in ('trace_time_ms', 'path_count', 'svg_bytes', 'iou', 'trace_iou'):
+                row[field] = round(float(np.mean([m[field] for m in measurements])), 4)
+            rows.append(row)
+
+            print(f"{style} {setting}: {row['trace_time_ms']:.1f}ms, {row['path_count']:.1f} paths, "
+                  f"{row['svg_bytes']:.0f} bytes, IoU {row['iou']:.4f}")
+
+    return rows
+
+
+def main():
+    """Command-line interface."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Sweep vectorizer parameters and report the size/speed/fidelity Pareto front per style'
+    )
+    parser.add_argument(
+        '--images',
+        default='../test_images',
+        help='Directory of test photos (default: ../test_images)'
+    )
+    parser.add_argument(
+        '--lineart',
+        action='store_true',
+        help='The images are already line art PNGs (no model inference)'
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=10,
+        help='Use the first N images, sorted by name (default: 10, 0 = all)'
+    )
+    parser.add_argument(
+        '--style',
+        choices=['contour', 'anime'],
+        nargs='+',
+        default=['contour', 'anime'],
+        help='Styles to tune (default: both)'
+    )
+    parser.add_argument(
+        '--models-dir',
+        default='../models',
+        help='Path to models directory'
+    )
+    parser.add_argument(
+        '--input-size',
+        type=int,
+        default=256,
+        help='Model input resolution, shorter side (default: 256)'
+    )
+    parser.add_argument('--turdsize', type=int, nargs='+', default=DEFAULT_GRID['turdsize'])
+    parser.add_argument('--alphamax', type=float, nargs='+', default=DEFAULT_GRID['alphamax'])
+    parser.add_argument('--opttolerance', type=float, nargs='+', default=DEFAULT_GRID['opttolerance'])
+    parser.add_argument(
+        '--threshold',
+        nargs='+',
+        default=DEFAULT_GRID['threshold'],
+        help="Threshold strategies: 'otsu' and/or fixed grey levels (default: otsu 128 180)"
+    )
+    parser.add_argument(
+        '--backend',
+        choices=['auto', 'cli', 'potracer'],
+        default='auto',
+        help='Outline tracer (default: auto)'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='Trace each image this many times and keep the fastest time (default: 1)'
+    )
+    parser.add_argument(
+        '--iou-slack',
+        type=float,
+        default=0.02,
+        help='Recommend the smallest front setting within this IoU of the best (default: 0.02)'
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='Write all measurements, fronts and recommendations as JSON'
+    )
+
+    args = parser.parse_args()
+
+    images = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if args.limit:
+        images = images[:args.limit]
+    if not images:
+        print(f"No images found in {args.images}")
+        return 1
+
+    grid = {
+        'turdsize': args.turdsize,
+        'alphamax': args.alphamax,
+        'opttolerance': args.opttolerance,
+        'threshold': [value if value == 'otsu' else int(value) for value in args.threshold]
+    }
+
+    generator = None
+    if not args.lineart:
+        from generate_lineart import LineArtGenerator # only needed (with torch) when rendering photos
+        generator = LineArtGenerator(models_dir=args.models_dir)
+
+    start_time = time.time()
+    report = {'images': [p.name for p in images], 'grid': grid, 'styles': {}}
+
+    for style in args.style:
+        lineart = load_lineart(images, style, generator=generator, input_size=args.input_size)
+        rows = sweep_style(style, lineart, grid, backend=args.backend, repeat=args.repeat)
+        front = pareto_front(rows)
+        report['styles'][style] = {
+            'results': rows,
+            'pareto_front': front,
+            'recommended': recommend(front, iou_slack=args.iou_slack)
+        }
+
+    report['total_time'] = time.time() - start_time
+
+    # Print the fronts
+    for style, style_report in report['styles'].items():
+        print(f"\nPareto front for {style} ({len(style_report['pareto_front'])} of {len(style_report['results'])} settings):")
+        print(f"{'turdsize':>8} {'alphamax':>8} {'opttol':>6} {'threshold':>9} {'time_ms':>8} {'paths':>7} {'bytes':>8} {'iou':>6}")
+        for row in style_report['pareto_front']:
+            print(f"{row['turdsize']:>8} {row['alphamax']:>8} {row['opttolerance']:>6} {str(row['threshold']):>9} "
+                  f"{row['trace_time_ms']:>8.1f} {row['path_count']:>7.1f} {row['svg_bytes']:>8.0f} {row['iou']:>6.3f}")
+        if style_report['recommended']:
+            print(f"Recommended: {json.dumps(style_report['recommended'])}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Binary bitmap helpers shared by line art generation and vectorization.
+Thresholds line art (Otsu or fixed) and keeps the result as a packed 1-bit buffer.
+"""
+
+import numpy as np
+import torch
+
+
+class PackedBitmap:
+    """1-bit bitmap packed 8 pixels per byte, row by row (set bit = line pixel)."""
+
+    def __init__(self, data, width, height, threshold=None):
+        """
+        Args:
+            data: uint8 array of shape (height, ceil(width / 8)) from np.packbits(..., axis=1)
+            width: Bitmap width in pixels
+            height: Bitmap height in pixels
+            threshold: Grey level used to binarize (for reporting)
+        """
+        self.data = data
+        self.width = width
+        self.height = height
+        self.threshold = threshold
+
+    @property
+    def nbytes(self):
+        """Size of the packed buffer in bytes."""
+        return self.data.nbytes
+
+    def to_pbm(self):
+        """
+        Encode as binary PBM (P4). P4 rows are packed MSB first and padded to whole bytes,
+        which is exactly the np.packbits layout, so no conversion is needed.
+
+        Returns:
+            PBM file contents as bytes
+        """
+        header = f"P4\n{self.width} {self.height}\n".encode('ascii')
+        return header + self.data.tobytes()
+
+    def unpack(self):
+        """
+        Expand to a boolean array (True = line pixel).
+
+        Returns:
+            HxW bool array
+        """
+        return np.unpackbits(self.data, axis=1, count=self.width).astype(bool)
+
+
+def otsu_threshold(histogram):
+    """
+    Otsu's threshold from a 256-bin grey level histogram.
+    Picks the level that maximises between-class variance, like cv2.THRESH_OTSU.
+
+    Args:
+        histogram: Array of 256 pixel counts
+
+    Returns:
+        Threshold level (pixels <= level are the dark class)
+    """
+    hist = np.asarray(histogram, dtype=np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0
+
+    levels = np.arange(256, dtype=np.float64)
+    prob = hist / total
+
+    omega = np.cumsum(prob) # weight of the dark class for each candidate level
+    mu = np.cumsum(prob * levels) # cumulative mean of the dark class
+    mu_total = mu[-1]
+
+    # between-class variance; levels where one class is empty are not candidates
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_b = (mu_total * omega - mu) ** 2 / (omega * (1.0 - omega))
+    sigma_b[~np.isfinite(sigma_b)] = -1.0
+
+    return int(np.argmax(sigma_b)) # first maximum, as OpenCV does
+
+
+def binarize(lineart, threshold='otsu'):
+    """
+    Threshold line art and pack it to 1 bit per pixel.
+    Works on a uint8 torch tensor (on any device) or a uint8 NumPy array,
+    so the model output can be binarized without leaving torch.
+
+    Args:
+        lineart: HxW uint8 tensor or array (dark lines on light background)
+        threshold: 'otsu' for an automatic threshold, or an int where pixels darker than it become lines
+
+    Returns:
+        PackedBitmap with line pixels set
+    """
+    if isinstance(lineart, np.ndarray):
+        lineart = torch.from_numpy(lineart)
+
+    height, width = lineart.shape
+
+    if threshold == 'otsu':
+        histogram = torch.bincount(lineart.flatten(), minlength=256).cpu().numpy()
+        level = otsu_threshold(histogram)
+        mask = lineart <= level # same split as cv2.threshold(..., THRESH_BINARY + THRESH_OTSU)
+    else:
+        level = int(threshold)
+        mask = lineart < level
+
+    data = np.packbits(mask.cpu().numpy(), axis=1)
+
+    return PackedBitmap(data, width, height, threshold=level)
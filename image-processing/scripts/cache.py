@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Caching helpers shared by the pipeline and the API.
+Bounded LRU cache with a memory budget, plus single-flight deduplication
+so concurrent callers asking for the same missing key only load it once.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Makes sure only one caller does the work for a given key at a time."""
+
+    def __init__(self):
+        """Initialise with no calls in flight."""
+        self._lock = threading.Lock()
+        self._calls = {} # key -> Future shared by everyone waiting on that key
+        self._followers = {} # key -> callers that joined the call instead of running it
+
+    def claim(self, key):
+        """
+        Join the in-flight call for key, or become the caller that runs it.
+
+        Args:
+            key: Hashable key identifying the work
+
+        Returns:
+            tuple: (future, leader) where leader is True if the caller must do
+            the work and then call resolve()
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._followers[key] += 1
+                return future, False
+
+            future = Future()
+            self._calls[key] = future
+            self._followers[key] = 0
+            return future, True
+
+    def close(self, key, future):
+        """
+        Stop new callers from joining the call for key; later callers start a new one.
+        resolve() does this itself; a leader calls it first when what it publishes depends on
+        whether anyone is waiting, then sets the future's result.
+
+        Args:
+            key: Key passed to claim()
+            future: Future returned by claim()
+
+        Returns:
+            Number of callers that joined the call
+        """
+        with self._lock:
+            # only remove the entry if it is still ours
+            if self._calls.get(key) is not future:
+                return 0
+            del self._calls[key]
+            return self._followers.pop(key)
+
+    def resolve(self, key, future, result=None, error=None):
+        """
+        Publish the leader's result (or error) to every waiting caller.
+
+        Args:
+            key: Key passed to claim()
+            future: Future returned by claim()
+            result: Result of the work
+            error: Exception raised by the work, if it failed
+        """
+        self.close(key, future)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        """
+        Run fn() once for all concurrent callers with the same key.
+
+        Args:
+            key: Hashable key identifying the work
+            fn: Zero-argument callable doing the work
+
+        Returns:
+            tuple: (result, shared) where shared is True if another caller did the work
+        """
+        future, leader = self.claim(key)
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+
+        self.resolve(key, future, result=result)
+        return result, False
+
+    def in_flight(self):
+        """Number of keys currently being worked on."""
+        with self._lock:
+            return len(self._calls)
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by an estimated memory budget."""
+
+    def __init__(self, max_bytes, size_of=None):
+        """
+        Initialise an empty cache.
+
+        Args:
+            max_bytes: Memory budget in bytes (None = unbounded)
+            size_of: Callable returning the size in bytes of a cached value (default: counts 1 per entry)
+        """
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda value: 1)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (value, size_bytes), least recently used first
+        self._loads = SingleFlight()
+
+        # counters for monitoring
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'load_failures': 0,
+            'evictions': 0,
+            'resident_bytes': 0
+        }
+
+    def get(self, key):
+        """
+        Look up a value and mark it as recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value, or None if missing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Insert a value, evicting least recently used entries to stay within budget.
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        size = self.size_of(value)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.stats['resident_bytes'] -= old[1]
+
+            self._entries[key] = (value, size)
+            self.stats['resident_bytes'] += size
+            self._evict()
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value, loading it on demand if missing.
+        Concurrent misses for the same key share a single load.
+
+        Args:
+            key: Cache key
+            loader: Zero-argument callable that produces the value
+
+        Returns:
+            Cached or freshly loaded value
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        def load():
+            # another caller may have finished loading between our miss and the claim
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+
+            try:
+                value = loader()
+            except Exception:
+                with self._lock:
+                    self.stats['load_failures'] += 1
+                raise
+
+            with self._lock:
+                self.stats['loads'] += 1
+            self.put(key, value)
+            return value
+
+        value, _ = self._loads.do(key, load)
+        return value
+
+    def evict(self, key):
+        """
+        Remove an entry if present.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            True if something was removed
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+
+            self.stats['resident_bytes'] -= entry[1]
+            self.stats['evictions'] += 1
+            return True
+
+    def _evict(self):
+        """Drop least recently used entries until within budget (lock must be held)."""
+        if self.max_bytes is None:
+            return
+
+        # always keep the newest entry, even if it alone is over budget
+        while self.stats['resident_bytes'] > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.stats['resident_bytes'] -= size
+            self.stats['evictions'] += 1
+
+    def keys(self):
+        """Cached keys, least recently used first."""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get_stats(self):
+        """
+        Snapshot of cache counters.
+
+        Returns:
+            Dictionary with hits, misses, loads, evictions, resident bytes and entry count
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['max_bytes'] = self.max_bytes
+            stats['loading'] = self._loads.in_flight()
+        return stats
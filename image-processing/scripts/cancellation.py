@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Cooperative cancellation for pipeline requests.
+A token carries a request's deadline and can be cancelled from outside (e.g. when the
+client disconnects); the pipeline checks it between stages and kills the Potrace
+subprocess through a callback, so abandoned requests stop using CPU.
+"""
+
+import time
+import threading
+
+# Reasons a token is cancelled with
+DEADLINE_EXCEEDED = 'deadline exceeded'
+CLIENT_DISCONNECTED = 'client disconnected'
+LEASE_LOST = 'lease lost'
+
+
+class Cancelled(Exception):
+    """Raised at a stage boundary once a request is cancelled or out of time."""
+
+    def __init__(self, reason, stage=None):
+        """
+        Describe the cancellation.
+
+        Args:
+            reason: Why the token was cancelled (e.g. DEADLINE_EXCEEDED)
+            stage: Stage that noticed it
+        """
+        super().__init__(f"Cancelled at {stage}: {reason}" if stage else f"Cancelled: {reason}")
+        self.reason = reason
+        self.stage = stage
+
+
+class CancellationToken:
+    """Thread-safe cancellation flag with an optional deadline."""
+
+    def __init__(self, timeout=None):
+        """
+        Initialise a live token.
+
+        Args:
+            timeout: Seconds from now until the token cancels itself (None = no deadline)
+        """
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+
+        self._lock = threading.Lock()
+        self._reason = None
+        self._callbacks = [] # called once on cancellation, e.g. to kill a subprocess
+
+    @property
+    def reason(self):
+        """Why the token was cancelled, or None while it is live (checks the deadline)."""
+        if self._reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+        return self._reason
+
+    @property
+    def cancelled(self):
+        """Whether the token was cancelled or its deadline has passed."""
+        return self.reason is not None
+
+    def cancel(self, reason='cancelled'):
+        """
+        Cancel the token and run its callbacks (only the first call has an effect).
+
+        Args:
+            reason: Why, reported by Cancelled
+        """
+        with self._lock:
+            if self._reason is not None:
+                return
+            self._reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass # e.g. the process already exited
+
+    def remaining(self):
+        """
+        Time left until the deadline.
+
+        Returns:
+            Seconds (0 when passed), or None without a deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self, stage=None):
+        """
+        Raise if the token is cancelled.
+
+        Args:
+            stage: Name of the stage about to run (for the error message)
+
+        Raises:
+            Cancelled
+        """
+        reason = self.reason
+        if reason is not None:
+            raise Cancelled(reason, stage)
+
+    def on_cancel(self, callback):
+        """
+        Register a callback for cancellation; runs immediately if already cancelled.
+
+        Args:
+            callback: Zero-argument callable
+
+        Returns:
+            Zero-argument callable that unregisters it
+        """
+        with self._lock:
+            if self._reason is None:
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+
+        callback()
+        return lambda: None
+
+
+def check(cancel_token, stage):
+    """
+    Raise Cancelled if a token is given and cancelled.
+
+    Args:
+        cancel_token: CancellationToken or None
+        stage: Name of the stage about to run
+    """
+    if cancel_token is not None:
+        cancel_token.check(stage)
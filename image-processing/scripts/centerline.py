@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Centerline (skeleton) tracing for line art.
+Thins the binary line mask to a one pixel wide skeleton, walks it into polylines,
+simplifies them and keeps the local stroke width, so every stroke becomes one
+open stroked path instead of a filled outline with two sides.
+"""
+
+import numpy as np
+from scipy import ndimage
+from skimage.morphology import skeletonize
+
+
+def _neighbour_offsets(row_stride):
+    """Flat index offsets of the 8 neighbours in a row-major array."""
+    return [
+        -row_stride - 1, -row_stride, -row_stride + 1,
+        -1, 1,
+        row_stride - 1, row_stride, row_stride + 1
+    ]
+
+
+def trace_skeleton(skeleton):
+    """
+    Walk a one pixel wide skeleton into pixel chains.
+    Chains run between nodes (end points and junctions, i.e. pixels without exactly
+    two neighbours); rings with no node become closed chains. Touching junction
+    pixels form one junction, so the steps between them are not chains of their own.
+
+    Args:
+        skeleton: HxW bool array
+
+    Returns:
+        List of (points, closed, start_junction, end_junction) where points is an (n, 2)
+        array of (row, col) pixels and the junction labels are 0 at free ends
+    """
+    padded = np.pad(skeleton.astype(bool), 1) # border of zeros, so neighbour lookups never wrap
+    stride = padded.shape[1]
+    offsets = _neighbour_offsets(stride)
+    eight_connected = np.ones((3, 3), dtype=np.uint8)
+
+    degree = ndimage.convolve(padded.astype(np.uint8), eight_connected, mode='constant') - padded
+    junctions, _ = ndimage.label(padded & (degree > 2), structure=eight_connected)
+
+    flat = padded.ravel().tolist()
+    is_node = ((degree.ravel() != 2) & padded.ravel()).tolist()
+    junction_of = junctions.ravel().tolist()
+    pixels = np.flatnonzero(padded).tolist()
+
+    visited = bytearray(len(flat)) # chain pixels already walked
+    node_links = set() # node-node steps already emitted
+    chains = []
+
+    def walk(start, step):
+        chain = [start, step]
+        previous, current = start, step
+        while not is_node[current]:
+            visited[current] = 1
+            following = None
+            for offset in offsets:
+                candidate = current + offset
+                if candidate != previous and flat[candidate] and not visited[candidate]:
+                    following = candidate
+                    if is_node[candidate]:
+                        break
+            if following is None:
+                break # ran back into an already walked part of a ring
+            previous, current = current, following
+            chain.append(current)
+        return chain
+
+    # chains starting at end points and junctions
+    for node in pixels:
+        if not is_node[node]:
+            continue
+        for offset in offsets:
+            step = node + offset
+            if not flat[step]:
+                continue
+            if is_node[step]:
+                if junction_of[node] and junction_of[node] == junction_of[step]:
+                    continue # inside one junction
+                link = (min(node, step), max(node, step))
+                if link not in node_links:
+                    node_links.add(link)
+                    chains.append(([node, step], False))
+            elif not visited[step]:
+                chains.append((walk(node, step), False))
+
+    # whatever is left are rings without any node
+    for pixel in pixels:
+        if visited[pixel] or is_node[pixel]:
+            continue
+        visited[pixel] = 1
+        following = next(pixel + o for o in offsets if flat[pixel + o])
+        chain = walk(pixel, following)
+        chains.append((chain, True))
+
+    result = []
+    for chain, closed in chains:
+        indices = np.asarray(chain)
+        points = np.column_stack([indices // stride - 1, indices % stride - 1])
+        start_junction = 0 if closed else junction_of[chain[0]]
+        end_junction = 0 if closed else junction_of[chain[-1]]
+        result.append((points, closed, start_junction, end_junction))
+
+    return result
+
+
+def _end_direction(points, side, reach=5):
+    """Unit direction pointing out of a chain at its start (side 0) or end (side 1)."""
+    if side == 0:
+        tip, inner = points[0], points[min(reach, len(points) - 1)]
+    else:
+        tip, inner = points[-1], points[max(len(points) - 1 - reach, 0)]
+    direction = (tip - inner).astype(np.float64)
+    norm = np.hypot(direction[0], direction[1])
+    return direction / norm if norm else direction
+
+
+def join_at_junctions(chains, join_angle=60.0):
+    """
+    Join chains that continue each other through a junction into longer strokes.
+    At each junction the pairs of chains that bend the least are joined first, as long
+    as the bend is under join_angle; the remaining chains stop at the junction.
+
+    Args:
+        chains: List from trace_skeleton()
+        join_angle: Largest change of direction (degrees) that still counts as one stroke
+
+    Returns:
+        List of (points, closed) strokes
+    """
+    min_alignment = np.cos(np.radians(join_angle))
+
+    incident = {} # junction label -> [(chain index, side)]
+    for index, (_, closed, start_junction, end_junction) in enumerate(chains):
+        if closed:
+            continue
+        for side, junction in ((0, start_junction), (1, end_junction)):
+            if junction:
+                incident.setdefault(junction, []).append((index, side))
+
+    links = {} # (chain, side) -> (chain, side) it continues into
+    for ends in incident.values():
+        directions = [_end_direction(chains[index][0], side) for index, side in ends]
+        pairs = []
+        for a in range(len(ends)):
+            for b in range(a + 1, len(ends)):
+                if ends[a][0] == ends[b][0]:
+                    continue # both ends of one chain
+                # outward directions point opposite ways when the stroke goes straight through
+                alignment = -float(np.dot(directions[a], directions[b]))
+                if alignment >= min_alignment:
+                    pairs.append((alignment, ends[a], ends[b]))
+        for _, end_a, end_b in sorted(pairs, key=lambda pair: -pair[0]):
+            if end_a not in links and end_b not in links:
+                links[end_a] = end_b
+                links[end_b] = end_a
+
+    used = [False] * len(chains)
+    strokes = []
+
+    def follow(index, entry_side):
+        pieces = []
+        while True:
+            used[index] = True
+            points = chains[index][0]
+            pieces.append(points if entry_side == 0 else points[::-1])
+            following = links.get((index, 1 - entry_side))
+            if following is None or used[following[0]]:
+                return np.vstack(pieces), following is not None
+            index, entry_side = following
+
+    # strokes with a free end first, then whatever is left forms loops of joined chains
+    for index, (points, closed, _, _) in enumerate(chains):
+        if used[index]:
+            continue
+        if closed:
+            used[index] = True
+            strokes.append((points, True))
+        elif (index, 0) not in links:
+            strokes.append((follow(index, 0)[0], False))
+        elif (index, 1) not in links:
+            strokes.append((follow(index, 1)[0], False))
+
+    for index in range(len(chains)):
+        if not used[index]:
+            strokes.append(follow(index, 0))
+
+    return strokes
+
+
+def simplify_polyline(points, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification.
+
+    Args:
+        points: (n, 2) array
+        tolerance: Maximum distance a dropped point may be from the simplified line
+
+    Returns:
+        (m, 2) array with the kept points (first and last always kept)
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return points
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        start = points[first]
+        direction = points[last] - start
+        length = np.hypot(direction[0], direction[1])
+        offsets = points[first + 1:last] - start
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return points[keep]
+
+
+def polyline_length(points):
+    """Total length of a polyline."""
+    if len(points) < 2:
+        return 0.0
+    steps = np.diff(points, axis=0)
+    return float(np.hypot(steps[:, 0], steps[:, 1]).sum())
+
+
+def smooth_segments(points, closed):
+    """
+    Catmull-Rom spline through the points, as cubic Bézier segments.
+
+    Args:
+        points: (n, 2) array of on-curve points
+        closed: Whether the polyline is a ring (first point not repeated at the end)
+
+    Returns:
+        List of (x1, y1, x2, y2, x, y) cubics continuing from points[0]
+    """
+    n = len(points)
+    if closed:
+        padded = np.vstack([points[-1:], points, points[:2]])
+        count = n
+    else:
+        padded = np.vstack([points[:1], points, points[-1:]])
+        count = n - 1
+
+    segments = []
+    for i in range(count):
+        p0, p1, p2, p3 = padded[i], padded[i + 1], padded[i + 2], padded[i + 3]
+        c1 = p1 + (p2 - p0) / 6.0
+        c2 = p2 - (p3 - p1) / 6.0
+        segments.append((c1[0], c1[1], c2[0], c2[1], p2[0], p2[1]))
+
+    return segments
+
+
+def trace_centerlines(mask, tolerance=1.0, min_length=4.0, smooth=True, join_angle=60.0, width_step=0.5):
+    """
+    Trace the centerlines of a binary line mask into stroked paths.
+    Every connected stroke network becomes one path (one subpath per stroke), like
+    Potrace's one path per connected shape, so editing and locking stay per drawing element.
+
+    Args:
+        mask: HxW bool array (True = line pixel)
+        tolerance: Simplification tolerance in pixels
+        min_length: Drop specks and spurs (branches with a free end) shorter than this many pixels
+        smooth: Fit Catmull-Rom curves through the simplified points instead of straight lines
+        join_angle: Largest bend (degrees) at which strokes are joined through a junction
+        width_step: Stroke widths are rounded to a multiple of this
+
+    Returns:
+        Document dict in the shape used by svg_writer.write_svg(), with a 'stroke' colour
+        and a 'stroke_width' on every path; coordinates are in pixels (y down)
+    """
+    height, width = mask.shape
+
+    skeleton = skeletonize(mask)
+    # distance to the background at a skeleton pixel is about half the stroke width (plus the pixel itself)
+    distance = ndimage.distance_transform_edt(mask)
+    components, _ = ndimage.label(skeleton, structure=np.ones((3, 3), dtype=np.uint8))
+
+    # skeletonization leaves short spurs at stroke corners and ends; drop them before joining
+    chains = [
+        chain for chain in trace_skeleton(skeleton)
+        if polyline_length(chain[0]) >= min_length or (chain[2] and chain[3])
+    ]
+
+    grouped = {} # component label -> (subpaths, skeleton pixels)
+    for pixels, closed in join_at_junctions(chains, join_angle):
+        points = pixels[:, ::-1].astype(np.float64) + 0.5 # (row, col) -> pixel centre (x, y)
+
+        if closed:
+            # simplify the ring as a path that returns to its start, then drop the repeated end
+            points = simplify_polyline(np.vstack([points, points[:1]]), tolerance)[:-1]
+            if len(points) < 3:
+                closed = False
+                points = np.vstack([points, points[:1]])
+        else:
+            points = simplify_polyline(points, tolerance)
+
+        if smooth and len(points) > 2:
+            segments = smooth_segments(points, closed)
+        else:
+            segments = [tuple(point) for point in points[1:]]
+
+        subpaths, component_pixels = grouped.setdefault(components[pixels[0, 0], pixels[0, 1]], ([], []))
+        subpaths.append({'start': tuple(points[0]), 'segments': segments, 'closed': closed})
+        component_pixels.append(pixels)
+
+    paths = []
+    for label in sorted(grouped):
+        subpaths, component_pixels = grouped[label]
+        pixels = np.vstack(component_pixels)
+
+        if len(pixels) < min_length:
+            continue # tiny ring
+
+        stroke_width = max(1.0, 2.0 * float(np.median(distance[pixels[:, 0], pixels[:, 1]])) - 1.0)
+        stroke_width = round(stroke_width / width_step) * width_step
+
+        paths.append({'subpaths': subpaths, 'stroke_width': stroke_width})
+
+    return {
+        'width': f"{width}pt",
+        'height': f"{height}pt",
+        'viewbox': [0, 0, width, height],
+        'transform': None,
+        'transform_attr': None,
+        'fill': 'none',
+        'stroke': '#000000',
+        'paths': paths
+    }
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+HTTP content-encoding helpers for API responses.
+Negotiates gzip or brotli from Accept-Encoding and compresses file chunks as they are sent;
+JSON responses go through NegotiatedGZipMiddleware, which uses the same negotiation.
+Brotli is optional: without the brotli package only gzip is offered.
+"""
+
+import zlib
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    import brotli
+except ImportError: # optional dependency
+    brotli = None
+
+# Read size for streamed files
+CHUNK_SIZE = 64 * 1024
+
+# Preferred first when the client accepts several equally
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding, supported=SUPPORTED_ENCODINGS):
+    """
+    Pick a content encoding from an Accept-Encoding header.
+
+    Args:
+        accept_encoding: Header value, e.g. 'gzip, deflate, br;q=0.9' (None or '' = no compression)
+        supported: Encodings to choose from, most preferred first
+
+    Returns:
+        'br', 'gzip' or None for identity
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(','):
+        parts = [part.strip() for part in item.split(';')]
+        coding = parts[0].lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            if param.lower().startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        weights[coding] = quality
+
+    wildcard = weights.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for coding in supported:
+        quality = weights.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+
+    return best
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield a file's contents in chunks.
+
+    Args:
+        path: File path
+        chunk_size: Bytes per chunk
+
+    Yields:
+        bytes
+    """
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def compress_chunks(chunks, encoding):
+    """
+    Compress a stream of chunks incrementally.
+
+    Args:
+        chunks: Iterable of bytes
+        encoding: 'br', 'gzip' or None (chunks are passed through)
+
+    Yields:
+        Encoded bytes
+    """
+    if encoding is None:
+        yield from chunks
+        return
+
+    if encoding == 'br':
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=5) # quality 5: fast enough to stream
+        compress, finish = compressor.process, compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16 + MAX_WBITS writes a gzip wrapper
+        compress, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f"Unsupported encoding '{encoding}'")
+
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+class NegotiatedGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that honours q-values. Starlette's gzips whenever 'gzip' appears in
+    Accept-Encoding, even as 'gzip;q=0'; this one only does when negotiate_encoding() would
+    pick gzip, the same rule the streamed SVG responses follow.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and negotiate_encoding(Headers(scope=scope).get('accept-encoding'), ('gzip',)) is None:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
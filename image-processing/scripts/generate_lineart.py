@@ -9,22 +9,42 @@ import time
 import json
 from pathlib import Path
 
+import cv2
+import numpy as np
 import torch
 import torchvision.transforms as transforms
-from PIL import Image
+import torchvision.transforms.v2.functional as TF
 
 from model import Generator
+from cache import LRUCache
+from bitmap import binarize
+
+
+def model_size_bytes(model):
+    """
+    Estimate the memory held by a model's parameters and buffers.
+
+    Args:
+        model: torch.nn.Module
+
+    Returns:
+        Size in bytes
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
 
 
 class LineArtGenerator:
     """Generates line art from photos using pre-trained models."""
     
-    def __init__(self, models_dir='../models'):
+    def __init__(self, models_dir='../models', cache_max_bytes=None):
         """
-        Initialiser for LineArtGenerator object that loads the pre-trained models when instantiated.
+        Initialiser for LineArtGenerator object. Models are loaded on demand and kept in a bounded cache.
 
         Args:
             models_dir: Path to directory containing model folders (default: '../models')
+            cache_max_bytes: Memory budget for loaded models; least recently used styles are evicted
+                when it is exceeded (default: None = keep every loaded model)
         """
 
         self.models_dir = Path(models_dir)
@@ -37,7 +57,8 @@ class LineArtGenerator:
         else:
             self.device = torch.device('cpu')
             
-        self.models = {} # dict to store loaded models for reuse
+        # LRU cache of loaded models so idle styles can be evicted when many styles are shipped
+        self.models = LRUCache(max_bytes=cache_max_bytes, size_of=model_size_bytes)
         
         # Models and their configurations
         self.styles = {
@@ -55,11 +76,18 @@ class LineArtGenerator:
             }
         }
         
-        # Image preprocessing (resize to 256x256 and convert to tensor)
-        self.transform = transforms.Compose([
-            transforms.Resize(256, Image.BICUBIC),
-            transforms.ToTensor()
-        ])
+        # Shorter side of the model input; images are resized to this before inference
+        self.input_size = 256
+
+        # Input sizing policy: shorter side per quality level, stepped down the ladder under load
+        self.quality_sizes = {
+            'fast': 192,
+            'balanced': 256, # the size the models were trained at
+            'high': 512
+        }
+        self.size_ladder = [128, 192, 256, 384, 512]
+        self.load_step = 2 # drop one rung for every 2 requests waiting behind this one
+        self.max_aspect_ratio = 3.0 # long side is capped at 3x the short side's size to bound pixel count
     
     def load_model(self, style):
         """
@@ -80,10 +108,19 @@ class LineArtGenerator:
         if style not in self.styles:
             raise ValueError(f"Invalid style '{style}'. Choose 'contour' or 'anime'.")
         
-        # If the model is already loaded, return it from the cache (reuse)
-        if style in self.models:
-            return self.models[style]
-        
+        # Reuse the cached model, or load it once even if several requests ask for it at the same time
+        return self.models.get_or_load(style, lambda: self._load_from_disk(style))
+
+    def _load_from_disk(self, style):
+        """
+        Build a Generator for the style and load its weights from disk.
+
+        Args:
+            style: Style name (already validated)
+
+        Returns:
+            Loaded model in evaluation mode on the selected device
+        """
         # get the configuration for this particular style
         config = self.styles[style]
         model_path = config['path']
@@ -106,11 +143,96 @@ class LineArtGenerator:
         model.to(self.device) # move model to the selected device
         model.eval() # set model to evaluation mode
         
-        # Store/cache the loaded model so we don't have to load it again later
-        self.models[style] = model
-        
         return model
+
+    def get_cache_stats(self):
+        """
+        Model cache metrics (loads, evictions, resident bytes, loaded styles).
+
+        Returns:
+            Dictionary of cache counters
+        """
+        stats = self.models.get_stats()
+        stats['loaded_styles'] = self.models.keys()
+        return stats
     
+    def choose_input_size(self, width, height, quality='balanced', queue_depth=0):
+        """
+        Pick the model input resolution (shorter side) for a request.
+
+        Starts from the quality level's size, steps down one rung of the ladder for every
+        load_step requests in the queue, never upscales past the image itself (small images
+        still go up to the default size), and shrinks very elongated images so the total
+        pixel count stays bounded.
+
+        Args:
+            width: Image width in pixels
+            height: Image height in pixels
+            quality: 'fast', 'balanced' or 'high'
+            queue_depth: Number of other requests waiting or running
+
+        Returns:
+            Shorter side in pixels (multiple of 4 so the output matches the input size)
+        """
+        if quality not in self.quality_sizes:
+            raise ValueError(f"Invalid quality '{quality}'. Choose 'fast', 'balanced' or 'high'.")
+
+        size = self.quality_sizes[quality]
+
+        # Degrade gracefully under load instead of timing out
+        steps_down = max(0, queue_depth) // self.load_step
+        if steps_down:
+            # highest rung not above the requested size, then step down from there
+            rung = max(i for i, s in enumerate(self.size_ladder) if s <= size)
+            size = self.size_ladder[max(0, rung - steps_down)]
+
+        short_side = min(width, height)
+        long_side = max(width, height)
+
+        # No point inventing detail the photo doesn't have (small photos still go up to the trained size)
+        size = max(self.size_ladder[0], min(size, max(short_side, self.input_size)))
+
+        # Bound the long side for panoramas and other extreme aspect ratios
+        # (applied after the ladder floor, so such images may go below the lowest rung)
+        scaled_long_side = long_side * size / short_side
+        max_long_side = self.quality_sizes[quality] * self.max_aspect_ratio
+        if scaled_long_side > max_long_side:
+            size = int(size * max_long_side / scaled_long_side)
+
+        # The generator downsamples twice by 2, so keep sizes divisible by 4
+        size = max(4, size - size % 4)
+
+        return size
+
+    def choose_region_size(self, width, height, detail=2.0):
+        """
+        Pick the model input resolution (shorter side) for re-rendering one region of a drawing.
+
+        The region is rendered at detail times the drawing's own scale, within the 'high'
+        quality size and the same aspect ratio bound as choose_input_size(), so the work
+        follows the size of the region rather than the photo.
+
+        Args:
+            width: Region width in drawing pixels
+            height: Region height in drawing pixels
+            detail: Resolution relative to the drawing (2.0 = twice as many pixels per side)
+
+        Returns:
+            Shorter side in pixels (multiple of 4)
+        """
+        short_side = max(1.0, min(width, height))
+        long_side = max(width, height, 1.0)
+
+        size = max(self.size_ladder[0], min(short_side * detail, self.quality_sizes['high']))
+
+        scaled_long_side = long_side * size / short_side
+        max_long_side = self.quality_sizes['high'] * self.max_aspect_ratio
+        if scaled_long_side > max_long_side:
+            size = size * max_long_side / scaled_long_side
+
+        size = int(size)
+        return max(4, size - size % 4)
+
     def generate(self, input_path, output_path, style='contour'):
         """
         Generate line art from a photo.
@@ -142,24 +264,18 @@ class LineArtGenerator:
             if not os.path.exists(input_path):
                 raise FileNotFoundError(f"Input image not found: {input_path}")
             
-            image = Image.open(input_path).convert('RGB')
+            image = cv2.imread(input_path) # BGR uint8 array
+            if image is None:
+                raise ValueError(f"Could not load image: {input_path}")
             
-            # Load model
-            model = self.load_model(style)
-            
-            # specifies batch size of 1, and moves the input tensor to device
-            input_tensor = self.transform(image).unsqueeze(0).to(self.device)
-            
-            # Generate line art
-            with torch.no_grad():
-                output_tensor = model(input_tensor)
-            
-            # Convert to PIL Image
-            output_image = transforms.ToPILImage()(output_tensor.squeeze(0).cpu())
+            # Run the tensor-native path
+            array_result = self.generate_array(image, style=style, channel_order='bgr')
+            if not array_result['success']:
+                raise RuntimeError(array_result['error'])
             
             # Save
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            output_image.save(output_path)
+            cv2.imwrite(output_path, array_result['lineart'])
             
             # Success
             result['success'] = True
@@ -172,6 +288,85 @@ class LineArtGenerator:
         
         return result
 
+    def generate_array(self, image, style='contour', channel_order='rgb', threshold=None, input_size=None):
+        """
+        Generate line art from an in-memory image without any PIL round-trips.
+
+        The uint8 array is wrapped with torch.from_numpy (zero-copy), resized while still uint8,
+        and only converted to float once as the model input. The output is returned as uint8,
+        or, if a threshold is given, binarized on the output tensor and returned as a packed bitmap.
+
+        Args:
+            image: HxWx3 uint8 NumPy array
+            style: 'contour' or 'anime'
+            channel_order: 'rgb', or 'bgr' for arrays coming from cv2.imread
+            threshold: None to return grey line art, 'otsu' or an int grey level to return a packed bitmap
+            input_size: Shorter side of the model input (default: self.input_size), see choose_input_size()
+
+        Returns:
+            dictionary with:
+                success (bool): Whether generation succeeded
+                lineart (np.ndarray): HxW uint8 line art (black lines on white), None if thresholded
+                bitmap (PackedBitmap): 1-bit line art for the tracer, None if not thresholded
+                input_size (list): [width, height] of the model input
+                processing_time (float): Time taken in seconds
+                error (str): Error message if failed
+        """
+        start_time = time.time()
+
+        result = {
+            'success': False,
+            'lineart': None,
+            'bitmap': None,
+            'input_size': None,
+            'processing_time': 0.0,
+            'error': None
+        }
+
+        try:
+            if image is None or image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+                raise ValueError("Expected an HxWx3 uint8 image array")
+
+            # Load model
+            model = self.load_model(style)
+
+            # HWC view of the NumPy buffer as CHW (no copy), then resize while still uint8
+            image_tensor = torch.from_numpy(image).permute(2, 0, 1)
+            resized = TF.resize(
+                image_tensor,
+                [input_size or self.input_size], # shorter side to input_size, keeping aspect ratio (same as transforms.Resize(256))
+                interpolation=transforms.InterpolationMode.BICUBIC,
+                antialias=True
+            )
+            if channel_order == 'bgr':
+                resized = resized[[2, 1, 0]] # the model expects RGB; reordering the small tensor is cheap
+
+            # batch of 1 on the device, converted to float in [0, 1] - the only float copy of the input
+            input_tensor = resized.unsqueeze(0).to(self.device).float().div_(255)
+
+            # Generate line art
+            with torch.no_grad():
+                output_tensor = model(input_tensor)
+
+            # Scale the sigmoid output in place and truncate to uint8 (same as ToPILImage)
+            lineart = output_tensor[0, 0].mul_(255).to(torch.uint8)
+
+            if threshold is None:
+                result['lineart'] = lineart.cpu().numpy()
+            else:
+                # Fused post-processing: threshold on the output tensor and pack to 1 bit per pixel
+                result['bitmap'] = binarize(lineart, threshold)
+
+            result['success'] = True
+            result['input_size'] = [int(input_tensor.shape[3]), int(input_tensor.shape[2])]
+            result['processing_time'] = time.time() - start_time
+
+        except Exception as e:
+            result['error'] = str(e)
+            result['processing_time'] = time.time() - start_time
+
+        return result
+
 
 def main():
     """CLI program for testing."""
@@ -29,6 +29,10 @@ CONFIG = {
 }
 
 
+class InvalidImage(ValueError):
+    """Raised when the input cannot be read as an image, so callers can tell bad input from a failed run."""
+
+
 def load_image(image_path):
     """
     Load image once for all analysis functions and return both color and grayscale versions.
@@ -44,7 +48,7 @@ def load_image(image_path):
     
     # Check if image loaded successfully
     if color_image is None:
-        raise ValueError(f"Could not load image: {image_path}")
+        raise InvalidImage(f"Could not load image: {image_path}")
     
     # Convert to grayscale
     gray_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
@@ -52,6 +56,25 @@ def load_image(image_path):
     return color_image, gray_image
 
 
+def decode_image(image_bytes):
+    """
+    Decode an encoded image (e.g. an uploaded JPEG or PNG) without going through a file.
+    
+    Args:
+        image_bytes: Encoded image bytes
+        
+    Returns:
+        BGR image array
+    """
+    color_image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    
+    # Check if image decoded successfully
+    if color_image is None:
+        raise InvalidImage("Could not decode image")
+    
+    return color_image
+
+
 def check_luminance(gray_image):
     """
     Check image brightness and uneven lighting.
@@ -301,6 +324,23 @@ def analyse_image(image_path):
     # Load image once
     color_image, gray_image = load_image(image_path)
     
+    return analyse_image_array(color_image, gray_image)
+
+
+def analyse_image_array(color_image, gray_image=None):
+    """
+    Run all analysis functions on an already decoded image.
+    
+    Args:
+        color_image: BGR image array (from cv2.imread / cv2.imdecode)
+        gray_image: Grayscale version, computed if not given
+        
+    Returns:
+        Dictionary with all analysis results
+    """
+    if gray_image is None:
+        gray_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
+    
     # Run all checks
     luminance = check_luminance(gray_image)
     blur = detect_blur(gray_image)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Durable job queue for callback jobs, backed by SQLite (WAL).
+Accepted jobs are committed before the client gets its 202, so a crash or a deploy restart
+loses nothing: a job runs under a lease that its worker keeps renewing with heartbeats, and
+a job whose lease runs out (its process died) is picked up again, up to a maximum number of
+attempts. All writes go through one writer thread that commits them in batches, so many
+enqueues and heartbeats cost one fsync between them instead of one each.
+"""
+
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Writes committed together at most, and how long the writer waits for more before committing
+MAX_BATCH = 256
+BATCH_WINDOW_S = 0.002
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    payload BLOB,                 -- uploaded image, dropped once the job is finished
+    spec TEXT NOT NULL,           -- JSON options
+    callback_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,   -- not claimed before this time (retry backoff)
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,                  -- JSON outcome once finished
+    notified INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, available_at);
+CREATE INDEX IF NOT EXISTS jobs_notify ON jobs (notified, state);
+"""
+
+
+class JobQueue:
+    """SQLite-backed queue with leases, heartbeats, retries and batched commits."""
+
+    def __init__(self, path, lease_s=30.0, max_attempts=3, retention_s=86400.0):
+        """
+        Open (or create) the queue and start its writer.
+
+        Args:
+            path: SQLite database file
+            lease_s: Seconds a claimed job stays owned without a heartbeat
+            max_attempts: Claims per job before it is failed for good (a job whose process keeps
+                dying is not retried forever)
+            retention_s: Seconds finished jobs are kept for status lookups
+        """
+        self.path = str(path)
+        self.lease_s = lease_s
+        self.max_attempts = max(1, max_attempts)
+        self.retention_s = retention_s
+
+        self._writer_db = self._connect()
+        self._writer_db.executescript(SCHEMA)
+        self._reader_db = self._connect()
+        self._reader_lock = threading.Lock()
+
+        self._writes = queue.Queue()
+        self._last_prune = 0.0
+        self._writer = threading.Thread(target=self._write_loop, name='job-queue-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        """Connection in WAL mode; NORMAL sync is durable across process crashes (not power loss)."""
+        db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def enqueue(self, job_id, payload, spec, callback_url=None):
+        """
+        Store a new job; returns once it is committed.
+
+        Args:
+            job_id: Unique id (the request id)
+            payload: Uploaded image bytes
+            spec: JSON-serialisable job options
+            callback_url: Where the outcome goes, if anywhere
+        """
+        now = time.time()
+        self._write(
+            "INSERT INTO jobs (id, state, payload, spec, callback_url, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, sqlite3.Binary(payload), json.dumps(spec), callback_url, now, now, now)
+        ).result()
+
+    def claim(self, owner):
+        """
+        Take the oldest job that is due: queued, or running under an expired lease (its worker died).
+
+        Args:
+            owner: Id of the claiming worker
+
+        Returns:
+            dict with id, payload, spec, callback_url and attempts (this claim included; more than
+            max_attempts means every earlier worker died mid-run, and the job should be failed), or None
+        """
+        return self._submit(self._claim, owner).result()
+
+    def heartbeat(self, job_id, owner):
+        """
+        Extend a job's lease (committed with the next batch).
+
+        Args:
+            job_id: Claimed job
+            owner: Its worker
+
+        Returns:
+            True, or False if the job is no longer this worker's (its lease ran out and it was taken over)
+        """
+        now = time.time()
+        return self._write(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+            (now + self.lease_s, now, job_id, RUNNING, owner)
+        ).result() > 0
+
+    def complete(self, job_id, owner, result):
+        """
+        Finish a job; its image is dropped and its outcome kept for status lookups and the callback.
+
+        Args:
+            job_id: Claimed job
+            owner: Its worker
+            result: JSON-serialisable outcome
+
+        Returns:
+            DONE, or None if the job is no longer this worker's (its lease ran out)
+        """
+        return self._finish(job_id, owner, DONE, result)
+
+    def fail(self, job_id, owner, result, retry_in=None, count_attempt=True):
+        """
+        Record a failed attempt: the job is queued again after retry_in seconds while it has
+        attempts left, and failed for good otherwise.
+
+        Args:
+            job_id: Claimed job
+            owner: Its worker
+            result: JSON-serialisable outcome of the attempt (kept if this was the last one)
+            retry_in: Seconds until the retry (None = don't retry)
+            count_attempt: False when the attempt never started (e.g. the job was shed), so it
+                doesn't use up one of the job's attempts
+
+        Returns:
+            QUEUED (will be retried), FAILED, or None if the job is no longer this worker's
+        """
+        if retry_in is None:
+            return self._finish(job_id, owner, FAILED, result)
+        return self._submit(self._retry, job_id, owner, result, retry_in, count_attempt).result()
+
+    def release(self, owner):
+        """
+        Put the jobs a worker is running back in the queue without using up an attempt, e.g. when
+        the process shuts down for a deploy, so the next process picks them up straight away
+        instead of after their leases run out.
+
+        Args:
+            owner: Worker (or process) id the jobs were claimed with
+
+        Returns:
+            Number of jobs released
+        """
+        now = time.time()
+        return self._write(
+            "UPDATE jobs SET state = ?, attempts = MAX(attempts - 1, 0), available_at = ?, lease_owner = NULL, "
+            "lease_expires = NULL, updated_at = ? WHERE state = ? AND lease_owner = ?",
+            (QUEUED, now, now, RUNNING, owner)
+        ).result()
+
+    def mark_notified(self, job_id):
+        """
+        Record that a finished job's callback was delivered (or given up on), so it isn't resent
+        after a restart. Doesn't wait for the commit.
+
+        Args:
+            job_id: Finished job
+        """
+        self._write("UPDATE jobs SET notified = 1, updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def unnotified(self):
+        """
+        Finished jobs whose callback may not have gone out (the process stopped before it did).
+
+        Returns:
+            List of dicts with id, callback_url and result
+        """
+        rows = self._read(
+            "SELECT id, callback_url, result FROM jobs WHERE notified = 0 AND state IN (?, ?) "
+            "AND callback_url IS NOT NULL",
+            (DONE, FAILED)
+        )
+        return [{'id': row[0], 'callback_url': row[1], 'result': json.loads(row[2])} for row in rows]
+
+    def get(self, job_id):
+        """
+        State of a job.
+
+        Args:
+            job_id: Job id
+
+        Returns:
+            dict with id, state, attempts, created_at, updated_at and result (None until finished),
+            or None for an unknown (or pruned) job
+        """
+        rows = self._read(
+            "SELECT id, state, attempts, created_at, updated_at, result FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        job_id, state, attempts, created_at, updated_at, result = rows[0]
+        return {
+            'id': job_id,
+            'state': state,
+            'attempts': attempts,
+            'created_at': created_at,
+            'updated_at': updated_at,
+            'result': json.loads(result) if result and state in (DONE, FAILED) else None
+        }
+
+    def get_stats(self):
+        """
+        Job counts.
+
+        Returns:
+            dict of state -> number of jobs, plus pending_writes (not yet committed)
+        """
+        counts = dict(self._read("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return {
+            **{state: counts.get(state, 0) for state in (QUEUED, RUNNING, DONE, FAILED)},
+            'pending_writes': self._writes.qsize()
+        }
+
+    def close(self):
+        """Commit what is pending and stop the writer."""
+        self._writes.put(None)
+        self._writer.join()
+        self._writer_db.close()
+        self._reader_db.close()
+
+    def _read(self, sql, params=()):
+        """Run a query on the reader connection (WAL readers don't block the writer)."""
+        with self._reader_lock:
+            return self._reader_db.execute(sql, params).fetchall()
+
+    def _write(self, sql, params):
+        """Queue a write statement for the next batch."""
+        return self._submit(lambda db: db.execute(sql, params).rowcount)
+
+    def _submit(self, operation, *args):
+        """
+        Queue an operation for the writer thread.
+
+        Args:
+            operation: Function called with the writer connection (inside the batch's transaction)
+            *args: Its other arguments
+
+        Returns:
+            Future set once the batch holding it is committed
+        """
+        future = Future()
+        self._writes.put((future, operation, args))
+        return future
+
+    def _claim(self, db, owner):
+        """Claim the oldest due job (writer thread, inside a transaction)."""
+        now = time.time()
+        row = db.execute(
+            "SELECT id, payload, spec, callback_url, attempts FROM jobs "
+            "WHERE (state = ? AND available_at <= ?) OR (state = ? AND lease_expires < ?) "
+            "ORDER BY available_at LIMIT 1",
+            (QUEUED, now, RUNNING, now)
+        ).fetchone()
+        if row is None:
+            return None
+
+        job_id, payload, spec, callback_url, attempts = row
+        db.execute(
+            "UPDATE jobs SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated_at = ? "
+            "WHERE id = ?",
+            (RUNNING, owner, now + self.lease_s, now, job_id)
+        )
+        return {
+            'id': job_id,
+            'payload': bytes(payload),
+            'spec': json.loads(spec),
+            'callback_url': callback_url,
+            'attempts': attempts + 1
+        }
+
+    def _retry(self, db, job_id, owner, result, retry_in, count_attempt):
+        """Queue a job again after a failed attempt, or fail it if it has none left (writer thread)."""
+        now = time.time()
+        attempts = db.execute(
+            "SELECT attempts FROM jobs WHERE id = ? AND state = ? AND lease_owner = ?", (job_id, RUNNING, owner)
+        ).fetchone()
+        if attempts is None:
+            return None # no longer ours (lease expired and another worker took it)
+
+        attempts = attempts[0] if count_attempt else attempts[0] - 1
+        if attempts >= self.max_attempts:
+            return self._finish_in(db, job_id, owner, FAILED, result)
+
+        db.execute(
+            "UPDATE jobs SET state = ?, attempts = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL, "
+            "updated_at = ? WHERE id = ?",
+            (QUEUED, attempts, now + retry_in, now, job_id)
+        )
+        return QUEUED
+
+    def _finish(self, job_id, owner, state, result):
+        """Move a job to DONE or FAILED and wait for the commit."""
+        return self._submit(self._finish_in, job_id, owner, state, result).result()
+
+    def _finish_in(self, db, job_id, owner, state, result):
+        """Move a job to DONE or FAILED (writer thread); None if it is no longer this worker's."""
+        updated = db.execute(
+            "UPDATE jobs SET state = ?, payload = NULL, result = ?, lease_owner = NULL, lease_expires = NULL, "
+            "updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+            (state, json.dumps(result), time.time(), job_id, RUNNING, owner)
+        ).rowcount
+        return state if updated else None
+
+    def _write_loop(self):
+        """Writer thread: run queued operations in batches, one transaction (and commit) per batch."""
+        while True:
+            item = self._writes.get()
+            batch = [item]
+            deadline = time.monotonic() + BATCH_WINDOW_S
+            while item is not None and len(batch) < MAX_BATCH:
+                try:
+                    item = self._writes.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            operations = [entry for entry in batch if entry is not None]
+            if operations:
+                self._run_batch(operations)
+            if None in batch:
+                return
+
+    def _run_batch(self, operations):
+        """Run operations in one transaction; one that fails doesn't take the others down."""
+        db = self._writer_db
+        results = []
+        try:
+            db.execute('BEGIN IMMEDIATE') # take the write lock up front (other API processes may share the file)
+            for future, operation, args in operations:
+                db.execute('SAVEPOINT operation')
+                try:
+                    results.append((future, operation(db, *args), None))
+                    db.execute('RELEASE operation')
+                except Exception as e:
+                    db.execute('ROLLBACK TO operation')
+                    db.execute('RELEASE operation')
+                    results.append((future, None, e))
+
+            self._prune(db)
+            db.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"Job queue commit failed: {e}")
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            results = [(future, None, e) for future, _, _ in operations]
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _prune(self, db):
+        """Delete finished jobs past the retention time (at most once a minute)."""
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        db.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND notified = 1 AND updated_at < ?",
+            (DONE, FAILED, now - self.retention_s)
+        )
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Process metrics in the Prometheus text exposition format.
+Histograms and counters write into per-thread shards, so recording a sample on the hot path
+takes no lock (only a thread's first sample registers its shard); a scrape merges the shards.
+Gauges and externally kept counters (cache stats, admission state) are read at scrape time.
+"""
+
+import math
+import bisect
+import threading
+
+# Latency buckets in seconds, from fast stages (decode, serialization) up to the 60s request budget
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _ShardedMetric:
+    """Base for metrics recorded into thread-local shards."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        """
+        Initialise an empty metric.
+
+        Args:
+            name: Metric name
+            help_text: HELP line
+            labelnames: Names of the labels every sample carries
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+        self._local = threading.local()
+        self._lock = threading.Lock() # only guards the shard list
+        self._shards = [] # one dict per thread: label values -> sample state
+
+    def _shard(self):
+        """This thread's shard, registering it on first use."""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _key(self, labels):
+        """Label values in labelnames order."""
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _snapshot(self):
+        """Copy of every shard (a sample being recorded meanwhile may land in the next scrape)."""
+        with self._lock:
+            shards = list(self._shards)
+        return [list(shard.items()) for shard in shards]
+
+
+class Counter(_ShardedMetric):
+    """Monotonic counter."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Add to the counter.
+
+        Args:
+            amount: Non-negative increment
+            **labels: Label values
+        """
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def collect(self):
+        """
+        Merged values.
+
+        Returns:
+            List of (suffix, label dict, value)
+        """
+        totals = {}
+        for items in self._snapshot():
+            for key, value in items:
+                totals[key] = totals.get(key, 0) + value
+        return [('_total', dict(zip(self.labelnames, key)), value) for key, value in sorted(totals.items())]
+
+
+class Histogram(_ShardedMetric):
+    """Cumulative histogram with fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Initialise an empty histogram.
+
+        Args:
+            name: Metric name
+            help_text: HELP line
+            labelnames: Names of the labels every sample carries
+            buckets: Sorted upper bounds (+Inf is added)
+        """
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Record one sample.
+
+        Args:
+            value: Observed value (seconds for latencies)
+            **labels: Label values
+        """
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # per-bucket counts (not cumulative) plus +Inf, then sum
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def collect(self):
+        """
+        Merged buckets, sums and counts.
+
+        Returns:
+            List of (suffix, label dict, value)
+        """
+        merged = {}
+        for items in self._snapshot():
+            for key, (counts, total) in items:
+                entry = merged.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+        samples = []
+        for key, (counts, total) in sorted(merged.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class CallbackMetric:
+    """Gauge or counter whose values are read from elsewhere at scrape time."""
+
+    def __init__(self, name, help_text, kind, collect_fn):
+        """
+        Initialise the metric.
+
+        Args:
+            name: Metric name (counters get a _total suffix)
+            help_text: HELP line
+            kind: 'gauge' or 'counter'
+            collect_fn: Zero-argument callable returning a list of (label dict, value)
+        """
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.collect_fn = collect_fn
+
+    def collect(self):
+        """
+        Current values.
+
+        Returns:
+            List of (suffix, label dict, value)
+        """
+        suffix = '_total' if self.kind == 'counter' else ''
+        return [(suffix, labels, value) for labels, value in self.collect_fn()]
+
+
+class Registry:
+    """Set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """
+        Add a metric.
+
+        Args:
+            metric: Counter, Histogram or CallbackMetric
+
+        Returns:
+            The metric
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Text exposition of every metric.
+
+        Returns:
+            String in the Prometheus text format (version 0.0.4)
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                samples = metric.collect()
+            except Exception:
+                continue # a failing source shouldn't break the whole scrape
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    """{name="value",...} with escaped values, or '' without labels."""
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """Sample value as Prometheus writes it."""
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+# Wall time of each pipeline stage; the per-style stages record one sample per style
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pipeline_stage_seconds',
+    'Time spent in each pipeline stage (decode, analysis, preprocessing, inference, tracing, serialization).',
+    labelnames=('stage',)
+))
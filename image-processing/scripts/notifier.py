@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Completion callbacks for jobs submitted with a callback URL.
+The result (or failure) of a job is POSTed as JSON to the caller's URL from background sender
+threads, retried with exponential backoff while the receiver is down or overloaded.
+Targets are http(s) URLs or local Unix sockets (http+unix://<percent-encoded socket path>/<path>).
+Callback URLs come from clients, so targets are denied by default: hosts off the allow-list must
+resolve to public addresses, and Unix sockets must sit in the configured socket directory.
+"""
+
+import os
+import hmac
+import json
+import time
+import heapq
+import socket
+import random
+import hashlib
+import logging
+import ipaddress
+import threading
+import http.client
+from urllib.parse import urlsplit, unquote
+
+logger = logging.getLogger(__name__)
+
+# Delay before the first retry (doubled per attempt, with jitter) and the longest delay between attempts
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 60.0
+
+# Receiver answers worth retrying: overloaded or failing, not rejecting the payload
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP over a Unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def parse_target(url, allowed_hosts=None, socket_dir=None):
+    """
+    Check a callback URL against the callback policy and split it into what a connection needs.
+
+    Args:
+        url: http://, https:// or http+unix:// URL (e.g. http+unix://%2Frun%2Fapp%2Fnode.sock/callbacks)
+        allowed_hosts: Hostnames http(s) callbacks may go to, whatever they resolve to (None or
+            empty = any host, but only if it resolves to public addresses: no loopback, private,
+            link-local, reserved or multicast ones)
+        socket_dir: Directory Unix socket callbacks may use (None = Unix socket callbacks refused)
+
+    Returns:
+        dict with scheme, host, port, socket_path, path (including the query) and address (the
+        checked IP to connect to; None for allow-listed hosts and Unix sockets)
+
+    Raises:
+        ValueError: Unsupported scheme, missing host, or a target the policy doesn't allow
+        OSError: The host could not be resolved
+    """
+    parts = urlsplit(url)
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+
+    if parts.scheme == 'http+unix':
+        socket_path = unquote(parts.netloc)
+        if not socket_path:
+            raise ValueError("Unix socket callback URL needs a socket path, e.g. http+unix://%2Frun%2Fapp.sock/path")
+        if not socket_dir:
+            raise ValueError("Unix socket callbacks are disabled on this server")
+        base = os.path.realpath(socket_dir)
+        if os.path.commonpath([os.path.realpath(socket_path), base]) != base:
+            raise ValueError(f"Unix socket callbacks must use a socket in {socket_dir}")
+        return {'scheme': parts.scheme, 'host': None, 'port': None, 'socket_path': socket_path, 'path': path, 'address': None}
+
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f"Unsupported callback URL scheme '{parts.scheme}'. Use http, https or http+unix.")
+    if not parts.hostname:
+        raise ValueError("Callback URL has no host")
+
+    if allowed_hosts:
+        if parts.hostname not in allowed_hosts:
+            raise ValueError(f"Callback host '{parts.hostname}' is not allowed")
+        address = None
+    else:
+        address = resolve_public(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+
+    return {
+        'scheme': parts.scheme, 'host': parts.hostname, 'port': parts.port, 'socket_path': None, 'path': path,
+        'address': address
+    }
+
+
+def resolve_public(host, port):
+    """
+    Resolve a callback host and make sure every address it has is public.
+
+    Args:
+        host: Hostname or IP literal
+        port: Port to resolve for
+
+    Returns:
+        The first address, to connect to (so a DNS answer changing afterwards can't redirect the callback)
+
+    Raises:
+        ValueError: An address is loopback, private, link-local, reserved or multicast
+        OSError: The host could not be resolved
+    """
+    addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0]) # drop an IPv6 zone id
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Callback host '{host}' resolves to a non-public address; add it to the allowed hosts to use it")
+    return addresses[0]
+
+
+class CallbackNotifier:
+    """Background sender of JSON callbacks, with retries scheduled on a due-time heap."""
+
+    def __init__(self, max_attempts=5, timeout=10.0, secret=None, workers=2, allowed_hosts=None, socket_dir=None):
+        """
+        Start the sender threads.
+
+        Args:
+            max_attempts: Deliveries tried per callback before giving up
+            timeout: Seconds per attempt (connect + response)
+            secret: Key for the X-Signature header (HMAC-SHA256 of the body; None = unsigned)
+            workers: Callbacks sent at the same time
+            allowed_hosts, socket_dir: Callback policy (see parse_target()), checked again on
+                every attempt
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.timeout = timeout
+        self.secret = secret.encode('utf-8') if secret else None
+        self.allowed_hosts = allowed_hosts
+        self.socket_dir = socket_dir
+
+        self._lock = threading.Lock()
+        self._due = threading.Condition(self._lock)
+        self._heap = [] # (due time, sequence, delivery), earliest first
+        self._sequence = 0
+        self.stats = {'delivered': 0, 'failed': 0, 'retries': 0}
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"callback-sender-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self, url, payload, on_done=None):
+        """
+        Queue a callback; it is sent in the background.
+
+        Args:
+            url: Target (already checked with parse_target())
+            payload: JSON-serialisable body
+            on_done: Optional function called with (delivered, attempts, error) once the callback
+                was delivered or given up on
+        """
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self._schedule({'url': url, 'body': body, 'attempt': 0, 'on_done': on_done}, 0.0)
+
+    def get_stats(self):
+        """
+        Delivery counters.
+
+        Returns:
+            dict with delivered, failed (gave up), retries and pending (queued or waiting to retry)
+        """
+        with self._lock:
+            return {**self.stats, 'pending': len(self._heap)}
+
+    def _schedule(self, delivery, delay):
+        """Put a delivery on the heap, due after delay seconds."""
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._sequence, delivery))
+            self._due.notify()
+
+    def _work(self):
+        """Sender loop: take the earliest due delivery and try it."""
+        while True:
+            with self._lock:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._due.wait(timeout=self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, delivery = heapq.heappop(self._heap)
+
+            self._attempt(delivery)
+
+    def _attempt(self, delivery):
+        """Send once; on a retryable failure schedule the next attempt, else finish."""
+        delivery['attempt'] += 1
+        retry_after = None
+        try:
+            status, retry_after = self._post(delivery['url'], delivery['body'])
+            error = None if 200 <= status < 300 else f"receiver answered {status}"
+            retryable = status in RETRY_STATUSES
+        except (OSError, http.client.HTTPException) as e: # refused, reset, timed out, bad response
+            error = f"{type(e).__name__}: {e}"
+            retryable = True
+        except ValueError as e: # the target no longer passes the callback policy
+            error = str(e)
+            retryable = False
+
+        if error is None:
+            self._finish(delivery, True, None)
+            return
+
+        if retryable and delivery['attempt'] < self.max_attempts:
+            # full jitter, so receivers coming back up aren't hit by every sender at once
+            delay = retry_after if retry_after is not None else random.uniform(
+                0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** (delivery['attempt'] - 1))
+            )
+            logger.warning(
+                f"Callback to {delivery['url']} failed ({error}), retry {delivery['attempt']} in {delay:.1f}s"
+            )
+            with self._lock:
+                self.stats['retries'] += 1
+            self._schedule(delivery, delay)
+            return
+
+        logger.error(f"Callback to {delivery['url']} given up after {delivery['attempt']} attempts: {error}")
+        self._finish(delivery, False, error)
+
+    def _finish(self, delivery, delivered, error):
+        """Count the outcome and tell whoever queued the callback."""
+        with self._lock:
+            self.stats['delivered' if delivered else 'failed'] += 1
+
+        if delivery['on_done'] is not None:
+            try:
+                delivery['on_done'](delivered, delivery['attempt'], error)
+            except Exception:
+                logger.exception("Callback completion handler failed")
+
+    def _post(self, url, body):
+        """
+        POST the body once.
+
+        Returns:
+            tuple: (status code, Retry-After seconds or None)
+        """
+        target = parse_target(url, self.allowed_hosts, self.socket_dir)
+        if target['socket_path']:
+            connection = UnixHTTPConnection(target['socket_path'], timeout=self.timeout)
+        elif target['scheme'] == 'https':
+            connection = http.client.HTTPSConnection(target['host'], target['port'], timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(target['host'], target['port'], timeout=self.timeout)
+
+        if target['address']:
+            # connect to the address that was checked; Host, SNI and the certificate check keep using the name
+            address = target['address']
+            connection._create_connection = lambda host_port, *args, **kwargs: socket.create_connection(
+                (address, host_port[1]), *args, **kwargs
+            )
+
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'image-to-svg-api'}
+        if self.secret:
+            headers['X-Signature'] = 'sha256=' + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+
+        try:
+            connection.request('POST', target['path'], body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            retry_after = response.getheader('Retry-After')
+            try:
+                retry_after = min(BACKOFF_MAX_S, max(0.0, float(retry_after))) if retry_after else None
+            except ValueError:
+                retry_after = None # HTTP-date form: fall back to backoff
+            return response.status, retry_after
+        finally:
+            connection.close()
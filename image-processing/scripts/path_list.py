@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Structured path-list output for vectorized line art.
+Turns parsed SVG geometry into per-path cubic Bézier arrays with bounding box,
+area and point count, encoded column by column as little-endian typed arrays
+(base64) so the editor can load them with Float32Array/Uint32Array directly.
+"""
+
+import base64
+
+import numpy as np
+
+# Samples per curve segment when flattening for bounding boxes and areas
+FLATTEN_STEPS = 8
+
+
+def subpath_cubics(subpath, transform=None):
+    """
+    Absolute cubic segments of a subpath; straight lines become cubics with
+    control points on the endpoints (still exactly straight).
+
+    Args:
+        subpath: Subpath dict from svg_writer.parse_path_data()
+        transform: Optional (sx, sy, tx, ty) to apply to every coordinate
+
+    Returns:
+        tuple: (start point array of shape (2,), cubic array of shape (n, 6))
+    """
+    start = np.array(subpath['start'], dtype=np.float64)
+    cubics = np.empty((len(subpath['segments']), 6), dtype=np.float64)
+
+    current = start
+    for i, segment in enumerate(subpath['segments']):
+        if len(segment) == 2:
+            cubics[i] = (current[0], current[1], segment[0], segment[1], segment[0], segment[1])
+        else:
+            cubics[i] = segment
+        current = cubics[i, 4:6]
+
+    if transform is not None:
+        sx, sy, tx, ty = transform
+        start = start * (sx, sy) + (tx, ty)
+        cubics = cubics * np.tile((sx, sy), 3) + np.tile((tx, ty), 3)
+
+    return start, cubics
+
+
+def flatten_cubics(start, cubics, steps=FLATTEN_STEPS):
+    """
+    Sample a chain of cubic segments into a polyline.
+
+    Args:
+        start: Start point (2,)
+        cubics: (n, 6) cubic control points (c1, c2, end) continuing from the previous end
+        steps: Samples per segment
+
+    Returns:
+        (n * steps + 1, 2) array of points
+    """
+    if len(cubics) == 0:
+        return start.reshape(1, 2)
+
+    p0 = np.vstack([start, cubics[:-1, 4:6]])[:, None, :]
+    p1 = cubics[:, None, 0:2]
+    p2 = cubics[:, None, 2:4]
+    p3 = cubics[:, None, 4:6]
+
+    t = np.linspace(0.0, 1.0, steps + 1)[1:, None]
+    mt = 1.0 - t
+    points = (mt ** 3) * p0 + 3 * (mt ** 2) * t * p1 + 3 * mt * (t ** 2) * p2 + (t ** 3) * p3
+
+    return np.vstack([start.reshape(1, 2), points.reshape(-1, 2)])
+
+
+def polygon_area(points):
+    """Signed shoelace area of a closed polyline."""
+    x = points[:, 0]
+    y = points[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def build_path_list(document):
+    """
+    Per-path geometry for a parsed SVG document, in viewBox coordinates.
+
+    Args:
+        document: Dict from svg_writer.parse_potrace_svg() (paths carry an 'id' once written)
+
+    Returns:
+        List of dicts with:
+            id (str): Path id (matches the SVG)
+            subpaths (list): (start, cubics, closed) per subpath
+            bbox (list): [min_x, min_y, max_x, max_y]
+            area (float): Filled area (holes subtracted; 0 for open centerline strokes)
+            point_count (int): Number of on-curve points
+            stroke_width (float): Stroke width for centerline paths, None for filled outlines
+    """
+    transform = document.get('transform') # maps Potrace's coordinates to viewBox space
+    paths = []
+
+    for index, path in enumerate(document['paths']):
+        subpaths = []
+        signed_area = 0.0
+        mins = []
+        maxs = []
+        point_count = 0
+
+        for subpath in path['subpaths']:
+            start, cubics = subpath_cubics(subpath, transform)
+            polyline = flatten_cubics(start, cubics)
+
+            subpaths.append((start, cubics, subpath['closed']))
+            mins.append(polyline.min(axis=0))
+            maxs.append(polyline.max(axis=0))
+            point_count += 1 + len(cubics)
+
+            # holes run the opposite way, so signed areas cancel them out
+            if subpath['closed']:
+                signed_area += polygon_area(polyline)
+
+        if subpaths:
+            low = np.min(mins, axis=0)
+            high = np.max(maxs, axis=0)
+            bbox = [float(low[0]), float(low[1]), float(high[0]), float(high[1])]
+        else:
+            bbox = [0.0, 0.0, 0.0, 0.0]
+
+        paths.append({
+            'id': path.get('id') or f"path_{index}",
+            'subpaths': subpaths,
+            'bbox': bbox,
+            'area': abs(signed_area),
+            'point_count': point_count,
+            'stroke_width': path.get('stroke_width')
+        })
+
+    return paths
+
+
+def encode_array(array, dtype):
+    """
+    Base64 of a little-endian typed array.
+
+    Args:
+        array: Array-like values
+        dtype: NumPy dtype name, e.g. 'float32'
+
+    Returns:
+        {'dtype': dtype, 'data': base64 string}
+    """
+    data = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': dtype, 'data': base64.b64encode(data.tobytes()).decode('ascii')}
+
+
+def encode_path_list(paths, width=None, height=None):
+    """
+    Columnar, typed-array friendly encoding of a path list.
+
+    Layout (all offsets are element indices):
+        coords: float32, per subpath the start x, y followed by 6 values per cubic segment
+        subpath_offsets: uint32, n_subpaths + 1 offsets into coords
+        subpath_closed: uint8, 1 if the subpath is closed
+        path_offsets: uint32, n_paths + 1 offsets into the subpath arrays
+        bboxes: float32, 4 per path (min_x, min_y, max_x, max_y)
+        areas: float32, 1 per path
+        point_counts: uint32, 1 per path
+        stroke_widths: float32, 1 per path (only for stroked centerline paths)
+
+    Args:
+        paths: List from build_path_list()
+        width: Width of the coordinate space (viewBox)
+        height: Height of the coordinate space (viewBox)
+
+    Returns:
+        JSON-serialisable dict
+    """
+    coords = []
+    subpath_offsets = [0]
+    subpath_closed = []
+    path_offsets = [0]
+    offset = 0
+
+    for path in paths:
+        for start, cubics, closed in path['subpaths']:
+            coords.append(start)
+            coords.append(cubics.reshape(-1))
+            offset += 2 + cubics.size
+            subpath_offsets.append(offset)
+            subpath_closed.append(1 if closed else 0)
+        path_offsets.append(len(subpath_closed))
+
+    coords_array = np.concatenate(coords) if coords else np.empty(0)
+
+    encoded = {
+        'format': 'columnar-v1',
+        'encoding': 'base64-le',
+        'count': len(paths),
+        'width': width,
+        'height': height,
+        'ids': [path['id'] for path in paths],
+        'arrays': {
+            'coords': encode_array(coords_array, 'float32'),
+            'subpath_offsets': encode_array(subpath_offsets, 'uint32'),
+            'subpath_closed': encode_array(subpath_closed, 'uint8'),
+            'path_offsets': encode_array(path_offsets, 'uint32'),
+            'bboxes': encode_array([p['bbox'] for p in paths] or np.empty((0, 4)), 'float32'),
+            'areas': encode_array([p['area'] for p in paths], 'float32'),
+            'point_counts': encode_array([p['point_count'] for p in paths], 'uint32')
+        }
+    }
+
+    if any(p.get('stroke_width') is not None for p in paths):
+        encoded['arrays']['stroke_widths'] = encode_array([p.get('stroke_width') or 0.0 for p in paths], 'float32')
+
+    return encoded
+
+
+def decode_array(encoded):
+    """Inverse of encode_array()."""
+    return np.frombuffer(base64.b64decode(encoded['data']), dtype=np.dtype(encoded['dtype']).newbyteorder('<'))
+
+
+def decode_path_list(encoded):
+    """
+    Decode the arrays of an encoded path list (for tests and Python consumers).
+
+    Args:
+        encoded: Dict from encode_path_list()
+
+    Returns:
+        Dict of array name -> NumPy array
+    """
+    return {name: decode_array(array) for name, array in encoded['arrays'].items()}
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Post-trace optimization of vectorized line art.
+Straightens near-straight curves, merges collinear line runs, culls small features
+and enforces a path/node budget so worst-case drawings stay bounded for the editor.
+Works on the document dicts used by svg_writer (Potrace outlines or centerlines).
+"""
+
+import math
+
+import numpy as np
+
+from centerline import simplify_polyline, polyline_length
+from path_list import subpath_cubics, flatten_cubics, polygon_area
+
+
+def _unit_scale(document):
+    """ViewBox pixels per document coordinate unit (Potrace uses 0.1px units under a scale transform)."""
+    transform = document.get('transform')
+    if transform is None:
+        return 1.0
+    return abs(transform[0]) or 1.0
+
+
+def count_nodes(document):
+    """
+    Size of a document.
+
+    Args:
+        document: Document dict (see svg_writer.parse_potrace_svg)
+
+    Returns:
+        tuple: (path count, node count) where nodes are on-curve points
+    """
+    nodes = sum(1 + len(subpath['segments']) for path in document['paths'] for subpath in path['subpaths'])
+    return len(document['paths']), nodes
+
+
+def _distance_to_segment(px, py, ax, ay, bx, by):
+    """Distance from point p to the segment a-b."""
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def straighten_subpath(subpath, tolerance):
+    """
+    Replace cubics whose control points lie within tolerance of their chord by lines.
+
+    Args:
+        subpath: Subpath dict (see svg_writer.parse_path_data)
+        tolerance: Maximum control point distance, in document units
+
+    Returns:
+        tuple: (new subpath dict, number of curves straightened)
+    """
+    segments = []
+    straightened = 0
+    cx, cy = subpath['start']
+
+    for segment in subpath['segments']:
+        if len(segment) == 6:
+            x1, y1, x2, y2, x, y = segment
+            if (_distance_to_segment(x1, y1, cx, cy, x, y) <= tolerance
+                    and _distance_to_segment(x2, y2, cx, cy, x, y) <= tolerance):
+                segment = (x, y)
+                straightened += 1
+        segments.append(segment)
+        cx, cy = segment[-2], segment[-1]
+
+    return {'start': subpath['start'], 'segments': segments, 'closed': subpath['closed']}, straightened
+
+
+def merge_collinear(subpath, tolerance):
+    """
+    Simplify runs of consecutive line segments with Ramer-Douglas-Peucker,
+    which merges collinear segments and drops points within tolerance of the line.
+
+    Args:
+        subpath: Subpath dict
+        tolerance: Maximum deviation, in document units
+
+    Returns:
+        tuple: (new subpath dict, number of segments removed)
+    """
+    segments = []
+    run = [subpath['start']] # points of the current run of lines, starting at the current point
+
+    def flush():
+        if len(run) > 2:
+            kept = simplify_polyline(np.asarray(run, dtype=np.float64), tolerance)
+            segments.extend((float(x), float(y)) for x, y in kept[1:])
+        else:
+            segments.extend(run[1:])
+
+    for segment in subpath['segments']:
+        if len(segment) == 2:
+            run.append(segment)
+            continue
+        flush()
+        segments.append(segment)
+        run = [(segment[-2], segment[-1])]
+    flush()
+
+    removed = len(subpath['segments']) - len(segments)
+    return {'start': subpath['start'], 'segments': segments, 'closed': subpath['closed']}, removed
+
+
+def _subpath_size(subpath):
+    """Signed area (closed subpaths) and length of a subpath, in document units."""
+    start, cubics = subpath_cubics(subpath)
+    polyline = flatten_cubics(start, cubics)
+    area = polygon_area(polyline) if subpath['closed'] else 0.0
+    return area, polyline_length(polyline)
+
+
+def optimize_document(document, line_tolerance=0.25, min_area=0.0, min_length=0.0, max_paths=None, max_nodes=None):
+    """
+    Optimize a document in place.
+    Tolerances and thresholds are in viewBox pixels whatever the document's coordinate units.
+
+    Args:
+        document: Document dict (see svg_writer.parse_potrace_svg or centerline.trace_centerlines)
+        line_tolerance: Curves and line runs within this distance of a straight line are straightened/merged (0 = off)
+        min_area: Drop closed subpaths (shapes and holes) with a smaller area, in square pixels
+        min_length: Drop open subpaths (centerline strokes) that are shorter, in pixels
+        max_paths: Keep at most this many paths, largest first (None = unbounded)
+        max_nodes: Keep at most this many nodes over all paths, largest paths first (None = unbounded)
+
+    Returns:
+        dictionary with:
+            paths_before, paths_after (int): Path counts
+            nodes_before, nodes_after (int): On-curve point counts
+            curves_straightened (int): Cubics replaced by lines
+            segments_merged (int): Line segments removed by merging/simplification
+            dropped_small (int): Subpaths culled by min_area/min_length
+            dropped_budget (int): Paths culled to meet max_paths/max_nodes
+    """
+    scale = _unit_scale(document)
+    tolerance = line_tolerance / scale
+    paths_before, nodes_before = count_nodes(document)
+
+    stats = {
+        'paths_before': paths_before,
+        'paths_after': paths_before,
+        'nodes_before': nodes_before,
+        'nodes_after': nodes_before,
+        'curves_straightened': 0,
+        'segments_merged': 0,
+        'dropped_small': 0,
+        'dropped_budget': 0
+    }
+
+    budget = max_paths is not None or max_nodes is not None
+    measure = min_area > 0 or min_length > 0 or budget # sizes are only needed for culling
+
+    kept_paths = []
+    importance = [] # ink each kept path puts on the page, used to rank paths for the budget
+    for path in document['paths']:
+        subpaths = []
+        signed_area = 0.0
+        stroke_ink = 0.0
+
+        for subpath in path['subpaths']:
+            if tolerance > 0:
+                subpath, straightened = straighten_subpath(subpath, tolerance)
+                subpath, merged = merge_collinear(subpath, tolerance)
+                stats['curves_straightened'] += straightened
+                stats['segments_merged'] += merged
+
+            if measure:
+                area, length = _subpath_size(subpath)
+                area *= scale * scale
+                length *= scale
+
+                if (abs(area) < min_area) if subpath['closed'] else (length < min_length):
+                    stats['dropped_small'] += 1
+                    continue
+
+                signed_area += area # holes run the other way, so they cancel out of the shape's area
+                if not subpath['closed']:
+                    stroke_ink += length * (path.get('stroke_width') or 1.0)
+
+            subpaths.append(subpath)
+
+        if subpaths:
+            path['subpaths'] = subpaths
+            kept_paths.append(path)
+            importance.append(abs(signed_area) + stroke_ink)
+
+    # budget: keep the paths with the most ink, in their original drawing order
+    if budget:
+        path_limit = max_paths if max_paths is not None else len(kept_paths)
+        node_limit = max_nodes if max_nodes is not None else math.inf
+        selected = []
+        total_nodes = 0
+
+        for index in sorted(range(len(kept_paths)), key=lambda i: -importance[i]):
+            if len(selected) >= path_limit:
+                break
+            nodes = sum(1 + len(subpath['segments']) for subpath in kept_paths[index]['subpaths'])
+            if total_nodes + nodes > node_limit:
+                continue # a smaller path may still fit
+            selected.append(index)
+            total_nodes += nodes
+
+        stats['dropped_budget'] = len(kept_paths) - len(selected)
+        kept_paths = [kept_paths[i] for i in sorted(selected)]
+
+    document['paths'] = kept_paths
+    stats['paths_after'], stats['nodes_after'] = count_nodes(document)
+
+    return stats
@@ -4,135 +4,428 @@ End-to-End Image Processing Pipeline of photo to line art PNG to editable SVG.
 Uses generate_lineart.py and vectorize_lineart.py with shared utilities.
 """
 
-import os
 import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import cv2
+import numpy as np
 
 from preprocess import preprocess_image, smart_resize
-from image_analyser import analyse_image
+from image_analyser import analyse_image_array, decode_image, InvalidImage
 from generate_lineart import LineArtGenerator
 from vectorize_lineart import LineArtVectorizer
-from pipeline_utils import (
-    create_required_folders,
-    generate_temp_filename,
-    cleanup_temp_files,
-    combine_results
-)
+from pipeline_utils import combine_results
+from spatial_index import decode_grid_index, query_region
+from cache import LRUCache
+from cancellation import Cancelled, check as check_cancelled
+from metrics import STAGE_SECONDS
+from stage_engine import Stage
+import stage_workers
+
+# Context traced around a refined region (drawing pixels), so strokes crossing its edge are seen as crossing it
+REGION_MARGIN = 16
+
+# Stages that can get their own workers, and whether those are processes (GIL-bound Python)
+# or threads (torch releases the GIL during a forward)
+OFFLOADED_STAGES = {'analysis': True, 'inference': False, 'tracing': True}
 
 class ImageProcessingPipeline:
     """Class for running the full photo to SVG pipeline."""
     
-    def __init__(self, models_dir='../models'):
+    def __init__(self, models_dir='../models', model_cache_bytes=None, optimize_options=None, trace_backend='auto',
+                 job_cache_bytes=None, workers_per_stage=None, stage_queue_size=0):
         """
         Initialize pipeline with both generators.
         
         Args:
             models_dir: Path to model weights directory
+            model_cache_bytes: Memory budget for loaded style models (None = unbounded)
+            optimize_options: Path optimizer settings (see LineArtVectorizer.optimize_options)
+            trace_backend: Outline tracer, 'cli' (potrace), 'potracer' (in process) or 'auto'
+            job_cache_bytes: Memory budget for the inputs kept for refine_region() (None = unbounded)
+            workers_per_stage: Workers per stage, e.g. {'analysis': 1, 'inference': 2, 'tracing': 2};
+                a stage without workers runs in the calling thread (None = every stage inline)
+            stage_queue_size: Items allowed to wait for each stage's workers (0 = unbounded)
         """
-        self.lineart_generator = LineArtGenerator(models_dir=models_dir)
-        self.vectorizer = LineArtVectorizer()
+        self.lineart_generator = LineArtGenerator(models_dir=models_dir, cache_max_bytes=model_cache_bytes)
+        self.vectorizer = LineArtVectorizer(optimize_options=optimize_options, backend=trace_backend)
+
+        # Runs the per-style stages (inference + tracing) of multi-style requests side by side
+        self.style_executor = ThreadPoolExecutor(
+            max_workers=len(self.lineart_generator.styles),
+            thread_name_prefix='pipeline-style'
+        )
+
+        # (job id, style) -> preprocessed model input, drawing size and path index of a processed job,
+        # so a region can be re-rendered without decoding, analysing or preprocessing the photo again
+        self.job_cache = LRUCache(
+            job_cache_bytes,
+            size_of=lambda source: source['image'].nbytes + source['index']['bboxes'].nbytes
+        )
+
+        # Staged execution: each offloaded stage has its own workers and bounded queue, so the
+        # stages of concurrent requests overlap (request N+1 in inference while N is traced)
+        self.stages = {
+            name: Stage(
+                name, (workers_per_stage or {})[name], queue_size=stage_queue_size, processes=processes,
+                initializer=stage_workers.init_worker if processes else None,
+                initargs=(optimize_options, trace_backend) if processes else ()
+            )
+            for name, processes in OFFLOADED_STAGES.items()
+            if (workers_per_stage or {}).get(name, 0) > 0
+        }
     
-    def process(self, input_image, output_svg, style='contour', skip_preprocess=False):
+    def process(self, input_image, output_svg, style='contour', skip_preprocess=False, quality='balanced', queue_depth=0,
+                include_paths=False, trace_mode=None, include_index=False, job_id=None, cancel_token=None, offload=True):
         """
         Process photo through full pipeline.
         
         Args:
-            input_image: Path to input image
-            output_svg: Path to save final SVG
-            style: 'contour' or 'anime'
+            input_image: Path to input image, encoded image bytes, or an already decoded BGR array
+            output_svg: Path to save final SVG (for a list of styles, see process_styles())
+            style: 'contour' or 'anime', or a list of styles to render from the same photo
             skip_preprocess: If True, skip preprocessing step
+            quality: Latency budget for inference resolution ('fast', 'balanced' or 'high')
+            queue_depth: Number of other requests in flight, used to pick a smaller resolution under load
+            include_paths: Also return the structured path list of the SVG
+            trace_mode: 'outline' or 'centerline' (default: the style's trace mode)
+            include_index: Also return the spatial index of path bounding boxes
+            job_id: Keep the preprocessed input under this id for refine_region() (None = don't keep it)
+            cancel_token: CancellationToken checked between stages; cancelling it (or its deadline
+                passing) stops the run and kills a running Potrace subprocess
+            offload: Run analysis, inference and tracing on their stage workers if there are any
+                (False = everything in the calling thread, e.g. under a profiler)
             
         Returns:
             dictionary with combined data:
                 success (bool): Whether entire pipeline succeeded
+                cancelled (bool): Whether it stopped because cancel_token was cancelled (on failure only)
                 final_svg (str): Path to output SVG
                 intermediate (dict): Paths to intermediate files
-                metrics (dict): Combined timing and size info
+                metrics (dict): Combined timing and size info, with stage_times (prepare, lineart
+                    and vectorization wall times in seconds) and stages (finer wall times of decode,
+                    analysis, preprocessing, inference, tracing and serialization, for the stages that ran)
                 error (str): Error message if failed
                 analysis (dict): Image analysis results
                 preprocessing_applied (list): List of preprocessing steps applied
                 warnings (list): Any warnings from analysis
+                paths (dict): Encoded path list (see path_list.encode_path_list) if include_paths
+                index (dict): Encoded grid index (see spatial_index.encode_grid_index) if include_index
+            For a list of styles, the dictionary from process_styles().
         """
-        # Create required folders
-        temp_dir, outputs_dir = create_required_folders()
+        if isinstance(style, (list, tuple)):
+            return self.process_styles(
+                input_image, output_svg, styles=style, skip_preprocess=skip_preprocess,
+                quality=quality, queue_depth=queue_depth, include_paths=include_paths, trace_mode=trace_mode,
+                include_index=include_index, job_id=job_id, cancel_token=cancel_token, offload=offload
+            )
+
+        prepared = None
         
-        # Generate temp filename for line art
-        temp_lineart_name = generate_temp_filename(prefix='lineart', extension='.png')
-        temp_lineart_path = os.path.join(temp_dir, temp_lineart_name)
+        try:
+            # 1. Decode + analyse once
+            prepare_start = time.time()
+            prepared = self._prepare_input(input_image, skip_preprocess, cancel_token, offload)
+            prepare_time = time.time() - prepare_start
 
-        # Generate temp filenames for preprocessed image if needed
-        temp_preprocessed_name = generate_temp_filename(prefix='preprocessed', extension='.jpg')
-        temp_preprocessed_path = os.path.join(temp_dir, temp_preprocessed_name) 
+            # 2-4. Preprocess, generate line art and vectorize for this style
+            result = self._run_style(
+                prepared, style, output_svg, quality, queue_depth, include_paths, trace_mode, include_index, job_id,
+                cancel_token
+            )
+
+            # per-stage wall times, e.g. for admission control's wait estimates
+            metrics = result['metrics']
+            metrics['stage_times'] = {
+                'prepare': prepare_time,
+                'lineart': metrics['lineart_time'],
+                'vectorization': metrics['vectorization_time']
+            }
+            if result['success']:
+                metrics['stages'] = {**prepared['stages'], **metrics['stages']}
+            return result
+            
+        except Exception as e:
+            return self._create_error_result(e, prepared)
 
-        # setup list and results
-        analysis_results = None
-        preprocessing_applied = [] 
+    def process_styles(self, input_image, output_svg, styles, skip_preprocess=False, quality='balanced', queue_depth=0,
+                       include_paths=False, trace_mode=None, include_index=False, job_id=None, cancel_token=None,
+                       offload=True):
+        """
+        Render several styles from one photo.
+        Decoding, analysis and resizing run once; the per-style inference and tracing run concurrently.
         
+        Args:
+            input_image: Path to input image, encoded image bytes, or an already decoded BGR array
+            output_svg: Dict of style -> SVG path, or one path that gets a '_<style>' suffix per style
+            styles: List of styles, e.g. ['contour', 'anime']
+            skip_preprocess: If True, skip preprocessing step
+            quality: Latency budget for inference resolution ('fast', 'balanced' or 'high')
+            queue_depth: Number of other requests in flight
+            include_paths: Also return the structured path list of each SVG
+            trace_mode: 'outline' or 'centerline' (default: each style's trace mode)
+            include_index: Also return the spatial index of each SVG's path bounding boxes
+            job_id: Keep each style's preprocessed input under this id for refine_region()
+            cancel_token: CancellationToken shared by all styles (see process())
+            offload: Run analysis, inference and tracing on their stage workers if there are any
+            
+        Returns:
+            dictionary with:
+                success (bool): Whether every style succeeded
+                cancelled (bool): Whether it stopped because cancel_token was cancelled (on failure only)
+                styles (dict): style -> result dict, same shape as process() for a single style
+                analysis (dict): Image analysis results (shared)
+                warnings (list): Any warnings from analysis
+                metrics (dict): total_time, shared_time (decode + analysis + resize), stage_times and
+                    stages (decode and analysis; each style's result has its own) in seconds
+                error (str): Error message(s) if any style failed
+        """
+        start_time = time.time()
+        styles = list(dict.fromkeys(styles)) # drop duplicates, keep order
+        prepared = None
+
         try:
-            # 1: Analyse image quality
-            if not skip_preprocess: # if not skipping preprocess, run analysis to determine if preprocessing is needed
-                analysis_results = analyse_image(input_image)
+            prepared = self._prepare_input(input_image, skip_preprocess, cancel_token, offload)
+            shared_time = time.time() - start_time
+
+            # one job per style; the model forwards release the GIL and Potrace runs as a subprocess
+            futures = {
+                style: self.style_executor.submit(
+                    self._run_style, prepared, style, self._style_output_path(output_svg, style),
+                    quality, queue_depth, include_paths, trace_mode, include_index, job_id, cancel_token
+                )
+                for style in styles
+            }
+            style_results = {style: future.result() for style, future in futures.items()}
+
+        except Exception as e:
+            failed = self._create_error_result(e, prepared)
+            failed['styles'] = {}
+            return failed
+
+        errors = [f"{style}: {result['error']}" for style, result in style_results.items() if not result['success']]
+        analysis_results = prepared['analysis']
+
+        result = {
+            'success': not errors,
+            'styles': style_results,
+            'analysis': analysis_results,
+            'warnings': analysis_results.get('warnings', []) if analysis_results else [],
+            'metrics': {
+                'total_time': time.time() - start_time,
+                'shared_time': shared_time,
+                # the styles run side by side, so each stage takes as long as its slowest style
+                'stage_times': {
+                    'prepare': shared_time,
+                    'lineart': max(result['metrics']['lineart_time'] for result in style_results.values()),
+                    'vectorization': max(result['metrics']['vectorization_time'] for result in style_results.values())
+                },
+                'stages': prepared['stages']
+            },
+            'error': '; '.join(errors) if errors else None
+        }
+        if errors:
+            result['cancelled'] = any(style_result.get('cancelled') for style_result in style_results.values())
+            result['invalid_input'] = any(style_result.get('invalid_input') for style_result in style_results.values())
+        return result
+
+    def _prepare_input(self, input_image, skip_preprocess, cancel_token=None, offload=True):
+        """
+        Style-independent stages: decode, analyse and resize.
+        
+        Args:
+            input_image: Path to input image, encoded image bytes, or an already decoded BGR array
+            skip_preprocess: If True, skip analysis and resizing
+            cancel_token: CancellationToken checked before each stage (None = run to completion)
+            offload: Run analysis (and later the style stages) on their stage workers
             
+        Returns:
+            dictionary with:
+                image (np.ndarray): Decoded BGR image
+                resized (np.ndarray): Image after smart resize (same as image if preprocessing is skipped)
+                analysis (dict): Analysis results, None if skipped
+                resize_time (float): Seconds spent resizing
+                stages (dict): Seconds spent decoding and analysing (the stages that ran)
+                offload (bool): As given, for the style stages
+        """
+        check_cancelled(cancel_token, 'decode')
+        stage_times = {}
+
+        # Load original image once; it stays in memory for the model (no temp file re-encode)
+        if isinstance(input_image, np.ndarray):
+            image = input_image
+        else:
+            stage_start = time.time()
+            if isinstance(input_image, (bytes, bytearray, memoryview)):
+                image = decode_image(input_image) # uploads are decoded in memory, no temp file
+            else:
+                image = cv2.imread(input_image)
+                if image is None:
+                    raise ValueError(f"Could not load image: {input_image}")
+            stage_times['decode'] = time.time() - stage_start
+            STAGE_SECONDS.observe(stage_times['decode'], stage='decode')
+
+        prepared = {
+            'image': image, 'resized': image, 'analysis': None, 'resize_time': 0.0, 'stages': stage_times,
+            'offload': offload
+        }
+
+        # if not skipping preprocess, run analysis to determine if preprocessing is needed
+        if not skip_preprocess:
+            check_cancelled(cancel_token, 'analysis')
+            stage_start = time.time()
+            if isinstance(input_image, (bytes, bytearray, memoryview)) and offload and 'analysis' in self.stages:
+                # the worker process gets the encoded upload, not the (many times larger) decoded pixels
+                prepared['analysis'] = self._run_stage(
+                    'analysis', offload, cancel_token, stage_workers.analyse_encoded, bytes(input_image)
+                )
+            else:
+                prepared['analysis'] = self._run_stage(
+                    'analysis', offload, cancel_token, analyse_image_array, image
+                )
+            stage_times['analysis'] = time.time() - stage_start
+            STAGE_SECONDS.observe(stage_times['analysis'], stage='analysis')
+
+            check_cancelled(cancel_token, 'resize')
+            stage_start = time.time()
+            # resizing applies to every style, so it is shared
+            prepared['resized'] = smart_resize(image, target_min=512, target_max=2048)
+            prepared['resize_time'] = time.time() - stage_start # counted into each style's preprocessing
+
+        return prepared
+
+    def _preprocess_for_style(self, prepared, style):
+        """
+        Style-specific preprocessing on top of the shared resize.
+        
+        Args:
+            prepared: Dict from _prepare_input()
+            style: 'contour' or 'anime'
+            
+        Returns:
+            tuple: (image_for_model, preprocessing_applied)
+        """
+        analysis_results = prepared['analysis']
+        preprocessing_applied = []
+
+        if not analysis_results:
+            return prepared['image'], preprocessing_applied
+
+        if style == 'anime':
+            # Anime: resize only — gamma/CLAHE amplify the already heavy line preservation
+            image_for_model = prepared['resized']
+        else:
+            # Contour: full preprocessing (resize + gamma + CLAHE); the image is already resized so that step is a no-op
+            image_for_model = preprocess_image(prepared['resized'], analysis_results)
+
+        # Check what was applied
+        height = analysis_results['resolution']['height']
+        width = analysis_results['resolution']['width']
+        smaller_side = min(height, width)
+        larger_side = max(height, width)
+        if smaller_side < 512 or larger_side > 2048:
+            preprocessing_applied.append('resize')
+
+        if style != 'anime':
+            luminance = analysis_results.get('luminance', {})
+            contrast = analysis_results.get('contrast', {})
+
+            global_mean_brightness = luminance.get('global_mean', 127)
+            if global_mean_brightness < 80 or global_mean_brightness > 180:
+                preprocessing_applied.append('gamma_correction')
+
+            if contrast.get('low_contrast_flag') or luminance.get('warning_flag'):
+                preprocessing_applied.append('clahe')
+
+        return image_for_model, preprocessing_applied
+
+    def _run_style(self, prepared, style, output_svg, quality, queue_depth, include_paths=False, trace_mode=None,
+                   include_index=False, job_id=None, cancel_token=None):
+        """
+        Per-style stages: preprocess, generate line art and vectorize.
+        
+        Args:
+            prepared: Dict from _prepare_input()
+            style: 'contour' or 'anime'
+            output_svg: Path to save the SVG
+            quality: Latency budget for inference resolution
+            queue_depth: Number of other requests in flight
+            include_paths: Also return the structured path list
+            trace_mode: 'outline' or 'centerline' (default: the style's trace mode)
+            include_index: Also return the spatial index of path bounding boxes
+            job_id: Keep the preprocessed input under this id for refine_region()
+            cancel_token: CancellationToken checked between stages and passed to the tracer
+            
+        Returns:
+            Result dict as described in process()
+        """
+        analysis_results = prepared['analysis']
+        preprocessing_applied = []
+
+        try:
             # 2. Preprocess if needed based on analysis
-            image_for_model = input_image
-            if not skip_preprocess and analysis_results:
-                # Load original image
-                original_image = cv2.imread(input_image)
-
-                if style == 'anime':
-                    # Anime: resize only — gamma/CLAHE amplify the already heavy line preservation
-                    preprocessed_image = smart_resize(original_image, target_min=512, target_max=2048)
-                else:
-                    # Contour: full preprocessing (resize + gamma + CLAHE)
-                    preprocessed_image = preprocess_image(original_image, analysis_results)
-
-                # Save preprocessed image to temp file for use in model
-                cv2.imwrite(temp_preprocessed_path, preprocessed_image)
-                image_for_model = temp_preprocessed_path # update path to use preprocessed image for model
-
-                # Check what was applied
-                height = analysis_results['resolution']['height']
-                width = analysis_results['resolution']['width']
-                smaller_side = min(height, width)
-                larger_side = max(height, width)
-                if smaller_side < 512 or larger_side > 2048:
-                    preprocessing_applied.append('resize')
-
-                if style != 'anime':
-                    luminance = analysis_results.get('luminance', {})
-                    contrast = analysis_results.get('contrast', {})
-
-                    global_mean_brightness = luminance.get('global_mean', 127)
-                    if global_mean_brightness < 80 or global_mean_brightness > 180:
-                        preprocessing_applied.append('gamma_correction')
-
-                    if contrast.get('low_contrast_flag') or luminance.get('warning_flag'):
-                        preprocessing_applied.append('clahe')
-
-            # 3. Generate line art
-            lineart_result = self.lineart_generator.generate(
-                input_path=image_for_model,
-                output_path=temp_lineart_path,
-                style=style
+            check_cancelled(cancel_token, 'preprocessing')
+            stage_start = time.time()
+            image_for_model, preprocessing_applied = self._preprocess_for_style(prepared, style)
+            stage_times = {'preprocessing': prepared['resize_time'] + time.time() - stage_start}
+            STAGE_SECONDS.observe(stage_times['preprocessing'], stage='preprocessing')
+
+            # Pick the model input resolution for this request
+            height, width = image_for_model.shape[:2]
+            input_size = self.lineart_generator.choose_input_size(
+                width, height, quality=quality, queue_depth=queue_depth
+            )
+
+            # 3. Generate line art straight from the BGR array, binarized on the output tensor
+            check_cancelled(cancel_token, 'lineart')
+            lineart_result = self._run_stage(
+                'inference', prepared['offload'], cancel_token,
+                self.lineart_generator.generate_array,
+                image_for_model,
+                style=style,
+                channel_order='bgr',
+                threshold=self.vectorizer.threshold_for(style),
+                input_size=input_size
             )
             
             # If line art generation failed
             if not lineart_result['success']:
-                cleanup_temp_files(temp_preprocessed_path, temp_lineart_path) # cleanup
                 return self._create_failed_result(lineart_result, step='lineart') # return error immediately without trying to run vectorization
+            stage_times['inference'] = lineart_result['processing_time']
+            STAGE_SECONDS.observe(stage_times['inference'], stage='inference')
+
+            # line art stays in memory as a packed bitmap
+            lineart_result['output_path'] = None
             
             # 4. Vectorize line art
-            vectorization_result = self.vectorizer.vectorize(
-                input_path=temp_lineart_path,
-                output_path=output_svg,
-                style=style
+            check_cancelled(cancel_token, 'vectorization')
+            vectorization_result = self._vectorize(
+                lineart_result['bitmap'], output_svg, style, include_paths, trace_mode,
+                include_index or job_id is not None, # refinement looks up the paths a region replaces
+                cancel_token, prepared['offload']
             )
+            # a killed Potrace shows up as a failed trace; report it as the cancellation it was
+            check_cancelled(cancel_token, 'vectorization')
+
+            if vectorization_result['success']:
+                stage_times['tracing'] = vectorization_result['metrics']['trace_time']
+                stage_times['serialization'] = vectorization_result['metrics']['serialize_time']
+                STAGE_SECONDS.observe(stage_times['tracing'], stage='tracing')
+                STAGE_SECONDS.observe(stage_times['serialization'], stage='serialization')
+
+            if job_id is not None and vectorization_result['success']:
+                self._keep_job_input(job_id, style, image_for_model, lineart_result, vectorization_result)
+                if not include_index:
+                    vectorization_result['index'] = None
             
             # Combine results
             combined_result = combine_results(lineart_result, vectorization_result)
 
             # add analysis and preprocessing info to combined result
+            combined_result['metrics']['input_size'] = lineart_result['input_size']
+            combined_result['metrics']['stages'] = stage_times
             combined_result['analysis'] = analysis_results
             combined_result['preprocessing_applied'] = preprocessing_applied
 
@@ -141,34 +434,275 @@ class ImageProcessingPipeline:
             else:
                 combined_result['warnings'] = []
 
-            # update intermediate paths in combined result
-            combined_result['intermediate']['preprocessed_image'] = temp_preprocessed_path if not skip_preprocess else None
-            
-            # Cleanup temp files
-            cleanup_temp_files(temp_preprocessed_path, temp_lineart_path)
+            # preprocessed image is kept in memory only
+            combined_result['intermediate']['preprocessed_image'] = None
             
             return combined_result
             
         except Exception as e:
-            # Cleanup on error
-            cleanup_temp_files(temp_preprocessed_path, temp_lineart_path)
+            failed = self._create_error_result(e, prepared)
+            failed['preprocessing_applied'] = preprocessing_applied
+            return failed
+
+    def refine_region(self, job_id, style, region, detail=2.0, cancel_token=None):
+        """
+        Re-render one region of an already processed drawing at a higher resolution.
+        Only the region (plus a small margin) goes through inference and tracing, starting from the
+        job's cached preprocessed input, so the cost follows the region's size rather than the photo's.
+
+        Args:
+            job_id: Id passed to process() for the job
+            style: Style of the drawing to refine
+            region: (x, y, width, height) in the drawing's viewBox pixels
+            detail: Resolution relative to the drawing (see LineArtGenerator.choose_region_size)
+            cancel_token: CancellationToken checked between stages (see process())
+
+        Returns:
+            dictionary with:
+                success (bool): Whether refinement succeeded
+                job_id, style (str): As given
+                region (list): [min_x, min_y, max_x, max_y], clipped to the drawing
+                paths (list): Replacement paths entirely inside the region (id, d, bbox, stroke_width),
+                    in the coordinates of the drawing's <g>
+                replaced_ids (list): Ids of the drawing's paths entirely inside the region, which the new paths replace
+                metrics (dict): total_time, lineart_time, vectorization_time, input_size, path_count, trace_mode
+                error (str): Error message if failed
+
+        Raises:
+            KeyError: The job (or this style of it) is not cached, e.g. evicted
+            ValueError: The region is empty or outside the drawing
+            Cancelled: cancel_token was cancelled
+        """
+        start_time = time.time()
+
+        source = self.job_cache.get((job_id, style))
+        if source is None:
+            raise KeyError(f"No cached input for job '{job_id}' with style '{style}'")
+        if detail <= 0:
+            raise ValueError("detail must be positive")
+
+        canvas_width, canvas_height = source['canvas_size']
+        x, y, width, height = region
+        if width <= 0 or height <= 0:
+            raise ValueError("Region width and height must be positive")
+
+        min_x, min_y = max(0.0, float(x)), max(0.0, float(y))
+        max_x, max_y = min(float(canvas_width), float(x + width)), min(float(canvas_height), float(y + height))
+        if min_x >= max_x or min_y >= max_y:
+            raise ValueError("Region lies outside the drawing")
+
+        # crop the preprocessed image around the region, with some context; drawing pixels are model input
+        # pixels (the generator only pads its output up to a multiple of 4 at the right and bottom)
+        image = source['image']
+        image_height, image_width = image.shape[:2]
+        scale_x, scale_y = image_width / source['model_size'][0], image_height / source['model_size'][1]
+        left = max(0, int(math.floor((min_x - REGION_MARGIN) * scale_x)))
+        top = max(0, int(math.floor((min_y - REGION_MARGIN) * scale_y)))
+        right = min(image_width, int(math.ceil((max_x + REGION_MARGIN) * scale_x)))
+        bottom = min(image_height, int(math.ceil((max_y + REGION_MARGIN) * scale_y)))
+        crop = np.ascontiguousarray(image[top:bottom, left:right])
+
+        crop_width, crop_height = (right - left) / scale_x, (bottom - top) / scale_y # in drawing pixels
+        input_size = self.lineart_generator.choose_region_size(crop_width, crop_height, detail=detail)
+
+        # same grey level as the full drawing, so line weights match around the region
+        check_cancelled(cancel_token, 'lineart')
+        lineart_result = self._run_stage(
+            'inference', True, cancel_token,
+            self.lineart_generator.generate_array,
+            crop,
+            style=style,
+            channel_order='bgr',
+            threshold=source['threshold'],
+            input_size=input_size
+        )
+        if not lineart_result['success']:
+            return self._create_failed_result(lineart_result, step='lineart')
+
+        model_width, model_height = lineart_result['input_size']
+        placement = (crop_width / model_width, crop_height / model_height, left / scale_x, top / scale_y)
+
+        check_cancelled(cancel_token, 'vectorization')
+        region_bounds = [min_x, min_y, max_x, max_y]
+        if 'tracing' in self.stages:
+            trace_result = self._run_stage(
+                'tracing', True, cancel_token,
+                stage_workers.trace_region,
+                lineart_result['bitmap'], style, placement, source['canvas_size'], region_bounds, source['trace_mode'],
+                timeout=cancel_token.remaining() if cancel_token is not None else None
+            )
+        else:
+            trace_result = self.vectorizer.trace_region(
+                lineart_result['bitmap'], style, placement, source['canvas_size'], region_bounds,
+                trace_mode=source['trace_mode'], cancel_token=cancel_token
+            )
+        check_cancelled(cancel_token, 'vectorization')
+        if not trace_result['success']:
+            return self._create_failed_result(trace_result, step='vectorization')
+
+        return {
+            'success': True,
+            'job_id': job_id,
+            'style': style,
+            'region': [min_x, min_y, max_x, max_y],
+            'paths': trace_result['paths'],
+            'replaced_ids': query_region(source['index'], min_x, min_y, max_x, max_y, contained=True),
+            'metrics': {
+                'total_time': time.time() - start_time,
+                'lineart_time': lineart_result['processing_time'],
+                'vectorization_time': trace_result['processing_time'],
+                'input_size': lineart_result['input_size'],
+                'path_count': trace_result['metrics']['path_count'],
+                'trace_mode': trace_result['metrics']['trace_mode']
+            },
+            'error': None
+        }
+
+    def analyse(self, image_bytes):
+        """
+        Decode and analyse an encoded image, on the analysis workers if there are any.
+
+        Args:
+            image_bytes: Encoded JPEG or PNG
+
+        Returns:
+            Analysis results (see image_analyser.analyse_image_array)
+        """
+        return self._run_stage('analysis', True, None, stage_workers.analyse_encoded, image_bytes)
+
+    def get_stage_stats(self):
+        """
+        Load of each offloaded stage.
+
+        Returns:
+            dict of stage name -> Stage.get_stats()
+        """
+        return {name: stage.get_stats() for name, stage in self.stages.items()}
+
+    def shutdown(self):
+        """Stop the stage workers (and their processes) and the style threads once their work is done."""
+        for stage in self.stages.values():
+            stage.shutdown()
+        self.style_executor.shutdown()
+
+    def _run_stage(self, name, offload, cancel_token, fn, *args, **kwargs):
+        """
+        Run a stage on its workers and wait for it, or in this thread if it has none.
+
+        Args:
+            name: 'analysis', 'inference' or 'tracing'
+            offload: False to run in this thread regardless
+            cancel_token: CancellationToken or None (see Stage.run())
+            fn: Stage function (module-level for process stages, so it can be pickled)
+            *args, **kwargs: Its arguments
+
+        Returns:
+            Return value of fn
+
+        Raises:
+            Cancelled: The token was cancelled while waiting
+        """
+        stage = self.stages.get(name) if offload else None
+        if stage is None:
+            return fn(*args, **kwargs)
+        return stage.run(cancel_token, fn, *args, **kwargs)
+
+    def _vectorize(self, bitmap, output_svg, style, include_paths, trace_mode, include_index, cancel_token, offload):
+        """
+        vectorize_bitmap() on the tracing workers, or in this thread without them.
+        A worker only gets the request's remaining time: it kills Potrace at the deadline, and an
+        explicit cancel (client gone) stops the wait here.
+
+        Returns:
+            Result dict of LineArtVectorizer.vectorize_bitmap()
+        """
+        if 'tracing' not in self.stages or not offload:
+            return self.vectorizer.vectorize_bitmap(
+                bitmap,
+                output_path=output_svg,
+                style=style,
+                include_paths=include_paths,
+                trace_mode=trace_mode,
+                include_index=include_index,
+                cancel_token=cancel_token
+            )
+
+        return self._run_stage(
+            'tracing', True, cancel_token,
+            stage_workers.vectorize_bitmap,
+            bitmap, output_svg, style, include_paths, trace_mode, include_index,
+            timeout=cancel_token.remaining() if cancel_token is not None else None
+        )
+
+    def _keep_job_input(self, job_id, style, image_for_model, lineart_result, vectorization_result):
+        """
+        Cache what refine_region() needs from a finished style.
+
+        Args:
+            job_id: Job id
+            style: Style name
+            image_for_model: Preprocessed BGR image the line art was generated from
+            lineart_result: Result of generate_array() (for the model input size)
+            vectorization_result: Result of vectorize_bitmap() with its index
+        """
+        encoded_index = vectorization_result['index']
+        self.job_cache.put((job_id, style), {
+            'image': image_for_model,
+            'canvas_size': (encoded_index['width'], encoded_index['height']),
+            'model_size': tuple(lineart_result['input_size']),
+            'index': decode_grid_index(encoded_index),
+            'threshold': vectorization_result['metrics']['threshold'],
+            'trace_mode': vectorization_result['metrics']['trace_mode']
+        })
+
+    def _style_output_path(self, output_svg, style):
+        """
+        SVG path for one style of a multi-style request.
+        
+        Args:
+            output_svg: Dict of style -> path, or a single path
+            style: Style name
             
-            return {
-                'success': False,
-                'final_svg': None,
-                'intermediate': {'preprocessed_image': None, 'lineart_png': None},
-                'analysis': analysis_results,
-                'preprocessing_applied': preprocessing_applied,
-                'warnings': analysis_results.get('warnings', []) if analysis_results else [],
-                'metrics': {
-                    'total_time': 0.0,
-                    'lineart_time': 0.0,
-                    'vectorization_time': 0.0,
-                    'path_count': None,
-                    'file_size_kb': None
-                },
-                'error': f"Pipeline error: {str(e)}"
-            }
+        Returns:
+            Path string
+        """
+        if isinstance(output_svg, dict):
+            return output_svg[style]
+
+        output_path = Path(output_svg)
+        return str(output_path.with_name(f"{output_path.stem}_{style}{output_path.suffix}"))
+
+    def _create_error_result(self, error, prepared=None):
+        """
+        Create result dict for an unexpected pipeline exception.
+        
+        Args:
+            error: The exception
+            prepared: Dict from _prepare_input() if it got that far
+            
+        Returns:
+            Formatted error result dict
+        """
+        analysis_results = prepared['analysis'] if prepared else None
+
+        return {
+            'success': False,
+            'final_svg': None,
+            'intermediate': {'preprocessed_image': None, 'lineart_png': None},
+            'analysis': analysis_results,
+            'preprocessing_applied': [],
+            'warnings': analysis_results.get('warnings', []) if analysis_results else [],
+            'metrics': {
+                'total_time': 0.0,
+                'lineart_time': 0.0,
+                'vectorization_time': 0.0,
+                'path_count': None,
+                'file_size_kb': None
+            },
+            'error': f"Pipeline error: {str(error)}",
+            'cancelled': isinstance(error, Cancelled),
+            'invalid_input': isinstance(error, InvalidImage)
+        }
     
     def _create_failed_result(self, failed_result, step):
         """
@@ -214,8 +748,9 @@ def main():
     parser.add_argument(
         '--style',
         choices=['contour', 'anime'],
-        default='contour',
-        help='Line art style (default: contour)'
+        nargs='+',
+        default=['contour'],
+        help='Line art style(s) (default: contour). With several styles, each SVG gets a _<style> suffix'
     )
     parser.add_argument(
         '--models-dir',
@@ -227,12 +762,31 @@ def main():
         action='store_true',
         help='Skip image analysis and preprocessing'
     )
+    parser.add_argument(
+        '--quality',
+        choices=['fast', 'balanced', 'high'],
+        default='balanced',
+        help='Inference resolution: fast (192px), balanced (256px) or high (512px) (default: balanced)'
+    )
+    parser.add_argument(
+        '--trace-mode',
+        choices=['outline', 'centerline'],
+        default=None,
+        help='Trace stroke outlines (Potrace) or centerlines as stroked paths (default: outline)'
+    )
     
     args = parser.parse_args()
     
     # Run pipeline
     pipeline = ImageProcessingPipeline(models_dir=args.models_dir)
-    result = pipeline.process(args.input, args.output, style=args.style, skip_preprocess=args.skip_preprocess)
+    result = pipeline.process(
+        args.input,
+        args.output,
+        style=args.style[0] if len(args.style) == 1 else args.style,
+        skip_preprocess=args.skip_preprocess,
+        quality=args.quality,
+        trace_mode=args.trace_mode
+    )
     
     # Print result
     print(json.dumps(result, indent=2))
@@ -86,6 +86,8 @@ def combine_results(lineart_result, vectorization_result):
             'path_count': None,
             'file_size_kb': None
         },
+        'paths': None,
+        'index': None,
         'error': None
     }
     
@@ -101,6 +103,12 @@ def combine_results(lineart_result, vectorization_result):
         
         combined['metrics']['path_count'] = vectorization_result['metrics']['path_count']
         combined['metrics']['file_size_kb'] = vectorization_result['metrics']['file_size_kb']
+        combined['metrics']['svg_bytes_saved'] = vectorization_result['metrics'].get('bytes_saved')
+        combined['metrics']['path_ids'] = vectorization_result['metrics'].get('path_ids', False)
+        combined['metrics']['trace_mode'] = vectorization_result['metrics'].get('trace_mode')
+        combined['metrics']['optimization'] = vectorization_result['metrics'].get('optimization')
+        combined['paths'] = vectorization_result.get('paths')
+        combined['index'] = vectorization_result.get('index')
 
     # otherwise, set error message based on which step failed
     else:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+In-process tracing backend built on potracer (pure Python port of Potrace).
+Traces the packed line art bitmap without a subprocess or temp files and builds
+the same document dict that svg_writer.parse_potrace_svg() gives for the CLI's output,
+so the rest of the vectorizer (optimizer, writer, path list) works unchanged.
+"""
+
+import numpy as np
+
+try:
+    import potrace
+except ImportError: # optional dependency
+    potrace = None
+
+from path_list import subpath_cubics, flatten_cubics, polygon_area
+
+# Potrace's SVG backend writes coordinates in tenths of a pixel, y up, under this transform
+UNITS_PER_PIXEL = 10
+
+
+def available():
+    """Whether potracer is installed."""
+    return potrace is not None
+
+
+def _point_in_polygon(x, y, polygon):
+    """Even-odd ray casting test of a point against an (n, 2) polygon."""
+    px, py = polygon[:, 0], polygon[:, 1]
+    qx, qy = np.roll(px, -1), np.roll(py, -1)
+    crosses = (py > y) != (qy > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersect_x = px + (y - py) * (qx - px) / (qy - py)
+    return bool(np.count_nonzero(crosses & (x < intersect_x)) % 2)
+
+
+def trace_bitmap(bitmap, turdsize=2, alphamax=1.0, opttolerance=0.2):
+    """
+    Trace a packed bitmap in process.
+
+    Args:
+        bitmap: PackedBitmap (set bits = line pixels)
+        turdsize: Suppress speckles of up to this many pixels
+        alphamax: Corner threshold
+        opttolerance: Curve optimization tolerance
+
+    Returns:
+        Document dict (see svg_writer.parse_potrace_svg), one path per shape with its holes
+    """
+    if potrace is None:
+        raise RuntimeError("potracer is not installed (pip install potracer)")
+
+    width, height = bitmap.width, bitmap.height
+
+    # potracer traces the False pixels, so line pixels must be False
+    curves = potrace.Bitmap(~bitmap.unpack()).trace(
+        turdsize=turdsize, alphamax=alphamax, opttolerance=opttolerance
+    )
+
+    def point(p):
+        return (int(round(p.x * UNITS_PER_PIXEL)), int(round((height - p.y) * UNITS_PER_PIXEL)))
+
+    # potracer gives a flat list (no curve tree); outer shapes and holes run opposite ways
+    outlines = []
+    for curve in curves:
+        segments = []
+        for segment in curve.segments:
+            if segment.is_corner:
+                segments.append(point(segment.c))
+                segments.append(point(segment.end_point))
+            else:
+                segments.append(point(segment.c1) + point(segment.c2) + point(segment.end_point))
+
+        subpath = {'start': point(curve.start_point), 'segments': segments, 'closed': True}
+        start, cubics = subpath_cubics(subpath)
+        polygon = flatten_cubics(start, cubics, steps=2)
+        outlines.append((subpath, polygon, polygon_area(polygon)))
+
+    # y is flipped, so outer shapes have negative signed area here
+    shapes = [i for i, (_, _, area) in enumerate(outlines) if area < 0]
+    paths = {i: {'subpaths': [outlines[i][0]]} for i in shapes}
+
+    if shapes:
+        boxes = np.array([np.concatenate([outlines[i][1].min(axis=0), outlines[i][1].max(axis=0)]) for i in shapes])
+        sizes = np.array([-outlines[i][2] for i in shapes])
+
+    # each hole belongs to the smallest shape around it (same <path>, so the nonzero fill cuts it out)
+    for index, (subpath, _, area) in enumerate(outlines):
+        if area < 0 or not shapes:
+            continue
+        x, y = subpath['start']
+        inside_box = np.flatnonzero((boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3]))
+        for candidate in inside_box[np.argsort(sizes[inside_box])]:
+            shape = shapes[candidate]
+            if _point_in_polygon(x, y, outlines[shape][1]):
+                paths[shape]['subpaths'].append(subpath)
+                break
+
+    return {
+        'width': f"{width}pt",
+        'height': f"{height}pt",
+        'viewbox': [0, 0, width, height],
+        'transform': (1.0 / UNITS_PER_PIXEL, -1.0 / UNITS_PER_PIXEL, 0.0, float(height)),
+        'transform_attr': f"translate(0,{height}) scale({1.0 / UNITS_PER_PIXEL},{-1.0 / UNITS_PER_PIXEL})",
+        'fill': '#000000',
+        'paths': [paths[i] for i in shapes]
+    }
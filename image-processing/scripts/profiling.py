@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Per-request profile capture for diagnosing slow photos in production.
+Runs one call under cProfile (Python call tree of the calling thread) or the torch profiler
+(operator-level trace of the model forward, Chrome trace format), and returns the profile
+as a body ready to be stored and served.
+"""
+
+import io
+import os
+import pstats
+import cProfile
+import tempfile
+import threading
+
+PROFILE_KINDS = ('cprofile', 'torch')
+
+# Functions listed in a cProfile report
+CPROFILE_TOP = 60
+
+# cProfile hooks are per thread but only one torch profiler may run per process; profiling
+# is a debug path, so profiled requests simply take turns
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when another request is being profiled."""
+
+
+def run_profiled(kind, fn, *args, **kwargs):
+    """
+    Call a function under a profiler.
+
+    Args:
+        kind: 'cprofile' or 'torch'
+        fn: Function to profile
+        *args, **kwargs: Its arguments
+
+    Returns:
+        tuple: (return value of fn, profile dict with kind, content_type and body (bytes))
+
+    Raises:
+        ValueError: Unknown profiler kind
+        ProfilerBusy: Another request is being profiled
+    """
+    if kind not in PROFILE_KINDS:
+        raise ValueError(f"Invalid profiler '{kind}'. Choose 'cprofile' or 'torch'.")
+
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another request is being profiled")
+
+    try:
+        if kind == 'cprofile':
+            return _run_cprofile(fn, args, kwargs)
+        return _run_torch_profiler(fn, args, kwargs)
+    finally:
+        _profile_lock.release()
+
+
+def _run_cprofile(fn, args, kwargs):
+    """Profile with cProfile and report the top functions by cumulative time."""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args, **kwargs)
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(CPROFILE_TOP)
+
+    return result, {
+        'kind': 'cprofile',
+        'content_type': 'text/plain; charset=utf-8',
+        'body': report.getvalue().encode('utf-8')
+    }
+
+
+def _run_torch_profiler(fn, args, kwargs):
+    """Profile with the torch profiler and export a Chrome trace (open in chrome://tracing or Perfetto)."""
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    with profile(activities=activities, record_shapes=True) as profiler:
+        result = fn(*args, **kwargs)
+
+    # the exporter only writes to files
+    fd, trace_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        profiler.export_chrome_trace(trace_path)
+        with open(trace_path, 'rb') as f:
+            body = f.read()
+    finally:
+        os.remove(trace_path)
+
+    return result, {
+        'kind': 'torch',
+        'content_type': 'application/json',
+        'body': body
+    }
+
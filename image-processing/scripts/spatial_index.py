@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Spatial index over the paths of a vectorized drawing.
+A uniform grid in compressed sparse row (CSR) form: for every cell, the indices of the
+paths whose bounding box overlaps it. Serialized as little-endian typed arrays (base64)
+next to the per-path bounding boxes, so the server and editor can answer
+"which paths intersect this region" without parsing the SVG.
+"""
+
+import math
+
+import numpy as np
+
+from path_list import encode_array, decode_array
+
+# Smallest cell side in pixels; finer grids only grow the index
+MIN_CELL_SIZE = 8
+
+
+def choose_cell_size(width, height, count):
+    """
+    Grid cell side so there are roughly as many cells as paths.
+
+    Args:
+        width: Drawing width
+        height: Drawing height
+        count: Number of paths
+
+    Returns:
+        Cell side in pixels
+    """
+    if count == 0:
+        return max(width, height, MIN_CELL_SIZE)
+    return max(MIN_CELL_SIZE, int(math.ceil(math.sqrt(width * height / count))))
+
+
+def build_grid_index(ids, bboxes, width, height, cell_size=None):
+    """
+    Build a uniform grid index.
+
+    Args:
+        ids: Path ids, in drawing order
+        bboxes: (n, 4) array of [min_x, min_y, max_x, max_y] per path, in viewBox coordinates
+        width: Drawing width (viewBox)
+        height: Drawing height (viewBox)
+        cell_size: Grid cell side in pixels (default: choose_cell_size())
+
+    Returns:
+        dictionary with:
+            cell_size, cols, rows (int): Grid layout, cells cover [0, cols * cell_size) x [0, rows * cell_size)
+            cell_offsets (ndarray): uint32, cols * rows + 1 offsets into cell_items, row-major cells
+            cell_items (ndarray): uint32 path indices per cell, ascending
+            ids, bboxes: As given
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    count = len(bboxes)
+    cell_size = cell_size or choose_cell_size(width, height, count)
+    cols = max(1, int(math.ceil(width / cell_size)))
+    rows = max(1, int(math.ceil(height / cell_size)))
+
+    # cell range covered by each box, clamped to the grid
+    col_start = np.clip(np.floor(bboxes[:, 0] / cell_size), 0, cols - 1).astype(np.int64)
+    col_end = np.clip(np.floor(bboxes[:, 2] / cell_size), 0, cols - 1).astype(np.int64)
+    row_start = np.clip(np.floor(bboxes[:, 1] / cell_size), 0, rows - 1).astype(np.int64)
+    row_end = np.clip(np.floor(bboxes[:, 3] / cell_size), 0, rows - 1).astype(np.int64)
+
+    # one (cell, path) entry per covered cell
+    spans = col_end - col_start + 1
+    covered = spans * (row_end - row_start + 1)
+    paths = np.repeat(np.arange(count, dtype=np.int64), covered)
+    step = np.arange(len(paths), dtype=np.int64) - np.repeat(np.cumsum(covered) - covered, covered)
+    cells = (row_start[paths] + step // spans[paths]) * cols + col_start[paths] + step % spans[paths]
+
+    order = np.argsort(cells, kind='stable') # stable keeps paths in drawing order within a cell
+    cell_offsets = np.zeros(cols * rows + 1, dtype=np.uint32)
+    cell_offsets[1:] = np.cumsum(np.bincount(cells, minlength=cols * rows))
+
+    return {
+        'cell_size': cell_size,
+        'cols': cols,
+        'rows': rows,
+        'cell_offsets': cell_offsets,
+        'cell_items': paths[order].astype(np.uint32),
+        'ids': list(ids),
+        'bboxes': bboxes
+    }
+
+
+def encode_grid_index(index, width, height):
+    """
+    JSON-serialisable form of a grid index.
+
+    Args:
+        index: Dict from build_grid_index()
+        width: Drawing width (viewBox)
+        height: Drawing height (viewBox)
+
+    Returns:
+        Dict with the layout, ids and base64-encoded 'bboxes' (float32, 4 per path),
+        'cell_offsets' and 'cell_items' (uint32)
+    """
+    return {
+        'format': 'grid-csr-v1',
+        'encoding': 'base64-le',
+        'width': width,
+        'height': height,
+        'count': len(index['ids']),
+        'cell_size': index['cell_size'],
+        'cols': index['cols'],
+        'rows': index['rows'],
+        'ids': index['ids'],
+        'arrays': {
+            'bboxes': encode_array(index['bboxes'], 'float32'),
+            'cell_offsets': encode_array(index['cell_offsets'], 'uint32'),
+            'cell_items': encode_array(index['cell_items'], 'uint32')
+        }
+    }
+
+
+def decode_grid_index(encoded):
+    """
+    Inverse of encode_grid_index().
+
+    Args:
+        encoded: Dict from encode_grid_index()
+
+    Returns:
+        Dict in the shape of build_grid_index()
+    """
+    arrays = encoded['arrays']
+    return {
+        'cell_size': encoded['cell_size'],
+        'cols': encoded['cols'],
+        'rows': encoded['rows'],
+        'cell_offsets': decode_array(arrays['cell_offsets']),
+        'cell_items': decode_array(arrays['cell_items']),
+        'ids': encoded['ids'],
+        'bboxes': decode_array(arrays['bboxes']).reshape(-1, 4)
+    }
+
+
+def query_region(index, min_x, min_y, max_x, max_y, contained=False):
+    """
+    Paths whose bounding box intersects a rectangle.
+
+    Args:
+        index: Dict from build_grid_index() or decode_grid_index()
+        min_x, min_y, max_x, max_y: Query rectangle in viewBox coordinates
+        contained: Only return paths whose bounding box lies entirely inside the rectangle
+
+    Returns:
+        List of path ids, in drawing order
+    """
+    cell_size, cols, rows = index['cell_size'], index['cols'], index['rows']
+    col_start = min(max(int(min_x // cell_size), 0), cols - 1)
+    col_end = min(max(int(max_x // cell_size), 0), cols - 1)
+    row_start = min(max(int(min_y // cell_size), 0), rows - 1)
+    row_end = min(max(int(max_y // cell_size), 0), rows - 1)
+
+    offsets = index['cell_offsets']
+    candidates = [
+        index['cell_items'][offsets[row * cols + col_start]:offsets[row * cols + col_end + 1]]
+        for row in range(row_start, row_end + 1)
+    ] # the cells of one row are contiguous, so each row is a single slice
+
+    if not candidates:
+        return []
+    candidates = np.unique(np.concatenate(candidates))
+
+    boxes = index['bboxes'][candidates]
+    if contained:
+        hits = candidates[
+            (boxes[:, 0] >= min_x) & (boxes[:, 2] <= max_x) & (boxes[:, 1] >= min_y) & (boxes[:, 3] <= max_y)
+        ]
+    else:
+        hits = candidates[
+            (boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)
+        ]
+
+    return [index['ids'][i] for i in hits]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Staged execution for the pipeline: each heavy stage (analysis, inference, tracing) has its own
+workers fed from a bounded queue, so concurrent requests form a producer/consumer chain.
+While one request is being traced the next can be in inference, and sustained throughput
+is set by the slowest stage instead of the sum of all of them. A full queue blocks the
+request handing work to it (backpressure) rather than letting work pile up unbounded.
+"""
+
+import time
+import queue
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+# How often a request waiting on a stage checks whether it was cancelled (seconds)
+CANCEL_POLL_S = 0.25
+
+
+class Stage:
+    """One pipeline stage: a bounded work queue and a fixed set of workers."""
+
+    def __init__(self, name, workers, queue_size=0, processes=False, initializer=None, initargs=()):
+        """
+        Start the stage's workers.
+
+        Args:
+            name: Stage name (as used in metrics, e.g. 'inference')
+            workers: Items processed at the same time
+            queue_size: Items allowed to wait for a worker (0 = unbounded)
+            processes: Run items in worker processes (for GIL-bound Python) instead of threads;
+                the processes are spawned, since torch and OpenCV thread pools don't survive a fork
+            initializer, initargs: Called once in each worker process
+        """
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=initializer,
+            initargs=initargs
+        ) if processes else None
+
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._busy = 0 # workers running an item
+        self._busy_seconds = 0.0 # of finished items
+        self._busy_since = {} # worker thread -> start of its current item
+        self.stats = {'completed': 0, 'failed': 0, 'cancelled': 0}
+
+        # with processes, each thread hands one item at a time to the pool and waits for it
+        self._threads = [
+            threading.Thread(target=self._work, name=f"stage-{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def run(self, cancel_token, fn, *args, **kwargs):
+        """
+        Queue an item and wait for its result.
+        While queued or waiting, the request's cancellation token is polled: a cancelled request
+        stops waiting straight away, and its item is dropped if no worker has picked it up yet.
+
+        Args:
+            cancel_token: CancellationToken or None
+            fn: Stage function (module-level for process stages, so it can be pickled)
+            *args, **kwargs: Its arguments
+
+        Returns:
+            Return value of fn
+
+        Raises:
+            Cancelled: The token was cancelled while waiting
+        """
+        poll = CANCEL_POLL_S if cancel_token is not None else None
+        future = Future()
+        # thread stages run the item in the request's context, so its log records keep the request id
+        item = (future, contextvars.copy_context(), fn, args, kwargs)
+
+        while True:
+            try:
+                self._queue.put(item, timeout=poll)
+                break
+            except queue.Full:
+                cancel_token.check(self.name)
+
+        while True:
+            try:
+                return future.result(timeout=poll)
+            except FutureTimeout:
+                if cancel_token.cancelled:
+                    future.cancel() # only drops it if it hasn't started yet
+                    cancel_token.check(self.name)
+
+    def _work(self):
+        """Worker loop: take items off the queue until shutdown() sends None."""
+        me = threading.current_thread()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            future, context, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                with self._lock:
+                    self.stats['cancelled'] += 1
+                continue
+
+            start = time.monotonic()
+            with self._lock:
+                self._busy += 1
+                self._busy_since[me] = start
+
+            try:
+                if self._pool is not None:
+                    result = self._pool.submit(fn, *args, **kwargs).result()
+                else:
+                    result = context.run(fn, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                outcome = 'failed'
+            else:
+                future.set_result(result)
+                outcome = 'completed'
+
+            with self._lock:
+                self._busy -= 1
+                self._busy_seconds += time.monotonic() - start
+                del self._busy_since[me]
+                self.stats[outcome] += 1
+
+    def get_stats(self):
+        """
+        Load of the stage.
+
+        Returns:
+            dict with workers, busy (workers running an item), queue_depth, queue_size,
+            busy_seconds (total worker time spent on items), utilisation (busy_seconds over the
+            workers' lifetime, 0-1) and the completed, failed and cancelled item counts
+        """
+        now = time.monotonic()
+        with self._lock:
+            busy_seconds = self._busy_seconds + sum(now - since for since in self._busy_since.values())
+            stats = dict(self.stats)
+            busy = self._busy
+
+        elapsed = max(now - self._started, 1e-9)
+        return {
+            'workers': self.workers,
+            'busy': busy,
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self.queue_size,
+            'busy_seconds': round(busy_seconds, 3),
+            'utilisation': round(min(1.0, busy_seconds / (elapsed * self.workers)), 4),
+            **stats
+        }
+
+    def shutdown(self):
+        """Stop the workers once the queued items are done."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Pipeline stages run in worker processes.
+Analysis and tracing are largely Python (path optimization, serialization) and hold the GIL,
+so ImageProcessingPipeline runs those stages in worker processes (see stage_engine.py) instead
+of next to inference. The functions here are what the workers execute; each keeps its own vectorizer.
+"""
+
+from image_analyser import analyse_image_array, decode_image
+from vectorize_lineart import LineArtVectorizer
+from cancellation import CancellationToken
+
+# Set up once per worker process by init_worker()
+_vectorizer = None
+
+
+def init_worker(optimize_options=None, trace_backend='auto'):
+    """
+    Process pool initializer: build this worker's vectorizer.
+
+    Args:
+        optimize_options: Path optimizer settings (see LineArtVectorizer.optimize_options)
+        trace_backend: Outline tracer, 'cli', 'potracer' or 'auto'
+    """
+    global _vectorizer
+    _vectorizer = LineArtVectorizer(optimize_options=optimize_options, backend=trace_backend)
+
+
+def analyse_encoded(image_bytes):
+    """
+    Decode and analyse an encoded image; only the (small) encoded bytes cross the process boundary.
+
+    Args:
+        image_bytes: Encoded JPEG or PNG
+
+    Returns:
+        Analysis results (see image_analyser.analyse_image_array)
+    """
+    return analyse_image_array(decode_image(image_bytes))
+
+
+def vectorize_bitmap(bitmap, output_path, style, include_paths, trace_mode, include_index, timeout=None):
+    """
+    LineArtVectorizer.vectorize_bitmap() in a worker.
+    A cancellation token can't cross the process boundary, so only the request's remaining time does:
+    Potrace is killed once it is spent.
+
+    Args:
+        bitmap, output_path, style, include_paths, trace_mode, include_index: As for vectorize_bitmap()
+        timeout: Seconds left until the request's deadline (None = no deadline)
+
+    Returns:
+        Result dict of vectorize_bitmap()
+    """
+    return _vectorizer.vectorize_bitmap(
+        bitmap,
+        output_path=output_path,
+        style=style,
+        include_paths=include_paths,
+        trace_mode=trace_mode,
+        include_index=include_index,
+        cancel_token=CancellationToken(timeout=timeout) if timeout is not None else None
+    )
+
+
+def trace_region(bitmap, style, placement, canvas_size, region, trace_mode, timeout=None):
+    """
+    LineArtVectorizer.trace_region() in a worker (see vectorize_bitmap() for timeout).
+
+    Returns:
+        Result dict of trace_region()
+    """
+    return _vectorizer.trace_region(
+        bitmap, style, placement, canvas_size, region,
+        trace_mode=trace_mode,
+        cancel_token=CancellationToken(timeout=timeout) if timeout is not None else None
+    )
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Non-blocking, structured logging for the API.
+Request threads only put records on a queue; a background listener thread formats them
+(JSON lines for the log file) and does the I/O, with size-based rotation of the file.
+Per-request context (request id, style, image size, stage timings) is bound once per request
+and attached to every record logged while it is active.
+"""
+
+import json
+import copy
+import queue
+import atexit
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Fields of the request being handled in this context (None outside a request)
+_request_context = contextvars.ContextVar('request_context', default=None)
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'context'}
+
+
+class ContextQueueHandler(QueueHandler):
+    """Queue handler that snapshots the request context on the logging thread."""
+
+    def prepare(self, record):
+        """
+        Make the record safe to hand to the listener thread.
+        The message is merged with its args here (they may change later) and the traceback
+        rendered, but JSON encoding and I/O are left to the listener.
+
+        Args:
+            record: LogRecord
+
+        Returns:
+            Copy of the record with context attached
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        context = _request_context.get()
+        record.context = dict(context) if context else {}
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request context and extra fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **getattr(record, 'context', {})
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for the terminal, with the request id when there is one."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, 'context', {}).get('request_id')
+        return f"{line} [{request_id}]" if request_id else line
+
+
+def setup_logging(log_file, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    Route the root logger through a queue to a background listener.
+    Calling it again (e.g. when the module is imported twice) keeps the first setup.
+
+    Args:
+        log_file: Path of the JSON lines log file
+        level: Root log level
+        max_bytes: Size at which the file is rotated (0 = never)
+        backup_count: Rotated files kept (api.log.1, api.log.2, ...)
+
+    Returns:
+        The running QueueListener
+    """
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, ContextQueueHandler):
+            return handler.listener
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(TextFormatter())
+
+    log_queue = queue.SimpleQueue() # unbounded: logging never blocks or drops on the request path
+    listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.listener = listener
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop) # flush what is still queued on shutdown
+    return listener
+
+
+def bind_request(**fields):
+    """
+    Start a request context; its fields are attached to every record logged in this context.
+
+    Args:
+        **fields: Context fields, e.g. request_id, endpoint, styles
+
+    Returns:
+        Token for reset_request()
+    """
+    return _request_context.set(dict(fields))
+
+
+def update_request(**fields):
+    """
+    Add fields to the current request context (e.g. image size once decoded, stage timings once done).
+
+    Args:
+        **fields: Context fields
+    """
+    context = _request_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+def reset_request(token):
+    """
+    End a request context.
+
+    Args:
+        token: Token from bind_request()
+    """
+    _request_context.reset(token)
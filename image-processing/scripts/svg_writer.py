@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Compact SVG writer for vectorized line art.
+Parses Potrace's SVG into absolute path geometry and re-emits it with quantized
+coordinates, the shorter of absolute/relative commands, an optional folded
+transform and no whitespace.
+"""
+
+import re
+import hashlib
+
+# Tokens in path data: a command letter or a number
+PATH_TOKEN_RE = re.compile(r'([MmLlHhVvCcZz])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+# Number of coordinates each command consumes
+COMMAND_ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'Z': 0}
+
+
+def _attribute(tag, name):
+    """Value of an XML attribute in a start tag, or None."""
+    match = re.search(r'\s' + name + r'="([^"]*)"', tag)
+    return match.group(1) if match else None
+
+
+def parse_transform(transform):
+    """
+    Parse a transform made of translate() and scale() into (sx, sy, tx, ty).
+
+    Args:
+        transform: SVG transform attribute, e.g. 'translate(0,256) scale(0.1,-0.1)'
+
+    Returns:
+        Tuple (sx, sy, tx, ty) mapping x -> sx*x + tx and y -> sy*y + ty, or None if it has other operations
+    """
+    sx, sy, tx, ty = 1.0, 1.0, 0.0, 0.0
+
+    for name, args in re.findall(r'(\w+)\(([^)]*)\)', transform):
+        values = [float(v) for v in re.split(r'[\s,]+', args.strip()) if v]
+
+        if name == 'translate':
+            dx = values[0]
+            dy = values[1] if len(values) > 1 else 0.0
+            # composed on the left: the new op applies after what is already accumulated
+            tx += sx * dx
+            ty += sy * dy
+        elif name == 'scale':
+            kx = values[0]
+            ky = values[1] if len(values) > 1 else kx
+            sx *= kx
+            sy *= ky
+        else:
+            return None
+
+    return (sx, sy, tx, ty)
+
+
+def parse_path_data(d):
+    """
+    Parse SVG path data into absolute subpaths.
+
+    Args:
+        d: Path data string (M/L/H/V/C/Z, absolute or relative)
+
+    Returns:
+        List of subpaths, each a dict with:
+            start (tuple): (x, y) of the moveto
+            segments (list): (x, y) tuples for lines and (x1, y1, x2, y2, x, y) tuples for cubics
+            closed (bool): Whether the subpath ends with Z
+    """
+    subpaths = []
+    current = None
+    x = y = 0.0
+    command = None
+    numbers = []
+
+    def flush(command, numbers):
+        nonlocal current, x, y
+
+        upper = command.upper()
+        relative = command.islower()
+        count = COMMAND_ARGS[upper]
+
+        if upper == 'Z':
+            if current is not None:
+                current['closed'] = True
+                x, y = current['start']
+            return
+
+        if count == 0 or len(numbers) % count:
+            raise ValueError(f"Bad argument count for '{command}' in path data")
+
+        for i in range(0, len(numbers), count):
+            args = numbers[i:i + count]
+
+            if upper == 'M' and i == 0:
+                nx, ny = (x + args[0], y + args[1]) if relative else (args[0], args[1])
+                current = {'start': (nx, ny), 'segments': [], 'closed': False}
+                subpaths.append(current)
+                x, y = nx, ny
+                continue
+
+            if current is None:
+                raise ValueError("Path data must start with a moveto")
+
+            if upper in ('M', 'L'): # extra moveto pairs are implicit linetos
+                nx, ny = (x + args[0], y + args[1]) if relative else (args[0], args[1])
+                current['segments'].append((nx, ny))
+            elif upper == 'H':
+                nx, ny = (x + args[0] if relative else args[0]), y
+                current['segments'].append((nx, ny))
+            elif upper == 'V':
+                nx, ny = x, (y + args[0] if relative else args[0])
+                current['segments'].append((nx, ny))
+            else: # C
+                if relative:
+                    args = [v + (x if j % 2 == 0 else y) for j, v in enumerate(args)]
+                nx, ny = args[4], args[5]
+                current['segments'].append(tuple(args))
+
+            x, y = nx, ny
+
+    for letter, number in PATH_TOKEN_RE.findall(d):
+        if letter:
+            if command is not None:
+                flush(command, numbers)
+            command = letter
+            numbers = []
+        else:
+            numbers.append(float(number))
+
+    if command is not None:
+        flush(command, numbers)
+
+    return subpaths
+
+
+def parse_potrace_svg(svg_text):
+    """
+    Parse Potrace SVG output into a document dict.
+
+    Args:
+        svg_text: SVG string written by potrace -s
+
+    Returns:
+        dictionary with:
+            width (str): width attribute (units kept, e.g. '344.000000pt')
+            height (str): height attribute
+            viewbox (list): [min_x, min_y, width, height]
+            transform (tuple): (sx, sy, tx, ty) of the path group, None if identity/absent
+            transform_attr (str): Raw transform attribute (used when it can't be folded)
+            fill (str): Fill colour of the path group
+            paths (list): One dict per <path> with 'subpaths' (see parse_path_data) and 'id' if it has one
+    """
+    svg_match = re.search(r'<svg\b[^>]*>', svg_text)
+    if svg_match is None:
+        raise ValueError("No <svg> element found")
+    svg_tag = svg_match.group(0)
+
+    viewbox = _attribute(svg_tag, 'viewBox')
+    group_match = re.search(r'<g\b[^>]*>', svg_text)
+    group_tag = group_match.group(0) if group_match else ''
+
+    transform_attr = _attribute(group_tag, 'transform')
+    transform = parse_transform(transform_attr) if transform_attr else None
+
+    paths = []
+    for tag in re.findall(r'<path\b[^>]*>', svg_text):
+        path = {'subpaths': parse_path_data(_attribute(tag, 'd') or '')}
+        path_id = _attribute(tag, 'id')
+        if path_id:
+            path['id'] = path_id
+        paths.append(path)
+
+    return {
+        'width': _attribute(svg_tag, 'width'),
+        'height': _attribute(svg_tag, 'height'),
+        'viewbox': [float(v) for v in re.split(r'[\s,]+', viewbox.strip())] if viewbox else None,
+        'transform': transform,
+        'transform_attr': transform_attr,
+        'fill': _attribute(group_tag, 'fill') or '#000000',
+        'paths': paths
+    }
+
+
+def compose_transforms(outer, inner):
+    """
+    Transform that applies inner first, then outer.
+
+    Args:
+        outer, inner: (sx, sy, tx, ty) tuples as returned by parse_transform()
+
+    Returns:
+        (sx, sy, tx, ty) tuple
+    """
+    osx, osy, otx, oty = outer
+    isx, isy, itx, ity = inner
+    return (osx * isx, osy * isy, osx * itx + otx, osy * ity + oty)
+
+
+def invert_transform(transform):
+    """
+    Inverse of a translate/scale transform.
+
+    Args:
+        transform: (sx, sy, tx, ty) tuple with non-zero scales
+
+    Returns:
+        (sx, sy, tx, ty) tuple
+    """
+    sx, sy, tx, ty = transform
+    return (1.0 / sx, 1.0 / sy, -tx / sx, -ty / sy)
+
+
+def transform_subpaths(subpaths, transform):
+    """
+    Apply a translate/scale transform to every coordinate of some subpaths.
+
+    Args:
+        subpaths: Subpaths as returned by parse_path_data() (modified in place)
+        transform: (sx, sy, tx, ty) tuple
+
+    Returns:
+        The same list
+    """
+    sx, sy, tx, ty = transform
+
+    def point(x, y):
+        return (sx * x + tx, sy * y + ty)
+
+    for subpath in subpaths:
+        subpath['start'] = point(*subpath['start'])
+        subpath['segments'] = [
+            tuple(v for j in range(0, len(seg), 2) for v in point(seg[j], seg[j + 1]))
+            for seg in subpath['segments']
+        ]
+
+    return subpaths
+
+
+def fold_transform(document):
+    """
+    Apply the group's translate/scale to every coordinate so the SVG needs no transform.
+
+    Args:
+        document: Dict from parse_potrace_svg() (modified in place)
+
+    Returns:
+        The same document
+    """
+    transform = document.get('transform')
+    if transform is None:
+        return document
+
+    for path in document['paths']:
+        transform_subpaths(path['subpaths'], transform)
+
+    document['transform'] = None
+    document['transform_attr'] = None
+    return document
+
+
+def format_number(value, scale, precision):
+    """
+    Shortest decimal text for a quantized coordinate.
+
+    Args:
+        value: Integer coordinate in units of 1/scale
+        scale: 10 ** precision
+        precision: Number of decimals
+
+    Returns:
+        String such as '12', '-3.5' or '.25'
+    """
+    sign = '-' if value < 0 else ''
+    whole, fraction = divmod(abs(value), scale)
+
+    text = str(whole) if whole else ''
+    if precision and fraction:
+        text += '.' + str(fraction).rjust(precision, '0').rstrip('0')
+
+    return sign + text if text else '0'
+
+
+def join_numbers(numbers):
+    """
+    Join numbers with the fewest separators ('-' and a second '.' start a new number on their own).
+
+    Args:
+        numbers: List of formatted numbers
+
+    Returns:
+        Joined string
+    """
+    out = []
+    previous = None
+
+    for number in numbers:
+        if previous is not None:
+            if not (number[0] == '-' or (number[0] == '.' and '.' in previous)):
+                out.append(' ')
+        out.append(number)
+        previous = number
+
+    return ''.join(out)
+
+
+def encode_path_data(subpaths, precision=0):
+    """
+    Minified path data for a list of absolute subpaths.
+    Coordinates are quantized to the given number of decimals and each command is
+    written absolute or relative, whichever is shorter.
+
+    Args:
+        subpaths: Subpaths as returned by parse_path_data()
+        precision: Number of decimals to keep
+
+    Returns:
+        Path data string
+    """
+    scale = 10 ** precision
+
+    def q(v):
+        return int(round(v * scale))
+
+    def fmt(values):
+        return join_numbers([format_number(v, scale, precision) for v in values])
+
+    parts = []
+    last_command = None
+    cx = cy = 0 # current point, quantized, so relative offsets never drift
+
+    def emit(command, text):
+        nonlocal last_command
+        # a command repeated back to back can drop its letter (not after a moveto, where it would mean lineto)
+        if command == last_command and command not in ('M', 'm'):
+            if text[0] != '-':
+                parts.append(' ')
+            parts.append(text)
+        else:
+            parts.append(command + text)
+        last_command = command
+
+    for subpath in subpaths:
+        sx, sy = q(subpath['start'][0]), q(subpath['start'][1])
+
+        absolute = fmt([sx, sy])
+        relative = fmt([sx - cx, sy - cy])
+        if parts and len(relative) < len(absolute):
+            emit('m', relative)
+        else:
+            emit('M', absolute)
+        cx, cy = sx, sy
+
+        for segment in subpath['segments']:
+            points = [q(v) for v in segment]
+            nx, ny = points[-2], points[-1]
+
+            if len(points) == 2:
+                if ny == cy:
+                    options = [('H', fmt([nx])), ('h', fmt([nx - cx]))]
+                elif nx == cx:
+                    options = [('V', fmt([ny])), ('v', fmt([ny - cy]))]
+                else:
+                    options = [('L', fmt([nx, ny])), ('l', fmt([nx - cx, ny - cy]))]
+            else:
+                deltas = [v - (cx if j % 2 == 0 else cy) for j, v in enumerate(points)]
+                options = [('C', fmt(points)), ('c', fmt(deltas))]
+
+            # cost includes the command letter unless it can be left implicit
+            def cost(option):
+                command, text = option
+                return len(text) + (0 if command == last_command else 1)
+
+            emit(*min(options, key=cost))
+            cx, cy = nx, ny
+
+        if subpath['closed']:
+            parts.append('z')
+            last_command = 'z'
+            cx, cy = sx, sy
+
+    return ''.join(parts)
+
+
+def make_path_id(path_data, seen):
+    """
+    Deterministic, content-derived id for a path.
+    The same geometry always gets the same id, so reprocessing an image gives stable ids;
+    identical paths within one drawing get a numeric suffix.
+
+    Args:
+        path_data: Path data string the id is derived from
+        seen: Dict of ids handed out so far in this drawing (updated)
+
+    Returns:
+        Id string such as 'path_3f9a1c0b2d4e'
+    """
+    base = 'path_' + hashlib.blake2b(path_data.encode('utf-8'), digest_size=6).hexdigest()
+
+    count = seen.get(base, 0) + 1
+    seen[base] = count
+
+    return base if count == 1 else f"{base}_{count}"
+
+
+def assign_path_ids(svg_text):
+    """
+    Add content-derived ids to the <path> elements of an SVG that is not rewritten by write_svg.
+
+    Args:
+        svg_text: SVG string
+
+    Returns:
+        SVG string with an id on every path that didn't have one
+    """
+    seen = {}
+
+    def add_id(match):
+        tag = match.group(0)
+        if re.search(r'\sid="', tag):
+            return tag
+        d = _attribute(tag, 'd') or ''
+        return '<path id="' + make_path_id(' '.join(d.split()), seen) + '"' + tag[len('<path'):]
+
+    return re.sub(r'<path\b[^>]*>', add_id, svg_text)
+
+
+def write_svg(document, precision=0, fold=False, path_ids=True):
+    """
+    Serialize a document as a compact, whitespace-free SVG.
+
+    Args:
+        document: Dict from parse_potrace_svg(), or a stroked document from
+            centerline.trace_centerlines() ('stroke' set and a 'stroke_width' per path)
+        precision: Number of decimals for coordinates (0 is lossless for Potrace's integer
+            coordinates; use 1 with fold=True to keep Potrace's 0.1px resolution)
+        fold: Fold the group's translate/scale into the coordinates
+        path_ids: Give every path a deterministic id derived from its geometry
+
+    Returns:
+        SVG string
+    """
+    if fold:
+        fold_transform(document)
+
+    svg_attrs = 'xmlns="http://www.w3.org/2000/svg" version="1.0"'
+    for name, value in (('width', document.get('width')), ('height', document.get('height'))):
+        if value:
+            svg_attrs += f' {name}="{_compact_length(value)}"'
+    if document.get('viewbox'):
+        svg_attrs += ' viewBox="' + ' '.join(_compact_float(v) for v in document['viewbox']) + '"'
+    svg_attrs += ' preserveAspectRatio="xMidYMid meet"'
+
+    if document.get('stroke'):
+        group_attrs = f'fill="none" stroke="{document["stroke"]}" stroke-linecap="round" stroke-linejoin="round"'
+    else:
+        group_attrs = f'fill="{document["fill"]}" stroke="none"'
+    if document.get('transform'):
+        sx, sy, tx, ty = document['transform']
+        transform = f'translate({_compact_float(tx)},{_compact_float(ty)}) scale({_compact_float(sx)},{_compact_float(sy)})'
+        group_attrs = f'transform="{transform}" ' + group_attrs
+    elif document.get('transform_attr'):
+        group_attrs = f'transform="{document["transform_attr"]}" ' + group_attrs # not foldable, keep as written
+
+    parts = [f'<svg {svg_attrs}><g {group_attrs}>']
+    seen_ids = {}
+    for path in document['paths']:
+        path_data = encode_path_data(path['subpaths'], precision)
+        attrs = f'd="{path_data}"'
+        if path.get('stroke_width') is not None:
+            attrs += f' stroke-width="{_compact_float(path["stroke_width"])}"'
+        if path_ids:
+            path['id'] = make_path_id(path_data, seen_ids) # kept on the document for structured outputs
+            attrs = f'id="{path["id"]}" ' + attrs
+        parts.append(f'<path {attrs}/>')
+    parts.append('</g></svg>')
+
+    return ''.join(parts)
+
+
+def _compact_float(value):
+    """'344.000000' -> '344', '0.5' -> '0.5'."""
+    text = f"{value:.6f}".rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+def _compact_length(value):
+    """Trim trailing zeros from a length attribute, keeping its unit ('344.000000pt' -> '344pt')."""
+    match = re.fullmatch(r'([-+]?[\d.]+)([a-z%]*)', value.strip())
+    if not match:
+        return value
+    return _compact_float(float(match.group(1))) + match.group(2)
@@ -1,29 +1,86 @@
 #!/usr/bin/env python3
 """
 Style-aware Potrace wrapper for converting line art PNG to editable SVG.
+Also traces centerlines (one stroked path per line) as an alternative to Potrace's filled outlines.
+The binarized line art stays a packed 1-bit buffer in memory: it is piped to the Potrace CLI
+(PBM on stdin, SVG on stdout) or traced in process with potracer, without temp files.
 """
 
 import os
 import time
 import json
+import shutil
 import subprocess
 from pathlib import Path
 import cv2
 
-from PIL import Image
-import numpy as np
+from bitmap import binarize
+from svg_writer import (
+    parse_potrace_svg, write_svg, assign_path_ids, encode_path_data, make_path_id,
+    compose_transforms, invert_transform, transform_subpaths
+)
+from path_list import build_path_list, encode_path_list
+from spatial_index import build_grid_index, encode_grid_index
+from centerline import trace_centerlines
+from path_optimizer import optimize_document
+import potracer_backend
+from cancellation import check as check_cancelled
+
+# 'outline' traces both sides of every stroke with Potrace (filled shapes),
+# 'centerline' traces the skeleton of the strokes (stroked open paths)
+TRACE_MODES = ('outline', 'centerline')
+
+# Outline tracers: the potrace CLI, potracer in process, or 'auto' (CLI if installed, else potracer)
+TRACE_BACKENDS = ('auto', 'cli', 'potracer')
 
 
 class LineArtVectorizer:
     """Converts line art images to SVG with style-specific optimization."""
     
-    def __init__(self):
-        """Initialize vectorizer with style configurations."""
+    def __init__(self, svg_options=None, optimize_options=None, backend='auto'):
+        """
+        Initialize vectorizer with style configurations.
+
+        Args:
+            svg_options: Overrides for the SVG writer settings in self.svg_options
+            optimize_options: Overrides for the path optimizer settings in self.optimize_options
+            backend: Outline tracer, 'cli', 'potracer' or 'auto'
+        """
+        if backend not in TRACE_BACKENDS:
+            raise ValueError(f"Invalid backend '{backend}'. Choose 'auto', 'cli' or 'potracer'.")
+        self.backend = backend
+
+        # SVG writer settings: Potrace's output is rewritten in compact form unless 'compact' is False
+        self.svg_options = {
+            'compact': True,
+            'precision': 0, # decimals kept; 0 is lossless for Potrace's integer coordinates (use 1 with fold_transform)
+            'fold_transform': False, # bake the group's translate/scale into the coordinates
+            'path_ids': True, # deterministic content-derived id on every path
+            'centerline_precision': 1 # centerline coordinates sit on pixel centres, so keep one decimal
+        }
+        if svg_options:
+            self.svg_options.update(svg_options)
+
+        # Post-trace path optimization (see path_optimizer.optimize_document), applied before the SVG is written.
+        # Distances are in pixels; culling and budgets are off by default. Not applied to raw (non-compact) output.
+        self.optimize_options = {
+            'enabled': True,
+            'line_tolerance': 0.25, # straighten curves / merge line runs that stay this close to a straight line
+            'min_area': 0.0, # drop shapes and holes smaller than this (px^2)
+            'min_length': 0.0, # drop centerline strokes shorter than this (px)
+            'max_paths': None, # path budget per drawing
+            'max_nodes': None # node budget per drawing
+        }
+        if optimize_options:
+            self.optimize_options.update(optimize_options)
         
         # Style-specific parameters
         self.style_configs = {
             'contour': {
-                # pixels darker than this become lines, lighter become background.
+                # 'otsu' picks the threshold per image; 'fixed' uses the threshold below
+                'threshold_strategy': 'otsu',
+
+                # pixels darker than this become lines, lighter become background (fixed strategy only).
                 'threshold': 128,
                 
                 # ignores any tiny specks smaller than 5 pixels.
@@ -33,17 +90,32 @@ class LineArtVectorizer:
                 'alphamax': 1.0,
                 
                 # how much the SVG can "stray" from the original pixels to stay smooth.
-                'opttolerance': 0.2
+                'opttolerance': 0.2,
+
+                # 'outline' (Potrace) or 'centerline' (skeleton, see centerline.py)
+                'trace_mode': 'outline',
+
+                # centerline only: simplification tolerance and shortest stroke kept, in pixels
+                'centerline_tolerance': 1.0,
+                'centerline_min_length': 4,
+
+                # centerline only: fit smooth curves through the simplified points
+                'centerline_smooth': True
             },
             'anime': {
+                'threshold_strategy': 'otsu',
                 'threshold': 180, # Anime line art often has thinner lines
                 'turdsize': 5,
                 'alphamax': 1.3,
-                'opttolerance': 0.4
+                'opttolerance': 0.4,
+                'trace_mode': 'outline',
+                'centerline_tolerance': 1.0,
+                'centerline_min_length': 4,
+                'centerline_smooth': True
             }
         }
     
-    def vectorize(self, input_path, output_path, style='contour'):
+    def vectorize(self, input_path, output_path, style='contour', trace_mode=None):
         """
         Convert line art PNG to SVG.
         
@@ -51,6 +123,7 @@ class LineArtVectorizer:
             input_path: Path to input line art PNG
             output_path: Path to save output SVG
             style: 'contour' or 'anime'
+            trace_mode: 'outline' or 'centerline' (default: the style's trace_mode)
             
         Returns:
             A dictionary with metrics and status:
@@ -73,41 +146,108 @@ class LineArtVectorizer:
         }
         
         try:
-            # Validate that style exists/is supported
-            if style not in self.style_configs:
-                raise ValueError(f"Invalid style '{style}'. Choose 'contour' or 'anime'.")
-            
             # Check that the image input file exists
             if not os.path.exists(input_path):
                 raise FileNotFoundError(f"Input image not found: {input_path}")
             
-            # Get style configuration
-            config = self.style_configs[style]
-            
-            # Preprocess to binary image in order to run Potrace (which expects a binary bitmap)
-            binary_path = self._preprocess_image(input_path, config['threshold'])
+            # Load image as grayscale and binarize it (Potrace expects a binary bitmap)
+            image_array = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
+            if image_array is None:
+                raise ValueError(f"Could not load image: {input_path}")
+            bitmap = binarize(image_array, self.threshold_for(style))
             
-            # run portrace to get the svg path
-            svg_path = self._run_potrace(binary_path, output_path, config) 
+            result = self.vectorize_bitmap(bitmap, output_path, style=style, trace_mode=trace_mode)
+            result['processing_time'] = time.time() - start_time # include loading and thresholding
             
-            # Calculate metrics from the generated svg file
-            path_count = self._count_paths(svg_path)
-            file_size = os.path.getsize(svg_path)
+        except Exception as e:
+            result['error'] = str(e)
+            result['processing_time'] = time.time() - start_time
+        
+        return result
+
+    def vectorize_bitmap(self, bitmap, output_path, style='contour', include_paths=False, trace_mode=None,
+                         include_index=False, cancel_token=None):
+        """
+        Convert an already binarized, packed line art bitmap to SVG.
+
+        Args:
+            bitmap: PackedBitmap (e.g. from LineArtGenerator.generate_array with a threshold)
+            output_path: Path to save output SVG
+            style: 'contour' or 'anime'
+            include_paths: Also return the structured path list (see path_list.encode_path_list)
+            trace_mode: 'outline' or 'centerline' (default: the style's trace_mode)
+            include_index: Also return the spatial index of path bounding boxes (see spatial_index.py)
+            cancel_token: CancellationToken; cancelling it kills a running Potrace subprocess
+
+        Returns:
+            Same dictionary as vectorize(), plus:
+                paths (dict): Encoded path list if include_paths, else None
+                index (dict): Encoded grid index if include_index, else None
+        """
+        start_time = time.time()
+
+        result = {
+            'success': False,
+            'output_path': None,
+            'paths': None,
+            'index': None,
+            'metrics': None,
+            'processing_time': 0.0,
+            'error': None
+        }
+
+        try:
+            trace_start = time.time()
+            raw_svg, document, trace_mode, backend, precision = self._trace(bitmap, style, trace_mode, cancel_token)
+            trace_time = time.time() - trace_start
+
+            # Optimize and write compact path data (and path ids)
+            serialize_start = time.time()
+            svg_text, document, optimization = self._build_svg(
+                raw_svg, document, precision, include_paths=include_paths or include_index
+            )
+
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            with open(output_path, 'w') as f:
+                f.write(svg_text)
+            serialize_time = time.time() - serialize_start
             
-            # Cleanup temp file
-            try:
-                os.remove(binary_path)
-            except:
-                pass
+            # Calculate metrics from the generated svg
+            path_count = svg_text.count('<path') # count how many path start tags there are
+            file_size = len(svg_text.encode('utf-8'))
+            raw_size = len(raw_svg.encode('utf-8')) if raw_svg is not None else file_size
             
             # Save results
             result['success'] = True
-            result['output_path'] = svg_path
+            result['output_path'] = output_path
             result['metrics'] = {
                 'path_count': path_count,
                 'file_size_bytes': file_size,
-                'file_size_kb': round(file_size / 1024, 2)
+                'file_size_kb': round(file_size / 1024, 2),
+                'raw_size_bytes': raw_size,
+                'bytes_saved': raw_size - file_size,
+                'path_ids': self.svg_options['path_ids'],
+                'threshold': bitmap.threshold,
+                'bitmap_bytes': bitmap.nbytes,
+                'trace_mode': trace_mode,
+                'backend': backend,
+                'optimization': optimization,
+                'trace_time': trace_time, # Potrace / centerline tracing
+                'serialize_time': serialize_time # optimization, path data encoding and the file write
             }
+
+            # Structured per-path geometry and bounding box index in viewBox coordinates
+            if include_paths or include_index:
+                viewbox = document['viewbox'] or [0, 0, bitmap.width, bitmap.height]
+                path_list = build_path_list(document)
+                if include_paths:
+                    result['paths'] = encode_path_list(path_list, width=viewbox[2], height=viewbox[3])
+                if include_index:
+                    index = build_grid_index(
+                        [path['id'] for path in path_list], [path['bbox'] for path in path_list],
+                        width=viewbox[2], height=viewbox[3]
+                    )
+                    result['index'] = encode_grid_index(index, width=viewbox[2], height=viewbox[3])
             result['processing_time'] = time.time() - start_time
             
         except Exception as e:
@@ -115,81 +255,296 @@ class LineArtVectorizer:
             result['processing_time'] = time.time() - start_time
         
         return result
-    
-    def _preprocess_image(self, input_path, threshold):
+
+    def trace_region(self, bitmap, style, placement, canvas_size, region, trace_mode=None, cancel_token=None):
         """
-        Convert image to binary using Otsu's thresholding.
+        Trace the line art of one region of a drawing and return only the paths inside the region,
+        in the coordinates of the full drawing, ready to replace that region's paths.
 
         Args:
-            input_path: Path to input image
-            threshold: Ignored (kept for API compatibility); Otsu computes optimal threshold automatically
+            bitmap: PackedBitmap of the region's line art (may be rendered at a different scale than the drawing)
+            style: 'contour' or 'anime'
+            placement: (scale_x, scale_y, offset_x, offset_y) mapping bitmap pixels to drawing viewBox pixels
+            canvas_size: (width, height) of the full drawing's viewBox
+            region: [min_x, min_y, max_x, max_y] in drawing viewBox pixels; paths not entirely inside are dropped
+            trace_mode: 'outline' or 'centerline' (default: the style's trace_mode)
+            cancel_token: CancellationToken; cancelling it kills a running Potrace subprocess
 
         Returns:
-            Path to binary PBM file
+            dictionary with:
+                success (bool): Whether tracing succeeded
+                paths (list): Dicts with id, d, bbox (drawing viewBox pixels) and stroke_width (centerline only)
+                metrics (dict): path_count, traced_path_count, trace_mode, backend, optimization
+                processing_time (float): Time in seconds
+                error (str): Error message if failed
         """
-        # Load image as grayscale
-        image_array = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
+        start_time = time.time()
+
+        result = {
+            'success': False,
+            'paths': None,
+            'metrics': None,
+            'processing_time': 0.0,
+            'error': None
+        }
 
-        # Apply Otsu's thresholding (automatically determines optimal threshold for doing binary segmentation)
-        _, binary = cv2.threshold(image_array, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        try:
+            raw_svg, document, trace_mode, backend, precision = self._trace(bitmap, style, trace_mode, cancel_token)
+            if document is None:
+                document = parse_potrace_svg(raw_svg)
+            optimization = self._optimize(document)
 
-        # Convert to PIL image
-        binary_image = Image.fromarray(binary)
-        
-        # Save as PBM (Potrace's preferred format)
-        temp_path = input_path + '_temp.pbm'
-        binary_image.save(temp_path)
-        
-        return temp_path
+            # document units -> region bitmap pixels -> drawing viewBox pixels
+            to_canvas = compose_transforms(placement, document['transform'] or (1.0, 1.0, 0.0, 0.0))
+
+            # same coordinate system as the drawing's own paths: Potrace's translate(0,H) scale(0.1,-0.1)
+            # for the full height, or plain viewBox pixels when transforms are folded (and for centerlines)
+            if document['transform'] is None or self.svg_options['fold_transform']:
+                target = None
+                to_drawing = to_canvas
+            else:
+                sx, sy, _, _ = document['transform']
+                target = (sx, sy, 0.0, float(canvas_size[1]))
+                to_drawing = compose_transforms(invert_transform(target), to_canvas)
+
+            min_x, min_y, max_x, max_y = region
+            paths = []
+            seen_ids = {}
+            path_list = build_path_list(document) # bounding boxes in bitmap pixels
+
+            for path, listed in zip(document['paths'], path_list):
+                x0, y0, x1, y1 = listed['bbox']
+                bbox = [
+                    placement[0] * x0 + placement[2], placement[1] * y0 + placement[3],
+                    placement[0] * x1 + placement[2], placement[1] * y1 + placement[3]
+                ]
+                # paths crossing the region's edge continue outside it, where the drawing keeps its own paths
+                if bbox[0] < min_x or bbox[1] < min_y or bbox[2] > max_x or bbox[3] > max_y:
+                    continue
+
+                path_data = encode_path_data(transform_subpaths(path['subpaths'], to_drawing), precision)
+                entry = {
+                    'id': make_path_id(path_data, seen_ids),
+                    'd': path_data,
+                    'bbox': [round(v, 2) for v in bbox]
+                }
+                if path.get('stroke_width') is not None:
+                    # centerline widths are in bitmap pixels, the region may be rendered at another scale
+                    entry['stroke_width'] = round(path['stroke_width'] * placement[0], 2)
+                paths.append(entry)
+
+            result['success'] = True
+            result['paths'] = paths
+            result['metrics'] = {
+                'path_count': len(paths),
+                'traced_path_count': len(document['paths']),
+                'trace_mode': trace_mode,
+                'backend': backend,
+                'optimization': optimization
+            }
+            result['processing_time'] = time.time() - start_time
+
+        except Exception as e:
+            result['error'] = str(e)
+            result['processing_time'] = time.time() - start_time
+
+        return result
+
+    def resolve_backend(self):
+        """
+        Outline tracer to use.
+
+        Returns:
+            'cli' or 'potracer'
+        """
+        if self.backend != 'auto':
+            return self.backend
+        if shutil.which('potrace') is None and potracer_backend.available():
+            return 'potracer'
+        return 'cli'
+    
+    def threshold_for(self, style):
+        """
+        Threshold setting to binarize line art for a style.
+
+        Args:
+            style: 'contour' or 'anime'
+
+        Returns:
+            'otsu' or a fixed grey level
+        """
+        if style not in self.style_configs:
+            raise ValueError(f"Invalid style '{style}'. Choose 'contour' or 'anime'.")
+
+        config = self.style_configs[style]
+        if config.get('threshold_strategy', 'otsu') == 'otsu':
+            return 'otsu'
+        return config['threshold']
     
-    def _run_potrace(self, pbm_path, output_path, config):
+    def _trace(self, bitmap, style, trace_mode=None, cancel_token=None):
         """
-        Run Potrace command-line tool.
+        Trace a bitmap with the style's settings.
+
+        Args:
+            bitmap: PackedBitmap of the line art
+            style: 'contour' or 'anime'
+            trace_mode: 'outline' or 'centerline' (default: the style's trace_mode)
+            cancel_token: CancellationToken checked before tracing and passed to the Potrace subprocess
+
+        Returns:
+            tuple: (raw SVG from the Potrace CLI or None, document dict or None for CLI output,
+            trace mode, backend (None for centerlines), coordinate precision)
+        """
+        # Validate that style exists/is supported
+        if style not in self.style_configs:
+            raise ValueError(f"Invalid style '{style}'. Choose 'contour' or 'anime'.")
+
+        # Get style configuration
+        config = self.style_configs[style]
+
+        trace_mode = trace_mode or config.get('trace_mode', 'outline')
+        if trace_mode not in TRACE_MODES:
+            raise ValueError(f"Invalid trace mode '{trace_mode}'. Choose 'outline' or 'centerline'.")
+
+        # the in-process tracers can't be interrupted, so this is their last chance to stop
+        check_cancelled(cancel_token, 'tracing')
+
+        if trace_mode == 'centerline':
+            # skeleton tracing builds the document directly, there is no raw Potrace output
+            document = self._trace_centerline(bitmap, config)
+            return None, document, trace_mode, None, self.svg_options['centerline_precision']
+
+        precision = self.svg_options['precision']
+        backend = self.resolve_backend()
+        if backend == 'potracer':
+            document = potracer_backend.trace_bitmap(
+                bitmap,
+                turdsize=config['turdsize'],
+                alphamax=config['alphamax'],
+                opttolerance=config['opttolerance']
+            )
+            return None, document, trace_mode, backend, precision
+
+        # packed bits go to Potrace on stdin, the SVG comes back on stdout
+        return self._run_potrace(bitmap, config, cancel_token), None, trace_mode, backend, precision
+
+    def _run_potrace(self, bitmap, config, cancel_token=None):
+        """
+        Run Potrace command-line tool on a packed bitmap through pipes.
         
         Args:
-            pbm_path: Path to binary PBM file
-            output_path: Path to save SVG
+            bitmap: PackedBitmap of the line art (sent as PBM on stdin)
             config: Style configuration dict
+            cancel_token: CancellationToken; the process is killed when it is cancelled or its deadline passes
             
         Returns:
-            Path to generated SVG
+            SVG text written by Potrace
+
+        Raises:
+            Cancelled: The process was killed through cancel_token
         """
-        # Create output directory if needed
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        # Build Potrace command
+        # Build Potrace command ('-' reads the bitmap from stdin, '-o -' writes the SVG to stdout)
         cmd = [
             'potrace',
-            pbm_path,
+            '-',
             '-s',  # SVG output
-            '-o', output_path,
+            '-o', '-',
             '--turdsize', str(config['turdsize']),
             '--alphamax', str(config['alphamax']),
             '--opttolerance', str(config['opttolerance'])
         ]
         
         # Run Potrace
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        unregister = cancel_token.on_cancel(process.kill) if cancel_token is not None else None
+
+        try:
+            # the deadline bounds the wait; an explicit cancel kills the process from the callback
+            stdout, stderr = process.communicate(
+                bitmap.to_pbm(), timeout=cancel_token.remaining() if cancel_token is not None else None
+            )
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            cancel_token.check('potrace') # the deadline has passed, so this raises
+            raise
+        finally:
+            if unregister is not None:
+                unregister()
+
+        check_cancelled(cancel_token, 'potrace')
         
-        if result.returncode != 0:
-            raise RuntimeError(f"Potrace failed: {result.stderr}")
+        if process.returncode != 0:
+            raise RuntimeError(f"Potrace failed: {stderr.decode('utf-8', errors='replace')}")
         
-        return output_path
-    
-    def _count_paths(self, svg_path):
+        return stdout.decode('utf-8')
+
+    def _trace_centerline(self, bitmap, config):
         """
-        Count number of paths in SVG.
+        Trace stroke centerlines.
         
         Args:
-            svg_path: Path to SVG file
+            bitmap: PackedBitmap of the line art
+            config: Style configuration dict
             
         Returns:
-            Number of path elements
+            Document dict from centerline.trace_centerlines
+        """
+        return trace_centerlines(
+            bitmap.unpack(),
+            tolerance=config['centerline_tolerance'],
+            min_length=config['centerline_min_length'],
+            smooth=config['centerline_smooth']
+        )
+
+    def _build_svg(self, raw_svg, document, precision, include_paths=False):
+        """
+        Final SVG text: optimized, compact path data and/or path ids, as configured in self.svg_options.
+        
+        Args:
+            raw_svg: SVG written by the Potrace CLI, or None if the document was traced in process
+            document: Document dict traced in process (None for CLI output)
+            precision: Decimals kept in path coordinates
+            include_paths: Also return the parsed document for structured outputs
+            
+        Returns:
+            tuple: (SVG text, document dict or None, optimization stats or None)
+        """
+        options = self.svg_options
+
+        if document is None:
+            if not options['compact']:
+                # raw Potrace output, only ids added
+                svg_text = assign_path_ids(raw_svg) if options['path_ids'] else raw_svg
+                document = parse_potrace_svg(svg_text) if include_paths else None # picks up the ids just assigned
+                return svg_text, document, None
+
+            document = parse_potrace_svg(raw_svg)
+
+        optimization = self._optimize(document)
+        svg_text = write_svg(
+            document,
+            precision=precision,
+            fold=options['fold_transform'],
+            path_ids=options['path_ids']
+        )
+
+        return svg_text, document, optimization
+
+    def _optimize(self, document):
         """
-        with open(svg_path, 'r') as f:
-            content = f.read()
+        Run the path optimizer on a document in place, if enabled.
         
-        return content.count('<path') # count how many path start tags there are
+        Args:
+            document: Document dict
+            
+        Returns:
+            Stats dict from path_optimizer.optimize_document, or None if disabled
+        """
+        options = dict(self.optimize_options)
+        if not options.pop('enabled'):
+            return None
+        return optimize_document(document, **options)
 
 
 def main():
@@ -214,11 +569,44 @@ def main():
         help='Line art style (default: contour)'
     )
     
+    parser.add_argument(
+        '--trace-mode',
+        choices=list(TRACE_MODES),
+        default=None,
+        help='Trace stroke outlines (Potrace) or centerlines (default: the style\'s mode, outline)'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=list(TRACE_BACKENDS),
+        default='auto',
+        help='Outline tracer: potrace CLI, potracer in process, or auto (default: auto)'
+    )
+    parser.add_argument(
+        '--precision',
+        type=int,
+        default=0,
+        help='Decimals kept in path coordinates (default: 0)'
+    )
+    parser.add_argument(
+        '--fold-transform',
+        action='store_true',
+        help='Bake the scale/flip transform into the path coordinates'
+    )
+    parser.add_argument(
+        '--raw-svg',
+        action='store_true',
+        help='Keep Potrace\'s SVG output as-is'
+    )
+    
     args = parser.parse_args()
     
     # Vectorize
-    vectorizer = LineArtVectorizer()
-    result = vectorizer.vectorize(args.input, args.output, style=args.style)
+    vectorizer = LineArtVectorizer(svg_options={
+        'compact': not args.raw_svg,
+        'precision': args.precision,
+        'fold_transform': args.fold_transform
+    }, backend=args.backend)
+    result = vectorizer.vectorize(args.input, args.output, style=args.style, trace_mode=args.trace_mode)
     
     # Print result
     print(json.dumps(result, indent=2))
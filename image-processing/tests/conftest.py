@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the service modules are flat scripts, imported the way api.py imports them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
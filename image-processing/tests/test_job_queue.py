@@ -0,0 +1,138 @@
+"""Durable job queue (job_queue.py): leases, retries, shutdown release and recovery after a restart."""
+
+import time
+
+import pytest
+
+from job_queue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+
+SPEC = {'styles': ['contour'], 'quality': 'fast'}
+LEASE_S = 0.2
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / 'jobs.db'
+
+
+@pytest.fixture
+def jobs(db_path):
+    job_queue = JobQueue(db_path, lease_s=LEASE_S, max_attempts=3)
+    yield job_queue
+    job_queue.close()
+
+
+def test_claim_returns_the_job(jobs):
+    jobs.enqueue('job-1', b'image', SPEC, 'http://receiver/cb')
+    job = jobs.claim('worker-a')
+    assert job == {'id': 'job-1', 'payload': b'image', 'spec': SPEC, 'callback_url': 'http://receiver/cb', 'attempts': 1}
+    assert jobs.get('job-1')['state'] == RUNNING
+    assert jobs.claim('worker-b') is None # still leased
+
+
+def test_expired_lease_is_reclaimed(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    jobs.claim('worker-a')
+    time.sleep(LEASE_S * 1.5)
+
+    job = jobs.claim('worker-b')
+    assert job['id'] == 'job-1'
+    assert job['attempts'] == 2
+
+
+def test_heartbeat_keeps_the_lease(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    jobs.claim('worker-a')
+    for _ in range(3):
+        time.sleep(LEASE_S / 2)
+        assert jobs.heartbeat('job-1', 'worker-a')
+    assert jobs.claim('worker-b') is None
+
+
+def test_stale_worker_loses_the_job(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    jobs.claim('worker-a')
+    time.sleep(LEASE_S * 1.5)
+    jobs.claim('worker-b')
+
+    assert not jobs.heartbeat('job-1', 'worker-a')
+    assert jobs.complete('job-1', 'worker-a', {'status': 'complete'}) is None
+    assert jobs.fail('job-1', 'worker-a', {'status': 'failed'}, retry_in=0) is None
+    assert jobs.complete('job-1', 'worker-b', {'status': 'complete'}) == DONE
+    assert jobs.get('job-1')['result'] == {'status': 'complete'}
+
+
+def test_failed_attempts_are_retried_until_max_attempts(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    for attempt in (1, 2):
+        job = jobs.claim('worker-a')
+        assert job['attempts'] == attempt
+        assert jobs.fail('job-1', 'worker-a', {'status_code': 500}, retry_in=0) == QUEUED
+
+    assert jobs.claim('worker-a')['attempts'] == 3
+    assert jobs.fail('job-1', 'worker-a', {'status_code': 500}, retry_in=0) == FAILED
+    job = jobs.get('job-1')
+    assert job['state'] == FAILED
+    assert job['result'] == {'status_code': 500}
+    assert jobs.claim('worker-a') is None
+
+
+def test_retry_waits_for_its_backoff(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    jobs.claim('worker-a')
+    assert jobs.fail('job-1', 'worker-a', {'status_code': 500}, retry_in=LEASE_S) == QUEUED
+    assert jobs.claim('worker-a') is None
+    time.sleep(LEASE_S * 1.5)
+    assert jobs.claim('worker-a')['id'] == 'job-1'
+
+
+def test_final_failure_is_not_retried(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    jobs.claim('worker-a')
+    assert jobs.fail('job-1', 'worker-a', {'status_code': 422}) == FAILED
+    assert jobs.get('job-1')['attempts'] == 1
+
+
+def test_shed_attempts_are_not_counted(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    for _ in range(5):
+        job = jobs.claim('worker-a')
+        assert job['attempts'] == 1
+        assert jobs.fail('job-1', 'worker-a', {'status_code': 429}, retry_in=0, count_attempt=False) == QUEUED
+    assert jobs.get('job-1')['attempts'] == 0
+
+
+def test_release_gives_back_the_attempt(jobs):
+    jobs.enqueue('job-1', b'image', SPEC)
+    jobs.enqueue('job-2', b'image', SPEC)
+    jobs.claim('worker-a')
+    jobs.claim('worker-b')
+
+    assert jobs.release('worker-a') == 1
+    job = jobs.get('job-1')
+    assert (job['state'], job['attempts']) == (QUEUED, 0)
+    assert jobs.get('job-2')['state'] == RUNNING # another worker's job is left alone
+
+    job = jobs.claim('worker-c') # no lease to wait out
+    assert (job['id'], job['attempts']) == ('job-1', 1)
+
+
+def test_unnotified_survives_a_restart(db_path):
+    jobs = JobQueue(db_path, lease_s=LEASE_S)
+    for job_id in ('sent', 'unsent', 'no-callback'):
+        jobs.enqueue(job_id, b'image', SPEC, None if job_id == 'no-callback' else f'http://receiver/{job_id}')
+        jobs.claim('worker-a')
+        jobs.complete(job_id, 'worker-a', {'request_id': job_id})
+    jobs.enqueue('running', b'image', SPEC, 'http://receiver/running')
+    jobs.claim('worker-a')
+    jobs.mark_notified('sent')
+    jobs.close()
+
+    reopened = JobQueue(db_path, lease_s=LEASE_S)
+    try:
+        assert reopened.unnotified() == [
+            {'id': 'unsent', 'callback_url': 'http://receiver/unsent', 'result': {'request_id': 'unsent'}}
+        ]
+        assert reopened.get_stats() == {QUEUED: 0, RUNNING: 1, DONE: 3, FAILED: 0, 'pending_writes': 0}
+    finally:
+        reopened.close()
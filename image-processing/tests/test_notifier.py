@@ -0,0 +1,204 @@
+"""Completion callbacks (notifier.py) against local stand-in receivers: HTTP on loopback and a Unix socket."""
+
+import hmac
+import json
+import time
+import hashlib
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import notifier
+from notifier import CallbackNotifier, parse_target
+
+LOOPBACK = {'127.0.0.1'}
+
+
+class Receiver(BaseHTTPRequestHandler):
+    """Records every callback and answers with the server's scripted responses (then 204)."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append({'time': time.monotonic(), 'path': self.path, 'headers': dict(self.headers), 'body': body})
+        status, headers = self.server.responses.pop(0) if self.server.responses else (204, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def address_string(self):
+        return 'receiver' # Unix socket peers have no (host, port)
+
+    def log_message(self, *args):
+        pass
+
+
+class UnixReceiverServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def start(server, responses):
+    server.received = []
+    server.responses = list(responses)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def http_receiver():
+    servers = []
+
+    def make(*responses):
+        servers.append(start(ThreadingHTTPServer(('127.0.0.1', 0), Receiver), responses))
+        return servers[-1]
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def unix_receiver(tmp_path):
+    server = start(UnixReceiverServer(str(tmp_path / 'callbacks.sock'), Receiver), ())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url_of(server, path='/callbacks/svg'):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def send(sender, url, payload, timeout=10):
+    """Queue one callback and wait for its outcome: (delivered, attempts, error)."""
+    done = threading.Event()
+    outcome = []
+
+    def on_done(*result):
+        outcome.append(result)
+        done.set()
+
+    sender.notify(url, payload, on_done=on_done)
+    assert done.wait(timeout), "callback was neither delivered nor given up on"
+    return outcome[0]
+
+
+def test_delivers_json_payload_over_http(http_receiver):
+    receiver = http_receiver()
+    sender = CallbackNotifier(allowed_hosts=LOOPBACK)
+    payload = {'request_id': 'abc', 'status': 'complete', 'data': {'svg': '<svg/>'}}
+
+    assert send(sender, url_of(receiver, '/callbacks/svg?source=test'), payload) == (True, 1, None)
+
+    [request] = receiver.received
+    assert request['path'] == '/callbacks/svg?source=test'
+    assert request['headers']['Content-Type'] == 'application/json'
+    assert json.loads(request['body']) == payload
+    assert sender.get_stats() == {'delivered': 1, 'failed': 0, 'retries': 0, 'pending': 0}
+
+
+def test_delivers_over_unix_socket(unix_receiver, tmp_path):
+    sender = CallbackNotifier(socket_dir=str(tmp_path))
+    socket_path = str(tmp_path / 'callbacks.sock').replace('/', '%2F')
+
+    assert send(sender, f"http+unix://{socket_path}/callbacks/svg", {'request_id': 'abc'}) == (True, 1, None)
+    [request] = unix_receiver.received
+    assert request['path'] == '/callbacks/svg'
+    assert json.loads(request['body']) == {'request_id': 'abc'}
+
+
+def test_retries_after_503_honouring_retry_after(http_receiver):
+    receiver = http_receiver((503, {'Retry-After': '2'}))
+    sender = CallbackNotifier(allowed_hosts=LOOPBACK)
+
+    assert send(sender, url_of(receiver), {'request_id': 'abc'}) == (True, 2, None)
+
+    first, second = receiver.received
+    assert second['time'] - first['time'] >= 1.9 # waited as asked, not the ~1s jittered backoff
+    assert first['body'] == second['body']
+    assert sender.get_stats()['retries'] == 1
+
+
+def test_gives_up_after_max_attempts(http_receiver, monkeypatch):
+    monkeypatch.setattr(notifier, 'BACKOFF_BASE_S', 0.01)
+    receiver = http_receiver(*[(500, {})] * 5)
+    sender = CallbackNotifier(max_attempts=3, allowed_hosts=LOOPBACK)
+
+    delivered, attempts, error = send(sender, url_of(receiver), {'request_id': 'abc'})
+
+    assert (delivered, attempts) == (False, 3)
+    assert '500' in error
+    assert len(receiver.received) == 3
+    assert sender.get_stats() == {'delivered': 0, 'failed': 1, 'retries': 2, 'pending': 0}
+
+
+def test_client_error_is_not_retried(http_receiver):
+    receiver = http_receiver((400, {}))
+    sender = CallbackNotifier(allowed_hosts=LOOPBACK)
+
+    assert send(sender, url_of(receiver), {'request_id': 'abc'})[:2] == (False, 1)
+    assert len(receiver.received) == 1
+
+
+def test_signs_body_with_hmac(http_receiver):
+    receiver = http_receiver()
+    sender = CallbackNotifier(secret='s3cret', allowed_hosts=LOOPBACK)
+
+    send(sender, url_of(receiver), {'request_id': 'abc', 'status': 'complete'})
+
+    [request] = receiver.received
+    expected = hmac.new(b's3cret', request['body'], hashlib.sha256).hexdigest()
+    assert request['headers']['X-Signature'] == f"sha256={expected}"
+
+
+def test_unsigned_without_secret(http_receiver):
+    receiver = http_receiver()
+    send(CallbackNotifier(allowed_hosts=LOOPBACK), url_of(receiver), {'request_id': 'abc'})
+    assert 'X-Signature' not in receiver.received[0]['headers']
+
+
+def test_policy_is_checked_again_when_sending(http_receiver):
+    receiver = http_receiver()
+    sender = CallbackNotifier() # no allow-list: loopback is off limits
+
+    delivered, attempts, error = send(sender, url_of(receiver), {'request_id': 'abc'})
+
+    assert (delivered, attempts) == (False, 1)
+    assert 'non-public' in error
+    assert receiver.received == []
+
+
+@pytest.mark.parametrize('url, options', [
+    ('ftp://example.com/callbacks', {}),
+    ('http:///callbacks', {}),
+    ('https://evil.example/callbacks', {'allowed_hosts': {'localhost'}}),
+    ('http://127.0.0.1:3000/callbacks', {}),
+    ('http://localhost/callbacks', {}),
+    ('http://10.1.2.3/callbacks', {}),
+    ('http://192.168.0.10/callbacks', {}),
+    ('http://169.254.169.254/latest/meta-data', {}),
+    ('http://[::1]/callbacks', {}),
+    ('http://[::ffff:127.0.0.1]/callbacks', {}),
+    ('http://0.0.0.0/callbacks', {}),
+    ('http+unix://%2Fvar%2Frun%2Fdocker.sock/containers/json', {}),
+    ('http+unix://%2Fvar%2Frun%2Fdocker.sock/containers/json', {'socket_dir': '/run/app'}),
+    ('http+unix://%2Frun%2Fapp%2F..%2Fdocker.sock/containers/json', {'socket_dir': '/run/app'}),
+    ('http+unix:///callbacks', {'socket_dir': '/run/app'}),
+])
+def test_parse_target_rejects(url, options):
+    with pytest.raises(ValueError):
+        parse_target(url, **options)
+
+
+def test_parse_target_accepts_allowed_targets():
+    listed = parse_target('http://localhost:3000/callbacks?x=1', allowed_hosts={'localhost'})
+    assert (listed['host'], listed['port'], listed['path'], listed['address']) == ('localhost', 3000, '/callbacks?x=1', None)
+
+    public = parse_target('https://8.8.8.8/callbacks')
+    assert public['address'] == '8.8.8.8' # the checked address is the one connected to
+
+    unix = parse_target('http+unix://%2Frun%2Fapp%2Fnode.sock/callbacks', socket_dir='/run/app')
+    assert (unix['socket_path'], unix['path']) == ('/run/app/node.sock', '/callbacks')
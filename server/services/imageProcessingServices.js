@@ -3,6 +3,8 @@ const path = require('path'); // module for handling file paths
 
 const FASTAPI_URL = process.env.FASTAPI_URL || 'http://localhost:8000';
 const FASTAPI_TIMEOUT_MS = 60000; // timeout for FastAPI requests after 60 seconds
+const BUSY_RETRIES = 3; // retries when FastAPI sheds load (429/503 with Retry-After)
+const MAX_RETRY_AFTER_MS = 30000; // never wait longer than this between retries
 
 async function processImage(imagePath, style) {
     // Make sure the image file exists before trying to read it
@@ -23,25 +25,42 @@ async function processImage(imagePath, style) {
     form.append('file', blob, path.basename(imagePath));
     form.append('style', style);
     form.append('skip_preprocess', 'false');
-
-    // Use AbortController to implement a timeout for the fetch request to FastAPI
-    const controller = new AbortController();
-    const timeout = setTimeout(() => controller.abort(), FASTAPI_TIMEOUT_MS);
+    form.append('stream', 'true'); // SVG comes back as the raw body (gzip/br, decoded by fetch) with metadata in headers
 
     let response;
-    try {
-        response = await fetch(`${FASTAPI_URL}/generate-svg`, {
-            method: 'POST',
-            body: form,
-            signal: controller.signal
-        });
-    } catch (error) {
-        if (error.name === 'AbortError') {
-            throw new Error('FastAPI request timed out after 60s');
+    for (let attempt = 0; ; attempt++) {
+        // Use AbortController to implement a timeout for the fetch request to FastAPI
+        const controller = new AbortController();
+        const timeout = setTimeout(() => controller.abort(), FASTAPI_TIMEOUT_MS);
+
+        try {
+            response = await fetch(`${FASTAPI_URL}/generate-svg`, {
+                method: 'POST',
+                body: form,
+                headers: {
+                    'Accept-Encoding': 'br, gzip',
+                    // FastAPI stops the pipeline once this budget is spent instead of finishing for nobody
+                    'X-Request-Timeout-Ms': String(FASTAPI_TIMEOUT_MS)
+                },
+                signal: controller.signal
+            });
+        } catch (error) {
+            if (error.name === 'AbortError') {
+                throw new Error('FastAPI request timed out after 60s');
+            }
+            throw new Error(`FastAPI unreachable: ${error.message}`);
+        } finally {
+            clearTimeout(timeout);
         }
-        throw new Error(`FastAPI unreachable: ${error.message}`);
-    } finally {
-        clearTimeout(timeout);
+
+        // FastAPI is at capacity: wait as long as it asks and try again
+        if ((response.status === 429 || response.status === 503) && attempt < BUSY_RETRIES) {
+            const retryAfterMs = (parseInt(response.headers.get('retry-after'), 10) || 1) * 1000;
+            await response.arrayBuffer(); // release the connection
+            await new Promise(resolve => setTimeout(resolve, Math.min(retryAfterMs, MAX_RETRY_AFTER_MS)));
+            continue;
+        }
+        break;
     }
 
     if (!response.ok) {
@@ -49,17 +68,25 @@ async function processImage(imagePath, style) {
         throw new Error(`FastAPI returned ${response.status}: ${text.slice(0, 200)}`);
     }
 
-    const result = await response.json();
-
-    if (!result.success) {
-        throw new Error(result.error?.message || 'FastAPI processing failed');
-    }
+    const svg = await response.text();
 
     return {
-        svg: result.data.svg,
-        warnings: result.analysis?.warnings ?? [],
-        metrics: result.analysis?.metrics ?? {}
+        svg,
+        pathIds: response.headers.get('x-path-ids') === 'true', // paths already carry stable ids from the vectorizer
+        warnings: parseJsonHeader(response, 'x-warnings', []),
+        metrics: parseJsonHeader(response, 'x-metrics', {})
     };
 }
 
+// Metadata of streamed SVG responses is sent as JSON in X- headers
+function parseJsonHeader(response, name, fallback) {
+    const value = response.headers.get(name);
+    if (!value) return fallback;
+    try {
+        return JSON.parse(value);
+    } catch {
+        return fallback;
+    }
+}
+
 module.exports = processImage;
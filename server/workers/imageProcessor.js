@@ -47,8 +47,8 @@ async function handleJob(drawing) {
             return;
         }
 
-        // Process SVG
-        const processedSVG = addPathIds(svgResult.svg);
+        // Process SVG (skip the DOM pass when the vectorizer already assigned path ids)
+        const processedSVG = svgResult.pathIds ? svgResult.svg : addPathIds(svgResult.svg);
     
         // Convert string to stream for GridFS storage
         const svgStream = Readable.from([processedSVG]);